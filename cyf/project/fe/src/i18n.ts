@@ -205,6 +205,12 @@ const messages = {
       recommend: '推荐',
       allowNet: '允许联网',
       statusValid: '状态',
+      contextWindow: '上下文窗口',
+      contextWindowHint: '单位 token，超出时裁剪早期对话，0 为不裁剪',
+      imageMaxEdge: '图片长边上限',
+      imageMaxEdgeHint: '多模态图片缩放到该长边（像素），0 为不处理',
+      imageQuality: '图片压缩质量',
+      imageQualityHint: 'JPEG 质量 1-95，0 为默认 85',
       text: '文本',
       image: '图像',
       multimodal: '多模态',
@@ -258,11 +264,29 @@ const messages = {
       modelCache: '模型缓存',
       modelCount: '模型数量',
       expireIn: '过期剩余',
+      attachmentCache: '附件缓存',
+      hitRate: '命中率',
+      cacheEntries: '缓存条目',
+      cacheSize: '缓存大小',
+      imageSaved: '图片压缩节省',
+      responseCacheHitRate: '响应缓存命中率',
       databasePath: '数据库路径',
+      logPending: '待写日志',
+      logSpooled: '转存日志',
+      quotaUsage: '配额使用',
+      quotaQueued: '排队次数',
+      quotaRejected: '拒绝次数',
+      quotaKey: '用户 / 模型',
+      quotaInFlight: '进行中请求',
+      quotaTpm: '近一分钟 Token',
       apiHostStatus: 'API Host 状态',
       host: 'Host',
       blacklisted: '已拉黑',
+      halfOpen: '探测中',
       remainingSeconds: '剩余秒数',
+      latencyMs: '延迟(ms)',
+      errorRate: '错误率',
+      inFlight: '在途请求',
       status: '状态',
       selectedCount: '已选 {count} 项',
       batchRecommend: '批量设为推荐',
@@ -571,6 +595,12 @@ const messages = {
       recommend: 'Recommend',
       allowNet: 'Allow Network',
       statusValid: 'Status',
+      contextWindow: 'Context Window',
+      contextWindowHint: 'In tokens; older turns are trimmed beyond it, 0 to disable',
+      imageMaxEdge: 'Image Max Edge',
+      imageMaxEdgeHint: 'Downscale multimodal images to this longest edge (px), 0 to disable',
+      imageQuality: 'Image Quality',
+      imageQualityHint: 'JPEG quality 1-95, 0 for default 85',
       text: 'Text',
       image: 'Image',
       multimodal: 'Multimodal',
@@ -624,11 +654,29 @@ const messages = {
       modelCache: 'Model Cache',
       modelCount: 'Model Count',
       expireIn: 'Expires In',
+      attachmentCache: 'Attachment Cache',
+      hitRate: 'Hit Rate',
+      cacheEntries: 'Entries',
+      cacheSize: 'Size',
+      imageSaved: 'Image Bytes Saved',
+      responseCacheHitRate: 'Response Cache Hit Rate',
       databasePath: 'Database Path',
+      logPending: 'Pending Logs',
+      logSpooled: 'Spooled Logs',
+      quotaUsage: 'Quota Usage',
+      quotaQueued: 'Queued',
+      quotaRejected: 'Rejected',
+      quotaKey: 'User / Model',
+      quotaInFlight: 'In Flight',
+      quotaTpm: 'Tokens (last min)',
       apiHostStatus: 'API Host Status',
       host: 'Host',
       blacklisted: 'Blacklisted',
+      halfOpen: 'Probing',
       remainingSeconds: 'Remaining(s)',
+      latencyMs: 'Latency(ms)',
+      errorRate: 'Error Rate',
+      inFlight: 'In Flight',
       status: 'Status',
       selectedCount: '{count} selected',
       batchRecommend: 'Batch Recommend',
@@ -6,6 +6,7 @@
 然后从主库删除对应数据
 """
 
+import json
 import os
 import sys
 import shutil
@@ -18,7 +19,7 @@ import logging
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # 从sqlitelog导入数据模型
-from sqlitelog import Log, Dialog
+from sqlitelog import Log, Dialog, DialogMessage, get_dialog_messages
 
 # 配置日志
 logging.basicConfig(
@@ -35,6 +36,20 @@ conf.read('conf/conf.ini')
 MAIN_DB_PATH = conf['log']['sqlite3_file']
 BACKUP_DIR = 'backup'
 
+def build_archived_context(dialog):
+    """返回包含完整消息的 context JSON；消息尚未拆分存储的旧记录原样返回"""
+    messages = get_dialog_messages(dialog.id)
+    if not messages:
+        return dialog.context
+    try:
+        payload = json.loads(dialog.context) if dialog.context else {}
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    payload["context"] = messages
+    return json.dumps(payload, ensure_ascii=False)
+
 class ArchiveManager:
     def __init__(self):
         self.main_db = None
@@ -95,17 +110,23 @@ class ArchiveManager:
                 logger.info(f"发现 {dialog_count} 条需要归档的旧dialog记录")
                 
                 # 将数据复制到备份库
+                archived_dialog_ids = []
                 with self.backup_db.atomic():
                     for dialog in old_dialogs_query:
+                        # 逐条存储的消息合并回 context，备份库保持完整对话 JSON 格式
+                        context = build_archived_context(dialog)
                         # 使用INSERT语句直接插入到备份库
                         self.backup_db.execute_sql(
                             'INSERT INTO dialog (username, chattype, modelname, dialog_name, start_date, context) VALUES (?, ?, ?, ?, ?, ?)',
-                            (dialog.username, dialog.chattype, dialog.modelname, dialog.dialog_name, dialog.start_date, dialog.context)
+                            (dialog.username, dialog.chattype, dialog.modelname, dialog.dialog_name, dialog.start_date, context)
                         )
+                        archived_dialog_ids.append(dialog.id)
                         archived_dialogs += 1
                     
                     # 从主库删除已归档的记录
                     deleted_count = Dialog.delete().where(Dialog.start_date < cutoff_date).execute()
+                    for batch in chunked(archived_dialog_ids, 500):
+                        DialogMessage.delete().where(DialogMessage.dialog_id.in_(batch)).execute()
                     logger.info(f"已归档并删除 {deleted_count} 条dialog记录")
             
             # 2. 归档所有log记录
@@ -120,8 +141,8 @@ class ArchiveManager:
                     for log in all_logs_query:
                         # 使用INSERT语句直接插入到备份库
                         self.backup_db.execute_sql(
-                            'INSERT INTO log (username, modelname, usage, request_text) VALUES (?, ?, ?, ?)',
-                            (log.username, log.modelname, log.usage, log.request_text)
+                            'INSERT INTO log (username, modelname, usage, prompt_tokens, completion_tokens, request_text) VALUES (?, ?, ?, ?, ?, ?)',
+                            (log.username, log.modelname, log.usage, log.prompt_tokens, log.completion_tokens, log.request_text)
                         )
                         archived_logs += 1
                     
@@ -195,6 +216,7 @@ def main():
         # 设置模型使用主数据库
         Log._meta.database = archive_manager.main_db
         Dialog._meta.database = archive_manager.main_db
+        DialogMessage._meta.database = archive_manager.main_db
         
         # 获取归档前的统计信息
         logger.info("获取归档前数据库统计信息...")
@@ -1,9 +1,41 @@
-from flask import Flask, jsonify, request
+from tempfile import SpooledTemporaryFile
+
+from flask import Flask, Request, jsonify, request
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from conf.runtime import runtime_state
+
+
+# multipart 文件小于该大小时保存在内存，否则落到临时文件（与 werkzeug 默认一致）
+UPLOAD_SPOOL_MAX_MEMORY = 500 * 1024
+
+
+class SizeLimitedSpooledFile(SpooledTemporaryFile):
+    """按实际写入的字节数限制单个上传文件大小，超过时抛出 413。"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(max_size=UPLOAD_SPOOL_MAX_MEMORY, mode="rb+")
+        self.max_bytes = max_bytes
+        self.written_bytes = 0
+
+    def write(self, data):
+        self.written_bytes += len(data)
+        if self.written_bytes > self.max_bytes:
+            raise RequestEntityTooLarge()
+        return super().write(data)
+
+
+class UploadLimitedRequest(Request):
+    """werkzeug 解析 multipart 时即校验文件大小，chunked 上传没有 Content-Length 也会在超限时中止。"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SizeLimitedSpooledFile(runtime_state.settings.upload_max_bytes)
 
 
 def create_app() -> Flask:
     app = Flask(__name__, static_folder=None)
+    app.request_class = UploadLimitedRequest
     app.config["MAX_CONTENT_LENGTH"] = 52428800
     CORS(
         app,
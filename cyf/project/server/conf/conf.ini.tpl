@@ -1,5 +1,13 @@
 [common]
 upload_dir=
+# 上传文件对外链接为 http://<host>:<upload_url_port>/download/<文件名>（由 nginx 直接提供 upload_dir）
+# 服务端处理附件时识别这类链接并直接读取 upload_dir，不再经 nginx 回环下载
+upload_url_port=4567
+# 可选，限定识别的 host（逗号分隔），为空时只按端口和路径识别
+upload_url_hosts=
+# 单个上传文件大小上限（字节），解析请求体时超过即中止（包括没有 Content-Length 的分块上传）；
+# 内容按 SHA-256 只保存一份，链接文件名为 <哈希前缀>-<原始文件名>
+upload_max_bytes=20971520
 # 用户配置支持两种格式：
 # 1. 旧格式（一行）：users=admin:admin123:key,user1:password1
 # 2. 新格式（多行，YAML风格）：
@@ -16,6 +24,68 @@ test_ip_default_limit=20
 test_exceed_msg=异常123
 [log]
 sqlite3_file=
+# log.request_text / dialog.context / dialogmessage.content / dialogmessage.parts 的压缩算法：zlib、zstd（需安装 zstandard，未安装时回退 zlib）或 none
+# 旧数据无需迁移即可读取，存量数据可用 recompress_logs.py 重新压缩
+compress_codec=zlib
+# log.request_text 记录内容：full 保存完整响应，usage 只保存 id/模型/用量/结束原因等元数据
+request_text_mode=full
+# 调用日志后台批量写入：请求线程只入队，写线程按条数/时间间隔批量提交事务
+write_behind=true
+flush_batch_size=200
+flush_interval_ms=500
+# 队列上限；队列已满或写库失败时追加到 spool 文件（JSONL），写库恢复后及下次启动时自动补写
+queue_max_size=10000
+# 默认 server 目录下的 log_spool.jsonl
+spool_file=
+[rate_limit]
+# 可选：测试用户的进程内令牌桶，最多连续 test_burst 次，之后每分钟补充 test_per_minute 次，超出时返回 RATE_LIMITED；
+# 默认 0 不启用，测试额度仍只按 TestLimit 判断，额度用尽后由进程内缓存直接拒绝、不再访问数据库
+test_burst=0
+test_per_minute=0
+# 测试额度用尽后在进程内缓存该结论的时间（秒），期间不再访问数据库；后台修改测试限制时立即失效
+exhausted_ttl_seconds=60
+# 可选滑动窗口限流，格式 次数/秒数（如 30/60），为空不限制；计数按进程统计，多进程部署时总量约为进程数倍
+# 按用户、按客户端 IP、按模型（所有用户合计）
+user_window=
+ip_window=
+model_window=
+exceed_msg=请求过于频繁，请稍后再试
+[quota]
+# 每个用户、每个模型（所有用户合计）同时进行中的请求数上限，0 表示不限制；对话、流式对话和图片请求都计入
+user_max_in_flight=0
+model_max_in_flight=0
+# 每个用户、每个模型最近 60 秒内已消耗的 token 上限（tokens per minute），0 表示不限制
+user_tpm=0
+model_tpm=0
+# 超出配额时排队等待的最长时间（毫秒），0 表示直接拒绝；计数按进程统计
+queue_timeout_ms=0
+exceed_msg=当前请求过多，请稍后再试
+[response_cache]
+# 单轮对话响应缓存（需显式开启）：dialog_mode=single 且带 system_prompt_id 的非流式请求，
+# 模型、系统提示词与输入完全相同时跨用户复用上游响应，命中时不再调用上游
+enabled=false
+# 允许缓存的模型与系统提示词 id（逗号分隔），为空表示不限
+models=
+system_prompt_ids=
+# 使用个人 api_key 的用户默认不走缓存
+include_personal_keys=false
+ttl_seconds=3600
+# 内存 LRU 总大小与单条上限（字节）
+max_bytes=16777216
+max_entry_bytes=262144
+# 可选的 SQLite 磁盘层（responsecache 表），多进程共享且重启后保留
+disk=false
+disk_max_entries=10000
+[system_prompt]
+# 进程内系统提示词缓存时间（秒）；后台增删改时当前进程立即失效，其他进程最多延迟该时长
+cache_ttl_seconds=300
+[auth]
+access_token_ttl_seconds=1800
+refresh_token_ttl_seconds=604800
+# 进程内令牌校验缓存时间（秒），多进程部署下吊销令牌最多延迟该时长生效
+token_cache_ttl_seconds=60
+# 进程内用户信息（api_key/role/is_active）缓存时间（秒）
+user_context_ttl_seconds=30
 [quant]
 # 独立量化数据库。不要和 log.sqlite3_file 共用，避免被日志清理策略误伤。
 sqlite3_file=
@@ -37,6 +107,53 @@ api_host=
 usd_to_cny_rate=5
 # API parameter mode: 'default' for date strings, 'timestamp' for millisecond timestamps
 api_param_mode=default
+# 个人 api_key 客户端池容量（按 api_key + host 缓存 OpenAI 客户端，LRU 淘汰）
+client_pool_size=256
+# 所有上游客户端共享的 HTTP 连接池参数
+http_max_connections=200
+http_max_keepalive_connections=50
+http_keepalive_expiry=30
+# 上游 host 负载均衡：EWMA 平滑系数，连续失败多少次熔断，熔断时长（秒，重复熔断指数退避至上限）
+host_ewma_alpha=0.3
+host_breaker_failure_threshold=3
+host_breaker_open_seconds=30
+host_breaker_max_open_seconds=300
+# 上游失败（连接错误/429/5xx）时换 host 重试：最多尝试次数，单请求总截止时间（秒）
+# 流式请求只在首个 token 输出前重试
+failover_max_attempts=3
+request_deadline_seconds=120
+# 非流式对话合并：同一用户同时发起的完全相同请求（模型、消息、参数一致）只调用一次上游，共享结果
+single_flight=true
+# temperature=0 的确定性请求结果缓存时间（秒）与条数上限，0 表示不缓存；需开启 single_flight
+deterministic_cache_ttl_seconds=0
+deterministic_cache_max_entries=256
+[stream]
+# SSE 输出合并：待发送内容达到 flush_bytes 个字符或距上次输出超过 flush_interval_ms 毫秒时输出一帧
+# 两者都设为 0 时每个上游 delta 单独输出
+flush_bytes=256
+flush_interval_ms=20
+# 流式请求附带 stream_options.include_usage，由上游返回真实 prompt/completion token 数
+# 上游不支持该参数时关闭，改为本地 tokenizer 估算（安装 tiktoken 时更准确）
+include_usage=true
+# 流式取消登记后端：memory 仅进程内有效；sqlite 通过 log 库共享，多进程（uwsgi/异步网关）下取消请求可落在任意进程
+cancel_backend=memory
+# sqlite 后端下每个进程轮询取消标记的间隔（毫秒），每轮对本进程所有在途流只查询一次
+cancel_poll_interval_ms=500
+[attachment]
+# 多模态附件并发下载线程数（进程内共享）
+fetch_workers=8
+# 附件处理结果（base64 data URL / 文本）的内存 LRU 缓存：总容量与单条上限（字节）
+cache_max_bytes=67108864
+cache_max_entry_bytes=8388608
+# 缓存有效期（秒），过期后按 ETag/大小向源站校验，未变化则继续使用
+cache_ttl_seconds=300
+# 图片压缩结果缓存容量（字节），按原图 SHA-256 + 模型的长边/质量参数缓存；压缩参数在模型管理中按模型配置，需要安装 Pillow
+image_cache_max_bytes=33554432
+[context]
+# 对话超出模型上下文窗口（模型管理中按模型配置）时，用该模型把被裁掉的早期对话压缩成滚动摘要
+# 摘要保存在对话记录上，只在裁剪范围扩大时更新；为空时只保留系统提示词与最近的对话
+summary_model=
+summary_max_tokens=512
 [model_filter]
 # 包含前缀（硬编码默认值：gpt,gemini）
 include_prefixes=gpt,gemini,qwen,nano-banana,deepseek
@@ -44,3 +161,7 @@ include_prefixes=gpt,gemini,qwen,nano-banana,deepseek
 exclude_keywords=instruct,realtime,audio
 # 缓存时间（秒）
 cache_ttl=3600
+# 后台提前刷新时间（秒）：缓存到期前该时长内由后台线程刷新，请求始终读取上一次成功的列表
+cache_refresh_ahead=300
+# 上游刷新失败后的重试间隔（秒），期间继续使用上一次成功的列表
+cache_retry_interval=60
@@ -1,36 +1,172 @@
+import queue
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from typing import Any, Optional
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 
 from conf.settings import settings
 
 
+@dataclass
+class HostHealth:
+    ewma_latency_ms: float = 0.0
+    error_rate: float = 0.0
+    error_rate_updated_at: float = 0.0
+    in_flight: int = 0
+    total_requests: int = 0
+    total_failures: int = 0
+    consecutive_failures: int = 0
+    state: str = "closed"
+    open_until: float = 0.0
+    open_count: int = 0
+    probe_started_at: float = 0.0
+    last_error: str = ""
+
+
 @dataclass
 class RuntimeState:
     settings: Any
     server_start_time: float = field(default_factory=time.time)
     model_cache: dict = field(default_factory=dict)
     cache_expiry_time: dict = field(default_factory=dict)
-    api_host_blacklist: dict = field(default_factory=dict)
-    blacklist_lock: threading.Lock = field(default_factory=threading.Lock)
+    model_cache_refresh_lock: threading.Lock = field(default_factory=threading.Lock)
+    # 缓存刷新线程按进程创建，fork 后的 worker 重新创建线程和刷新锁
+    model_cache_refresher_lock: threading.Lock = field(default_factory=threading.Lock)
+    model_cache_refresher: Optional[threading.Thread] = None
+    model_cache_refresher_pid: int = 0
+    model_cache_stats: dict = field(
+        default_factory=lambda: {
+            "refreshing": False,
+            "last_reason": "",
+            "last_refresh_at": 0,
+            "last_refresh_ms": 0,
+            "success_count": 0,
+            "failure_count": 0,
+            "consecutive_failures": 0,
+            "last_error": "",
+            "last_error_at": 0,
+        }
+    )
+    host_health: dict = field(default_factory=dict)
+    host_health_lock: threading.Lock = field(default_factory=threading.Lock)
     stream_cancel_lock: threading.Lock = field(default_factory=threading.Lock)
     stream_cancel_registry: dict = field(default_factory=dict)
+    stream_cancel_poller: Optional[threading.Thread] = None
+    stream_cancel_poller_pid: int = 0
     model_meta_timer_lock: threading.Lock = field(default_factory=threading.Lock)
     model_meta_timer: Optional[threading.Timer] = None
+    token_cache_lock: threading.Lock = field(default_factory=threading.Lock)
+    token_cache: dict = field(default_factory=dict)
+    user_context_lock: threading.Lock = field(default_factory=threading.Lock)
+    user_context_cache: dict = field(default_factory=dict)
+    token_encoder_lock: threading.Lock = field(default_factory=threading.Lock)
+    token_encoders: dict = field(default_factory=dict)
     thread_local: threading.local = field(default_factory=threading.local)
     clients: list = field(default_factory=list)
+    http_client: Optional[httpx.Client] = None
+    client_pool_lock: threading.Lock = field(default_factory=threading.Lock)
+    client_pool: OrderedDict = field(default_factory=OrderedDict)
+    client_pool_stats: dict = field(default_factory=lambda: {"hits": 0, "misses": 0, "evictions": 0})
+    # 异步客户端只在 ASGI 流式网关的事件循环内创建和使用
+    async_http_client: Optional[httpx.AsyncClient] = None
+    async_client_pool: OrderedDict = field(default_factory=OrderedDict)
+    attachment_cache_lock: threading.Lock = field(default_factory=threading.Lock)
+    attachment_cache: OrderedDict = field(default_factory=OrderedDict)
+    attachment_cache_stats: dict = field(
+        default_factory=lambda: {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0, "bytes": 0}
+    )
+    attachment_executor: Optional[ThreadPoolExecutor] = None
+    image_preprocess_lock: threading.Lock = field(default_factory=threading.Lock)
+    image_preprocess_cache: OrderedDict = field(default_factory=OrderedDict)
+    image_preprocess_stats: dict = field(
+        default_factory=lambda: {"processed": 0, "hits": 0, "skipped": 0, "bytes_saved": 0, "bytes": 0}
+    )
+    # 调用日志写入队列与写线程，按进程创建（fork 后的 worker 进程会重新创建）
+    log_writer_lock: threading.Lock = field(default_factory=threading.Lock)
+    log_queue: Optional[queue.Queue] = None
+    log_writer_thread: Optional[threading.Thread] = None
+    log_writer_pid: int = 0
+    log_replay_lock: threading.Lock = field(default_factory=threading.Lock)
+    log_writer_stats: dict = field(
+        default_factory=lambda: {"queued": 0, "written": 0, "batches": 0, "spooled": 0, "replayed": 0, "failures": 0}
+    )
+    # 限流：测试用户令牌桶、额度用尽缓存与滑动窗口计数，均为进程内状态
+    rate_limit_lock: threading.Lock = field(default_factory=threading.Lock)
+    rate_limit_buckets: dict = field(default_factory=dict)
+    rate_limit_windows: dict = field(default_factory=dict)
+    test_limit_exhausted: dict = field(default_factory=dict)
+    rate_limit_stats: dict = field(
+        default_factory=lambda: {"allowed": 0, "db_checks": 0, "bucket_rejected": 0, "cache_rejected": 0, "limit_rejected": 0, "window_rejected": 0}
+    )
+    # 用户/模型配额：进行中请求数与最近 60 秒 token 用量，等待配额的请求在 quota_condition 上排队
+    quota_condition: threading.Condition = field(default_factory=threading.Condition)
+    quota_in_flight: dict = field(default_factory=dict)
+    quota_token_windows: dict = field(default_factory=dict)
+    # 异步网关中排队的请求不占线程，按 (事件循环, asyncio.Event) 登记，释放配额时逐个唤醒
+    quota_async_waiters: set = field(default_factory=set)
+    quota_stats: dict = field(
+        default_factory=lambda: {"admitted": 0, "queued": 0, "rejected_in_flight": 0, "rejected_tpm": 0}
+    )
+    # 非流式对话 single-flight：进行中的上游调用与 temperature=0 结果的短期缓存
+    single_flight_lock: threading.Lock = field(default_factory=threading.Lock)
+    single_flight_calls: dict = field(default_factory=dict)
+    deterministic_cache: OrderedDict = field(default_factory=OrderedDict)
+    single_flight_stats: dict = field(default_factory=lambda: {"leaders": 0, "followers": 0, "cache_hits": 0})
+    response_cache_lock: threading.Lock = field(default_factory=threading.Lock)
+    response_cache: OrderedDict = field(default_factory=OrderedDict)
+    response_cache_stats: dict = field(
+        default_factory=lambda: {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "evictions": 0, "bytes": 0}
+    )
+    # 有效系统提示词缓存：by_id、groups、version（内容摘要，用作 ETag）与过期时间
+    system_prompt_lock: threading.Lock = field(default_factory=threading.Lock)
+    system_prompt_cache: dict = field(default_factory=dict)
     allowed_extensions: set = field(default_factory=lambda: {"txt", "pdf", "png", "jpg", "jpeg", "gif", "ppt", "pptx", "md"})
     use_db_auth: bool = True
-    blacklist_duration: int = 5 * 60
     user_credentials: dict = field(default_factory=dict)
     user_api_keys: dict = field(default_factory=dict)
 
+    def build_http_client(self) -> httpx.Client:
+        if self.http_client is None:
+            self.http_client = DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.settings.http_max_connections,
+                    max_keepalive_connections=self.settings.http_max_keepalive_connections,
+                    keepalive_expiry=self.settings.http_keepalive_expiry,
+                )
+            )
+        return self.http_client
+
+    def build_async_http_client(self) -> httpx.AsyncClient:
+        if self.async_http_client is None:
+            self.async_http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.settings.http_max_connections,
+                    max_keepalive_connections=self.settings.http_max_keepalive_connections,
+                    keepalive_expiry=self.settings.http_keepalive_expiry,
+                )
+            )
+        return self.async_http_client
+
+    def build_async_client(self, api_key: str, url_index: int) -> AsyncOpenAI:
+        return AsyncOpenAI(api_key=api_key, base_url=self.settings.api_hosts[url_index], http_client=self.build_async_http_client())
+
+    def build_attachment_executor(self) -> ThreadPoolExecutor:
+        with self.attachment_cache_lock:
+            if self.attachment_executor is None:
+                self.attachment_executor = ThreadPoolExecutor(
+                    max_workers=max(1, self.settings.attachment_fetch_workers), thread_name_prefix="attachment-fetch"
+                )
+            return self.attachment_executor
+
     def build_clients(self):
+        http_client = self.build_http_client()
         self.clients = [
-            OpenAI(api_key=self.settings.default_api_key, base_url=host)
+            OpenAI(api_key=self.settings.default_api_key, base_url=host, http_client=http_client)
             for host in self.settings.api_hosts
             if host
         ]
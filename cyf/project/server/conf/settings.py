@@ -17,18 +17,80 @@ class Settings:
     default_api_key: str
     web_host: str
     upload_dir: str
+    upload_url_port: int
+    upload_max_bytes: int
+    upload_url_hosts: list[str]
     access_token_ttl_seconds: int
     refresh_token_ttl_seconds: int
+    token_cache_ttl_seconds: int
+    user_context_ttl_seconds: int
     test_user_name: str
     test_ip_default_limit: int
     test_exceed_msg: str
     model_cache_ttl: int
+    model_cache_refresh_ahead: int
+    model_cache_retry_interval: int
     model_exclude_keywords: list[str]
     meta_refresh_hour: int
     meta_refresh_minute: int
     meta_refresh_on_startup: bool
     usd_to_cny_rate: float
     api_param_mode: str
+    client_pool_size: int
+    http_max_connections: int
+    http_max_keepalive_connections: int
+    http_keepalive_expiry: float
+    host_ewma_alpha: float
+    host_breaker_failure_threshold: int
+    host_breaker_open_seconds: int
+    host_breaker_max_open_seconds: int
+    failover_max_attempts: int
+    request_deadline_seconds: int
+    single_flight_enabled: bool
+    deterministic_cache_ttl_seconds: int
+    deterministic_cache_max_entries: int
+    stream_flush_bytes: int
+    stream_flush_interval_ms: int
+    stream_cancel_backend: str
+    stream_include_usage: bool
+    stream_cancel_poll_interval_ms: int
+    attachment_fetch_workers: int
+    attachment_cache_max_bytes: int
+    attachment_cache_max_entry_bytes: int
+    attachment_cache_ttl_seconds: int
+    image_preprocess_cache_max_bytes: int
+    dialog_summary_model: str
+    dialog_summary_max_tokens: int
+    log_compress_codec: str
+    log_request_text_mode: str
+    log_write_behind: bool
+    log_flush_batch_size: int
+    log_flush_interval_ms: int
+    log_queue_max_size: int
+    log_spool_file: str
+    rate_limit_test_burst: int
+    rate_limit_test_per_minute: int
+    rate_limit_exhausted_ttl_seconds: int
+    rate_limit_user_window: tuple[int, int]
+    rate_limit_ip_window: tuple[int, int]
+    rate_limit_model_window: tuple[int, int]
+    rate_limit_exceed_msg: str
+    quota_user_max_in_flight: int
+    quota_model_max_in_flight: int
+    quota_user_tpm: int
+    quota_model_tpm: int
+    quota_queue_timeout_ms: int
+    quota_exceed_msg: str
+    response_cache_enabled: bool
+    response_cache_models: list[str]
+    response_cache_prompt_ids: list[str]
+    response_cache_personal_keys: bool
+    response_cache_ttl_seconds: int
+    response_cache_max_bytes: int
+    response_cache_max_entry_bytes: int
+    response_cache_disk: bool
+    response_cache_disk_max_entries: int
+    system_prompt_cache_ttl_seconds: int
     enable_sql_execute: bool
     users_raw: str
     quant_sqlite3_file: str
@@ -53,6 +115,15 @@ def _get_str(conf: configparser.ConfigParser, section: str, option: str, fallbac
     return value if str(value).strip() else fallback
 
 
+def _get_window(conf: configparser.ConfigParser, section: str, option: str) -> tuple[int, int]:
+    """解析 "次数/秒数" 格式的滑动窗口配置，未配置时返回 (0, 0) 表示不限制。"""
+    value = _get_str(conf, section, option).strip()
+    if not value:
+        return 0, 0
+    count, _, seconds = value.partition("/")
+    return int(count), int(seconds or "60")
+
+
 def load_settings(conf_path: Optional[str] = None) -> Settings:
     final_conf_path = conf_path or CONF_PATH
     conf = configparser.ConfigParser()
@@ -73,18 +144,84 @@ def load_settings(conf_path: Optional[str] = None) -> Settings:
         default_api_key=conf.get("api", "api_key", fallback=""),
         web_host=conf.get("common", "host", fallback=""),
         upload_dir=conf.get("common", "upload_dir", fallback=""),
+        upload_url_port=int(conf.get("common", "upload_url_port", fallback="4567")),
+        upload_max_bytes=int(conf.get("common", "upload_max_bytes", fallback="20971520")),
+        upload_url_hosts=[
+            item.strip().lower() for item in conf.get("common", "upload_url_hosts", fallback="").split(",") if item.strip()
+        ],
         access_token_ttl_seconds=int(conf.get("auth", "access_token_ttl_seconds", fallback="1800")),
         refresh_token_ttl_seconds=int(conf.get("auth", "refresh_token_ttl_seconds", fallback="604800")),
+        token_cache_ttl_seconds=int(conf.get("auth", "token_cache_ttl_seconds", fallback="60")),
+        user_context_ttl_seconds=int(conf.get("auth", "user_context_ttl_seconds", fallback="30")),
         test_user_name=conf.get("common", "test_user", fallback=""),
         test_ip_default_limit=int(conf.get("common", "test_ip_default_limit", fallback="20")),
         test_exceed_msg=conf.get("common", "test_exceed_msg", fallback="请求次数已达上限"),
         model_cache_ttl=int(conf.get("model_filter", "cache_ttl", fallback="3600")),
+        model_cache_refresh_ahead=int(conf.get("model_filter", "cache_refresh_ahead", fallback="300")),
+        model_cache_retry_interval=int(conf.get("model_filter", "cache_retry_interval", fallback="60")),
         model_exclude_keywords=exclude_keywords,
         meta_refresh_hour=int(conf.get("model_filter", "meta_refresh_hour", fallback="2")),
         meta_refresh_minute=int(conf.get("model_filter", "meta_refresh_minute", fallback="0")),
         meta_refresh_on_startup=_get_bool(conf, "model_filter", "meta_refresh_on_startup", fallback="true"),
         usd_to_cny_rate=float(conf.get("api", "usd_to_cny_rate", fallback="2.5")),
         api_param_mode=conf.get("api", "api_param_mode", fallback="default"),
+        client_pool_size=int(conf.get("api", "client_pool_size", fallback="256")),
+        http_max_connections=int(conf.get("api", "http_max_connections", fallback="200")),
+        http_max_keepalive_connections=int(conf.get("api", "http_max_keepalive_connections", fallback="50")),
+        http_keepalive_expiry=float(conf.get("api", "http_keepalive_expiry", fallback="30")),
+        host_ewma_alpha=float(conf.get("api", "host_ewma_alpha", fallback="0.3")),
+        host_breaker_failure_threshold=int(conf.get("api", "host_breaker_failure_threshold", fallback="3")),
+        host_breaker_open_seconds=int(conf.get("api", "host_breaker_open_seconds", fallback="30")),
+        host_breaker_max_open_seconds=int(conf.get("api", "host_breaker_max_open_seconds", fallback="300")),
+        failover_max_attempts=int(conf.get("api", "failover_max_attempts", fallback="3")),
+        request_deadline_seconds=int(conf.get("api", "request_deadline_seconds", fallback="120")),
+        single_flight_enabled=_get_bool(conf, "api", "single_flight", fallback="true"),
+        deterministic_cache_ttl_seconds=int(conf.get("api", "deterministic_cache_ttl_seconds", fallback="0")),
+        deterministic_cache_max_entries=int(conf.get("api", "deterministic_cache_max_entries", fallback="256")),
+        stream_flush_bytes=int(conf.get("stream", "flush_bytes", fallback="256")),
+        stream_flush_interval_ms=int(conf.get("stream", "flush_interval_ms", fallback="20")),
+        stream_include_usage=_get_bool(conf, "stream", "include_usage", fallback="true"),
+        stream_cancel_backend=conf.get("stream", "cancel_backend", fallback="memory").strip().lower(),
+        stream_cancel_poll_interval_ms=int(conf.get("stream", "cancel_poll_interval_ms", fallback="500")),
+        attachment_fetch_workers=int(conf.get("attachment", "fetch_workers", fallback="8")),
+        attachment_cache_max_bytes=int(conf.get("attachment", "cache_max_bytes", fallback="67108864")),
+        attachment_cache_max_entry_bytes=int(conf.get("attachment", "cache_max_entry_bytes", fallback="8388608")),
+        attachment_cache_ttl_seconds=int(conf.get("attachment", "cache_ttl_seconds", fallback="300")),
+        image_preprocess_cache_max_bytes=int(conf.get("attachment", "image_cache_max_bytes", fallback="33554432")),
+        dialog_summary_model=conf.get("context", "summary_model", fallback="").strip(),
+        dialog_summary_max_tokens=int(conf.get("context", "summary_max_tokens", fallback="512")),
+        log_compress_codec=conf.get("log", "compress_codec", fallback="zlib").strip().lower(),
+        log_request_text_mode=conf.get("log", "request_text_mode", fallback="full").strip().lower(),
+        log_write_behind=_get_bool(conf, "log", "write_behind", fallback="true"),
+        log_flush_batch_size=int(conf.get("log", "flush_batch_size", fallback="200")),
+        log_flush_interval_ms=int(conf.get("log", "flush_interval_ms", fallback="500")),
+        log_queue_max_size=int(conf.get("log", "queue_max_size", fallback="10000")),
+        log_spool_file=_get_str(conf, "log", "spool_file", fallback=os.path.join(BASE_DIR, "log_spool.jsonl")),
+        rate_limit_test_burst=int(conf.get("rate_limit", "test_burst", fallback="0")),
+        rate_limit_test_per_minute=int(conf.get("rate_limit", "test_per_minute", fallback="0")),
+        rate_limit_exhausted_ttl_seconds=int(conf.get("rate_limit", "exhausted_ttl_seconds", fallback="60")),
+        rate_limit_user_window=_get_window(conf, "rate_limit", "user_window"),
+        rate_limit_ip_window=_get_window(conf, "rate_limit", "ip_window"),
+        rate_limit_model_window=_get_window(conf, "rate_limit", "model_window"),
+        rate_limit_exceed_msg=_get_str(conf, "rate_limit", "exceed_msg", fallback="请求过于频繁，请稍后再试"),
+        quota_user_max_in_flight=int(conf.get("quota", "user_max_in_flight", fallback="0")),
+        quota_model_max_in_flight=int(conf.get("quota", "model_max_in_flight", fallback="0")),
+        quota_user_tpm=int(conf.get("quota", "user_tpm", fallback="0")),
+        quota_model_tpm=int(conf.get("quota", "model_tpm", fallback="0")),
+        quota_queue_timeout_ms=int(conf.get("quota", "queue_timeout_ms", fallback="0")),
+        quota_exceed_msg=_get_str(conf, "quota", "exceed_msg", fallback="当前请求过多，请稍后再试"),
+        response_cache_enabled=_get_bool(conf, "response_cache", "enabled", fallback="false"),
+        response_cache_models=[item.strip() for item in _get_str(conf, "response_cache", "models").split(",") if item.strip()],
+        response_cache_prompt_ids=[
+            item.strip() for item in _get_str(conf, "response_cache", "system_prompt_ids").split(",") if item.strip()
+        ],
+        response_cache_personal_keys=_get_bool(conf, "response_cache", "include_personal_keys", fallback="false"),
+        response_cache_ttl_seconds=int(conf.get("response_cache", "ttl_seconds", fallback="3600")),
+        response_cache_max_bytes=int(conf.get("response_cache", "max_bytes", fallback="16777216")),
+        response_cache_max_entry_bytes=int(conf.get("response_cache", "max_entry_bytes", fallback="262144")),
+        response_cache_disk=_get_bool(conf, "response_cache", "disk", fallback="false"),
+        response_cache_disk_max_entries=int(conf.get("response_cache", "disk_max_entries", fallback="10000")),
+        system_prompt_cache_ttl_seconds=int(conf.get("system_prompt", "cache_ttl_seconds", fallback="300")),
         enable_sql_execute=_get_bool(conf, "admin", "enable_sql_execute", fallback="false"),
         users_raw=conf.get("common", "users", fallback=""),
         quant_sqlite3_file=_get_str(conf, "quant", "sqlite3_file", fallback=os.path.join(BASE_DIR, "quant.db")),
@@ -13,11 +13,14 @@ class ChatRequest:
     system_prompt_id: str
     role_setting: Optional[dict]
     max_response_tokens: Optional[int]
+    temperature: Optional[float]
 
     @classmethod
     def from_data(cls, data):
         raw_tokens = data.get("max_response_tokens")
         max_tokens = int(raw_tokens) if raw_tokens is not None and str(raw_tokens).strip() else None
+        raw_temperature = data.get("temperature")
+        temperature = float(raw_temperature) if raw_temperature is not None and str(raw_temperature).strip() else None
         return cls(
             model=str(data.get("model", "")).strip(),
             dialog=str(data.get("dialog", "")),
@@ -26,6 +29,7 @@ class ChatRequest:
             system_prompt_id=str(data.get("system_prompt_id", "")).strip(),
             role_setting=parse_role_setting(data.get("role_setting")),
             max_response_tokens=max_tokens,
+            temperature=temperature,
         )
 
 
@@ -44,6 +48,7 @@ class StreamChatRequest(ChatRequest):
             system_prompt_id=base.system_prompt_id,
             role_setting=base.role_setting,
             max_response_tokens=base.max_response_tokens,
+            temperature=base.temperature,
             request_id=str(data.get("request_id", "")).strip(),
         )
 
@@ -64,6 +69,7 @@ class ImageChatRequest(ChatRequest):
             system_prompt_id=base.system_prompt_id,
             role_setting=base.role_setting,
             max_response_tokens=base.max_response_tokens,
+            temperature=base.temperature,
             size=str(data.get("size", "1024x1024")).strip(),
             dialog_id=str(data.get("dialogId", "")).strip(),
         )
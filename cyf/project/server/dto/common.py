@@ -19,6 +19,14 @@ def get_request_data(as_text: bool = False):
     return request.values
 
 
+def get_client_ip() -> str:
+    """客户端 IP：优先取反向代理传入的 X-Forwarded-For / X-Real-IP。"""
+    forwarded_for = request.headers.get("X-Forwarded-For", "")
+    if forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return request.headers.get("X-Real-IP", "") or request.remote_addr or ""
+
+
 def to_bool(value):
     if isinstance(value, bool):
         return value
@@ -14,6 +14,21 @@ class DialogContentRequest:
         return cls(dialog_id=int(raw) if raw is not None and str(raw).strip() else None)
 
 
+@dataclass
+class DialogHistoryRequest:
+    cursor: Optional[str]
+    limit: Optional[int]
+
+    @classmethod
+    def from_data(cls, data):
+        raw_cursor = data.get("cursor")
+        raw_limit = data.get("limit")
+        return cls(
+            cursor=str(raw_cursor).strip() if raw_cursor is not None and str(raw_cursor).strip() else None,
+            limit=int(raw_limit) if raw_limit is not None and str(raw_limit).strip() else None,
+        )
+
+
 @dataclass
 class DialogDeleteRequest:
     dialog_ids: list
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对话消息拆分迁移脚本
+把旧版 dialog.context 中的完整对话拆成 DialogMessage 逐条记录，context 只保留角色设定等元数据。
+可重复执行：已有消息记录的对话会被跳过；未迁移的对话在下次续聊或读取时同样兼容。
+用法：python migrate_dialog_messages.py [每批条数，默认200]
+"""
+
+import json
+import os
+import sys
+import logging
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlitelog import Dialog, DialogMessage, append_dialog_messages, db, init_db
+from service.dialog_context_service import build_dialog_context_payload, parse_dialog_context
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def migrate_batch(dialogs):
+    """迁移一批对话，返回 (迁移对话数, 写入消息数, 失败数)"""
+    migrated = 0
+    written = 0
+    failed = 0
+    for dialog in dialogs:
+        try:
+            messages, role_setting = parse_dialog_context(dialog.context)
+        except Exception as e:
+            logger.warning(f"对话 {dialog.id} 的 context 无法解析，跳过: {e}")
+            failed += 1
+            continue
+        with db.atomic():
+            written += append_dialog_messages(dialog.id, messages)
+            Dialog.update(context=build_dialog_context_payload([], role_setting)).where(Dialog.id == dialog.id).execute()
+        migrated += 1
+    return migrated, written, failed
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    init_db()
+    logger.info("开始迁移对话消息...")
+
+    migrated_total = 0
+    written_total = 0
+    failed_total = 0
+    last_id = 0
+    while True:
+        # 按 id 游标分批读取尚无消息记录的对话，避免一次性加载所有 context
+        migrated_ids = DialogMessage.select(DialogMessage.dialog_id).distinct()
+        dialogs = list(
+            Dialog.select()
+            .where((Dialog.id > last_id) & (Dialog.id.not_in(migrated_ids)))
+            .order_by(Dialog.id)
+            .limit(batch_size)
+        )
+        if not dialogs:
+            break
+        migrated, written, failed = migrate_batch(dialogs)
+        migrated_total += migrated
+        written_total += written
+        failed_total += failed
+        last_id = dialogs[-1].id
+        logger.info(f"已迁移 {migrated_total} 个对话，写入 {written_total} 条消息（当前 id: {last_id}）")
+
+    logger.info(f"迁移完成：对话 {migrated_total} 个，消息 {written_total} 条，失败 {failed_total} 个")
+
+
+if __name__ == "__main__":
+    main()
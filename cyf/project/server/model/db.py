@@ -1,4 +1,4 @@
-from peewee import BooleanField, TextField
+from peewee import BooleanField, CharField, IntegerField, TextField
 from playhouse.migrate import SqliteMigrator, migrate
 from playhouse.sqlite_ext import SqliteExtDatabase
 
@@ -8,7 +8,7 @@ from conf.settings import settings
 db = SqliteExtDatabase(settings.conf.get("log", "sqlite3_file"))
 
 
-def ensure_schema(user_model, model_meta_model):
+def ensure_schema(user_model, model_meta_model, log_model=None, dialog_model=None):
     try:
         migrator = SqliteMigrator(db)
         missing_records = []
@@ -21,12 +21,40 @@ def ensure_schema(user_model, model_meta_model):
         if "token" not in user_columns:
             migrate(migrator.add_column(user_table_name, "token", TextField(null=True)))
             missing_records.append(f"{user_table_name}.token")
+        for column_name in ("access_token_hash", "refresh_token_hash"):
+            if column_name not in user_columns:
+                migrate(migrator.add_column(user_table_name, column_name, CharField(null=True)))
+                missing_records.append(f"{user_table_name}.{column_name}")
+        user_indexes = {index.name for index in db.get_indexes(user_table_name)}
+        for column_name in ("access_token_hash", "refresh_token_hash"):
+            if f"{user_table_name}_{column_name}" not in user_indexes:
+                migrate(migrator.add_index(user_table_name, (column_name,), True))
+                missing_records.append(f"{user_table_name}_{column_name}(unique index)")
 
         model_meta_table_name = model_meta_model._meta.table_name
         model_meta_columns = {col.name for col in db.get_columns(model_meta_table_name)}
         if "allow_net" not in model_meta_columns:
             migrate(migrator.add_column(model_meta_table_name, "allow_net", BooleanField(default=True)))
             missing_records.append(f"{model_meta_table_name}.allow_net")
+        for column_name in ("image_max_edge", "image_quality", "context_window"):
+            if column_name not in model_meta_columns:
+                migrate(migrator.add_column(model_meta_table_name, column_name, IntegerField(default=0)))
+                missing_records.append(f"{model_meta_table_name}.{column_name}")
+
+        if log_model is not None:
+            log_table_name = log_model._meta.table_name
+            log_columns = {col.name for col in db.get_columns(log_table_name)}
+            for column_name in ("prompt_tokens", "completion_tokens"):
+                if column_name not in log_columns:
+                    migrate(migrator.add_column(log_table_name, column_name, IntegerField(default=0)))
+                    missing_records.append(f"{log_table_name}.{column_name}")
+
+        if dialog_model is not None:
+            dialog_table_name = dialog_model._meta.table_name
+            dialog_columns = {col.name for col in db.get_columns(dialog_table_name)}
+            if "summary" not in dialog_columns:
+                migrate(migrator.add_column(dialog_table_name, "summary", TextField(null=True)))
+                missing_records.append(f"{dialog_table_name}.summary")
 
         if missing_records:
             print(f"[db] 已补齐字段: {', '.join(missing_records)}")
@@ -34,7 +62,7 @@ def ensure_schema(user_model, model_meta_model):
         print(f"[db] 自动更新表结构失败: {exc}")
 
 
-def init_db(models, user_model, model_meta_model):
+def init_db(models, user_model, model_meta_model, log_model=None, dialog_model=None):
     db.connect(reuse_if_open=True)
     db.create_tables(models, safe=True)
-    ensure_schema(user_model, model_meta_model)
+    ensure_schema(user_model, model_meta_model, log_model, dialog_model)
@@ -6,6 +6,7 @@ from datetime import datetime
 from peewee import BooleanField, CharField, DateField, DateTimeField, IntegerField, Model, TextField
 
 from model.db import db
+from model.fields import CompressedTextField
 
 
 class BaseModel(Model):
@@ -17,7 +18,9 @@ class Log(BaseModel):
     username = CharField()
     modelname = CharField()
     usage = IntegerField()
-    request_text = TextField()
+    prompt_tokens = IntegerField(default=0)
+    completion_tokens = IntegerField(default=0)
+    request_text = CompressedTextField()
 
 
 class Dialog(BaseModel):
@@ -26,11 +29,32 @@ class Dialog(BaseModel):
     modelname = CharField()
     dialog_name = CharField()
     start_date = DateField()
-    context = TextField()
+    context = CompressedTextField()
+    # 早期对话的滚动摘要（JSON），由上下文预算裁剪时生成
+    summary = TextField(null=True)
 
     class Meta:
         database = db
-        indexes = ((( "username", "chattype", "dialog_name"), True),)
+        indexes = (
+            (( "username", "chattype", "dialog_name"), True),
+            # 历史列表按用户 + 日期过滤、按 id 倒序翻页
+            (("username", "start_date", "id"), False),
+        )
+
+
+class DialogMessage(BaseModel):
+    # 对话消息按条存储，每轮只追加新消息；content 保存除 role/parts/time 外的消息字段（JSON），content 与 parts 均压缩存储
+    dialog_id = IntegerField()
+    seq = IntegerField()
+    role = CharField()
+    content = CompressedTextField(null=True)
+    parts = CompressedTextField(null=True)
+    time = CharField(default="")
+    digest = CharField()
+
+    class Meta:
+        database = db
+        indexes = ((( "dialog_id", "seq"), True),)
 
 
 class ModelMeta(BaseModel):
@@ -41,6 +65,11 @@ class ModelMeta(BaseModel):
     allow_net = BooleanField(default=False)
     status_valid = BooleanField()
     model_grp = CharField(default="")
+    # 多模态图片预处理：长边上限（像素，0 表示不处理）与 JPEG 压缩质量（0 表示默认值）
+    image_max_edge = IntegerField(default=0)
+    image_quality = IntegerField(default=0)
+    # 上下文窗口（token，0 表示不做裁剪）
+    context_window = IntegerField(default=0)
 
     class Meta:
         database = db
@@ -56,6 +85,9 @@ class ModelMeta(BaseModel):
             "allow_net": self.allow_net,
             "status_valid": self.status_valid,
             "model_grp": self.model_grp,
+            "image_max_edge": self.image_max_edge,
+            "image_quality": self.image_quality,
+            "context_window": self.context_window,
         }
 
 
@@ -97,6 +129,9 @@ class User(BaseModel):
     salt = CharField()
     api_key = CharField(null=True)
     token = TextField(null=True)
+    # token 摘要列，唯一索引由 ensure_schema 补建，避免旧库 create_tables 时列尚不存在
+    access_token_hash = CharField(null=True)
+    refresh_token_hash = CharField(null=True)
     browser_conf = TextField(null=True)
     role = CharField(default="user")
     is_active = BooleanField(default=True)
@@ -149,4 +184,20 @@ class Notification(BaseModel):
         }
 
 
-ALL_MODELS = [Log, Dialog, ModelMeta, SystemPrompt, TestLimit, User, Notification]
+class StreamCancel(BaseModel):
+    # 跨进程流式取消登记：流开始时写入，取消接口置 cancelled，流结束时删除
+    request_id = CharField(unique=True)
+    cancelled = BooleanField(default=False)
+    created_at = DateTimeField(default=datetime.now)
+
+
+class ResponseCache(BaseModel):
+    # 单轮对话响应缓存的磁盘层：cache_key 为模型与请求参数的摘要，payload 为上游响应 JSON
+    cache_key = CharField(unique=True)
+    modelname = CharField()
+    payload = CompressedTextField()
+    expires_at = IntegerField(index=True)
+    created_at = DateTimeField(default=datetime.now)
+
+
+ALL_MODELS = [Log, Dialog, DialogMessage, ModelMeta, SystemPrompt, TestLimit, User, Notification, StreamCancel, ResponseCache]
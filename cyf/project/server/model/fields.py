@@ -0,0 +1,81 @@
+import base64
+import zlib
+
+from peewee import TextField
+
+from conf.settings import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# 压缩后的值以 BLOB 存储，前缀标记压缩格式；未压缩的旧数据仍是 TEXT，读取时原样返回
+ZLIB_MARKER = b"\x00z"
+ZSTD_MARKER = b"\x00s"
+# 小于该长度的文本不压缩，压缩收益有限且保留直接查询的可读性
+MIN_COMPRESS_BYTES = 256
+
+
+def get_compress_codec() -> str:
+    codec = settings.log_compress_codec
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+    return codec
+
+
+def encode_compressed_text(value, codec: str = None):
+    if value is None:
+        return None
+    raw = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+    codec = codec or get_compress_codec()
+    if codec not in ("zlib", "zstd") or len(raw) < MIN_COMPRESS_BYTES:
+        return raw.decode("utf-8")
+    if codec == "zstd":
+        compressed = ZSTD_MARKER + zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        compressed = ZLIB_MARKER + zlib.compress(raw, 6)
+    return compressed if len(compressed) < len(raw) else raw.decode("utf-8")
+
+
+def decode_compressed_text(value):
+    """解压带格式标记的 BLOB；普通文本和其他值原样返回。"""
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    raw = bytes(value)
+    if raw.startswith(ZLIB_MARKER):
+        return zlib.decompress(raw[len(ZLIB_MARKER):]).decode("utf-8")
+    if raw.startswith(ZSTD_MARKER):
+        if zstandard is None:
+            raise RuntimeError("读取 zstd 压缩数据需要安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(raw[len(ZSTD_MARKER):]).decode("utf-8")
+    return value
+
+
+def decode_query_value(value):
+    """原始 SQL 查询结果的取值：解压压缩字段，其余无法按 UTF-8 解码的二进制转为 base64: 前缀的文本，保证可以 JSON 序列化。"""
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    try:
+        value = decode_compressed_text(value)
+    except Exception:
+        # substr() 等截断了压缩数据时无法解压，按普通二进制输出
+        pass
+    if isinstance(value, str):
+        return value
+    raw = bytes(value)
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return "base64:" + base64.b64encode(raw).decode("ascii")
+
+
+class CompressedTextField(TextField):
+    """透明压缩的文本字段：写入时按 [log] compress_codec 压缩，读取时按前缀标记解压，兼容未压缩的旧数据。"""
+
+    def db_value(self, value):
+        return encode_compressed_text(value)
+
+    def python_value(self, value):
+        return decode_compressed_text(value)
@@ -1,36 +1,196 @@
+import hashlib
+import json
 from datetime import date, datetime
 
-from peewee import DoesNotExist
+from peewee import DoesNotExist, IntegrityError, Tuple, chunked
 
-from model.entities import Dialog, Log
+from conf.settings import settings
+from model.db import db
+from model.entities import Dialog, DialogMessage, Log
 
 
-def set_log(user: str, usage: int, model: str, text: str):
-    Log.create(username=user, usage=usage, modelname=model, request_text=text)
+# request_text_mode=usage 时保留的响应字段
+USAGE_LOG_KEYS = ("id", "object", "created", "model", "usage", "purpose")
 
 
-def set_dialog(user: str, model: str, chattype: str, dialog_name: str, context: str, dialog_id: int = None):
+def trim_request_text(text: str) -> str:
+    """只保留响应的 id/模型/用量/结束原因，正文替换为字符数。"""
+    try:
+        payload = json.loads(text)
+    except (TypeError, ValueError):
+        return json.dumps({"text_chars": len(text or "")})
+    if not isinstance(payload, dict):
+        return json.dumps({"text_chars": len(text)})
+    trimmed = {key: payload[key] for key in USAGE_LOG_KEYS if key in payload}
+    if isinstance(payload.get("choices"), list):
+        trimmed["finish_reasons"] = [choice.get("finish_reason") for choice in payload["choices"] if isinstance(choice, dict)]
+    if isinstance(payload.get("content"), str):
+        trimmed["content_chars"] = len(payload["content"])
+    if isinstance(payload.get("data"), list):
+        trimmed["data_count"] = len(payload["data"])
+    return json.dumps(trimmed, ensure_ascii=False)
+
+
+def build_log_row(user: str, usage: int, model: str, text: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> dict:
+    return {
+        "username": user,
+        "usage": usage,
+        "modelname": model,
+        "request_text": text,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+
+
+def insert_logs(rows: list) -> int:
+    """在一个事务内批量写入日志行。"""
+    if settings.log_request_text_mode == "usage":
+        rows = [{**row, "request_text": trim_request_text(row["request_text"])} for row in rows]
+    with db.atomic():
+        for batch in chunked(rows, 100):
+            Log.insert_many(batch).execute()
+    return len(rows)
+
+
+def set_log(user: str, usage: int, model: str, text: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+    insert_logs([build_log_row(user, usage, model, text, prompt_tokens, completion_tokens)])
+
+
+def _message_digest(message: dict) -> str:
+    # 只按消息内容判断是否变化，时间戳与 parts 由服务端补充，不参与比较
+    payload = json.dumps(
+        [message.get("role"), message.get("content"), message.get("desc"), message.get("url")],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _build_message_row(dialog_id: int, seq: int, message: dict) -> dict:
+    body = {key: value for key, value in message.items() if key not in ("role", "parts", "time")}
+    return {
+        "dialog_id": dialog_id,
+        "seq": seq,
+        "role": message.get("role", ""),
+        "content": json.dumps(body, ensure_ascii=False),
+        "parts": json.dumps(message["parts"], ensure_ascii=False) if "parts" in message else None,
+        "time": message.get("time") or "",
+        "digest": _message_digest(message),
+    }
+
+
+def _row_to_message(row: dict) -> dict:
+    message = {"role": row["role"], **json.loads(row["content"] or "{}")}
+    if row["parts"] is not None:
+        message["parts"] = json.loads(row["parts"])
+    if row["time"]:
+        message["time"] = row["time"]
+    return message
+
+
+def append_dialog_messages(dialog_id: int, messages: list) -> int:
+    """把完整消息列表同步到 DialogMessage，只写入与已存储内容不同的尾部，返回写入条数。
+
+    正常续聊时只追加本轮的新消息；客户端修改或重新生成了历史消息时，从第一条不一致处截断后重写。
+    """
+    stored_digests = [
+        row.digest
+        for row in DialogMessage.select(DialogMessage.digest).where(DialogMessage.dialog_id == dialog_id).order_by(DialogMessage.seq)
+    ]
+    messages = [message for message in messages if isinstance(message, dict)]
+    common = 0
+    while common < min(len(stored_digests), len(messages)) and stored_digests[common] == _message_digest(messages[common]):
+        common += 1
+    with db.atomic():
+        if common < len(stored_digests):
+            DialogMessage.delete().where((DialogMessage.dialog_id == dialog_id) & (DialogMessage.seq >= common)).execute()
+        rows = [_build_message_row(dialog_id, seq, messages[seq]) for seq in range(common, len(messages))]
+        for batch in chunked(rows, 100):
+            DialogMessage.insert_many(batch).execute()
+    return len(rows)
+
+
+def get_dialog_messages(dialog_id: int) -> list:
+    query = DialogMessage.select().where(DialogMessage.dialog_id == dialog_id).order_by(DialogMessage.seq)
+    return [_row_to_message(row) for row in query.dicts().iterator()]
+
+
+def delete_dialog_messages(dialog_ids: list) -> int:
+    if not dialog_ids:
+        return 0
+    return DialogMessage.delete().where(DialogMessage.dialog_id.in_(dialog_ids)).execute()
+
+
+def set_dialog(user: str, model: str, chattype: str, dialog_name: str, context: str, dialog_id: int = None, messages: list = None):
+    """保存对话元数据；传入 messages 时消息逐条追加到 DialogMessage，context 只保存角色设定等元数据。
+
+    同名对话原地更新，dialog_id 保持不变，已存储的消息与滚动摘要随之保留。
+    """
     time_str = datetime.now().strftime("%Y-%m-%d")
-    if dialog_id is not None:
-        Dialog.update(modelname=model, dialog_name=dialog_name, start_date=time_str, context=context).where(Dialog.id == dialog_id).execute()
-        return dialog_id
-    return Dialog.replace(
-        username=user,
-        chattype=chattype,
-        modelname=model,
-        dialog_name=dialog_name,
-        start_date=time_str,
-        context=context,
-    ).execute()
-
-
-def get_dialog_list(user: str, start_date: date):
+    dialog_filter = (Dialog.username == user) & (Dialog.chattype == chattype) & (Dialog.dialog_name == dialog_name)
+    # 先读后写的事务以 IMMEDIATE 开始，避免并发保存同一对话时读锁升级写锁互相等待导致 database is locked
+    with db.atomic("IMMEDIATE"):
+        if dialog_id is None:
+            existing = Dialog.select(Dialog.id).where(dialog_filter).first()
+            dialog_id = existing.id if existing else None
+        created = False
+        if dialog_id is None:
+            try:
+                with db.atomic():
+                    dialog_id = Dialog.insert(
+                        username=user,
+                        chattype=chattype,
+                        modelname=model,
+                        dialog_name=dialog_name,
+                        start_date=time_str,
+                        context=context,
+                    ).execute()
+                created = True
+            except IntegrityError:
+                # 其他进程刚创建了同名对话，改为更新该记录
+                dialog_id = Dialog.select(Dialog.id).where(dialog_filter).first().id
+        if not created:
+            Dialog.update(modelname=model, dialog_name=dialog_name, start_date=time_str, context=context).where(Dialog.id == dialog_id).execute()
+        if messages is not None:
+            append_dialog_messages(dialog_id, messages)
+    return dialog_id
+
+
+def get_dialog_summary(user: str, chattype: str, dialog_name: str):
+    row = (
+        Dialog.select(Dialog.summary)
+        .where((Dialog.username == user) & (Dialog.chattype == chattype) & (Dialog.dialog_name == dialog_name))
+        .first()
+    )
+    return row.summary if row else None
+
+
+def set_dialog_summary(user: str, chattype: str, dialog_name: str, summary: str) -> bool:
+    rows_modified = (
+        Dialog.update(summary=summary)
+        .where((Dialog.username == user) & (Dialog.chattype == chattype) & (Dialog.dialog_name == dialog_name))
+        .execute()
+    )
+    return rows_modified > 0
+
+
+def get_dialog_list(user: str, start_date: date, cursor: tuple = None, limit: int = None):
+    """按最近对话日期、id 倒序返回对话列表，顺序与 (username, start_date, id) 索引一致，无需额外排序。
+
+    cursor 为上一页最后一条对话的 (start_date, id)，以行值比较做 keyset 翻页，每页只扫描本页的索引范围。
+    """
     query = (
         Dialog.select(Dialog.id, Dialog.username, Dialog.chattype, Dialog.modelname, Dialog.dialog_name, Dialog.start_date)
         .where(Dialog.username == user, Dialog.start_date >= start_date)
-        .order_by(Dialog.id.desc())
+        .order_by(Dialog.start_date.desc(), Dialog.id.desc())
     )
-    return [dialog for dialog in query.dicts().iterator()] if query.exists() else []
+    if cursor is not None:
+        cursor_date, cursor_id = cursor
+        query = query.where(Tuple(Dialog.start_date, Dialog.id) < Tuple(cursor_date, cursor_id))
+    if limit is not None:
+        query = query.limit(limit)
+    return list(query.dicts().iterator())
 
 
 def get_dialog_context(user: str, dialog_id: int):
@@ -43,7 +203,10 @@ def get_dialog_context(user: str, dialog_id: int):
 def delete_dialogs(user: str, dialog_ids: list) -> int:
     if not dialog_ids:
         return 0
-    return Dialog.delete().where((Dialog.username == user) & (Dialog.id.in_(dialog_ids))).execute()
+    with db.atomic():
+        owned_ids = [row.id for row in Dialog.select(Dialog.id).where((Dialog.username == user) & (Dialog.id.in_(dialog_ids)))]
+        delete_dialog_messages(owned_ids)
+        return Dialog.delete().where(Dialog.id.in_(owned_ids)).execute() if owned_ids else 0
 
 
 def update_dialog_title(user: str, dialog_id: int, new_title: str) -> bool:
@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import Optional
+
+from model.entities import ResponseCache
+
+
+def get_response_cache(cache_key: str, now_ts: int) -> Optional[tuple]:
+    """返回未过期记录的 (payload, expires_at)。"""
+    row = (
+        ResponseCache.select(ResponseCache.payload, ResponseCache.expires_at)
+        .where((ResponseCache.cache_key == cache_key) & (ResponseCache.expires_at > now_ts))
+        .first()
+    )
+    return (row.payload, row.expires_at) if row else None
+
+
+def set_response_cache(cache_key: str, model: str, payload: str, expires_at: int):
+    ResponseCache.replace(
+        cache_key=cache_key, modelname=model, payload=payload, expires_at=expires_at, created_at=datetime.now()
+    ).execute()
+
+
+def purge_response_cache(now_ts: int, max_entries: int) -> int:
+    """删除过期记录，超出条数上限时再按写入先后删除最旧的记录。"""
+    deleted = ResponseCache.delete().where(ResponseCache.expires_at <= now_ts).execute()
+    overflow = ResponseCache.select().count() - max_entries
+    if overflow > 0:
+        oldest_ids = ResponseCache.select(ResponseCache.id).order_by(ResponseCache.id).limit(overflow)
+        deleted += ResponseCache.delete().where(ResponseCache.id.in_(oldest_ids)).execute()
+    return deleted
+
+
+def clear_response_cache() -> int:
+    return ResponseCache.delete().execute()
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from model.entities import StreamCancel
+
+
+# SQLite 单条语句的绑定参数上限为 999，分批查询
+_QUERY_BATCH_SIZE = 500
+
+
+def register_stream_cancel(request_id: str):
+    StreamCancel.replace(request_id=request_id, cancelled=False, created_at=datetime.now()).execute()
+
+
+def mark_stream_cancelled(request_id: str) -> bool:
+    return StreamCancel.update(cancelled=True).where(StreamCancel.request_id == request_id).execute() > 0
+
+
+def get_cancelled_request_ids(request_ids: list) -> set:
+    cancelled_ids = set()
+    for start in range(0, len(request_ids), _QUERY_BATCH_SIZE):
+        batch = request_ids[start:start + _QUERY_BATCH_SIZE]
+        query = StreamCancel.select(StreamCancel.request_id).where(
+            StreamCancel.request_id.in_(batch), StreamCancel.cancelled == True
+        )
+        cancelled_ids.update(row.request_id for row in query)
+    return cancelled_ids
+
+
+def delete_stream_cancel(request_id: str):
+    StreamCancel.delete().where(StreamCancel.request_id == request_id).execute()
+
+
+def purge_stream_cancels(before: datetime) -> int:
+    return StreamCancel.delete().where(StreamCancel.created_at < before).execute()
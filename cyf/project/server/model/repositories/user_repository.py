@@ -1,3 +1,4 @@
+import hashlib
 import json
 from datetime import datetime
 from typing import Optional
@@ -6,12 +7,14 @@ from peewee import DoesNotExist
 
 from model.db import db
 from model.entities import Notification, TestLimit, User
+from model.fields import decode_query_value
 
 
 def message_query(sql: str, params=None):
     cursor = db.execute_sql(sql, params)
     columns = [desc[0] for desc in cursor.description] if cursor.description else []
-    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    # 压缩存储的字段以 BLOB 返回，解压后再输出，结果需能直接 JSON 序列化
+    return [dict(zip(columns, (decode_query_value(value) for value in row))) for row in cursor.fetchall()]
 
 
 def get_user_by_username(username: str, role: str = None):
@@ -23,6 +26,19 @@ def get_user_by_username(username: str, role: str = None):
         return None
 
 
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _apply_token_payload(user: User, payload: Optional[dict]):
+    payload = payload or {}
+    access_token = payload.get("access_token")
+    refresh_token = payload.get("refresh_token")
+    user.token = json.dumps(payload, ensure_ascii=False) if payload else None
+    user.access_token_hash = hash_token(access_token) if access_token else None
+    user.refresh_token_hash = hash_token(refresh_token) if refresh_token else None
+
+
 def get_user_token_payload(username: str) -> Optional[dict]:
     user = get_user_by_username(username)
     if not user or not user.token:
@@ -41,7 +57,7 @@ def set_user_token_payload(username: str, payload: Optional[dict]) -> bool:
     if not user:
         return False
     try:
-        user.token = json.dumps(payload, ensure_ascii=False) if payload else None
+        _apply_token_payload(user, payload)
         user.updated_at = datetime.now()
         user.save()
         return True
@@ -49,20 +65,42 @@ def set_user_token_payload(username: str, payload: Optional[dict]) -> bool:
         return False
 
 
+def clear_user_token_fields(user: User):
+    _apply_token_payload(user, None)
+
+
 def find_user_by_token(token: str, token_type: str = "access") -> Optional[tuple]:
     if not token:
         return None
     token_key = "access_token" if token_type == "access" else "refresh_token"
-    for user in User.select().where(User.is_active == True):
-        if not user.token:
-            continue
+    hash_field = User.access_token_hash if token_type == "access" else User.refresh_token_hash
+    try:
+        user = User.get(hash_field == hash_token(token), User.is_active == True)
+    except DoesNotExist:
+        return None
+    if not user.token:
+        return None
+    try:
+        payload = json.loads(user.token)
+    except Exception:
+        return None
+    if isinstance(payload, dict) and payload.get(token_key) == token:
+        return user, payload
+    return None
+
+
+def backfill_user_token_hashes() -> int:
+    updated = 0
+    query = User.select().where(User.token.is_null(False), User.access_token_hash.is_null(True), User.refresh_token_hash.is_null(True))
+    for user in list(query):
         try:
             payload = json.loads(user.token)
         except Exception:
-            continue
-        if isinstance(payload, dict) and payload.get(token_key) == token:
-            return user, payload
-    return None
+            payload = None
+        _apply_token_payload(user, payload if isinstance(payload, dict) else None)
+        user.save()
+        updated += 1
+    return updated
 
 
 def get_active_token_count() -> int:
@@ -146,6 +184,20 @@ def check_test_limit_exceeded(user_ip: str, default_limit: int) -> bool:
     return record.user_count >= record.limit
 
 
+def consume_test_limit(user_ip: str, default_limit: int) -> bool:
+    """原子占用一次测试额度：计数与上限判断在同一条 UPDATE 中完成，并发下不会超发。返回是否占用成功。"""
+    query = TestLimit.update(user_count=TestLimit.user_count + 1).where(
+        (TestLimit.user_ip == user_ip) & (TestLimit.user_count < TestLimit.limit)
+    )
+    if query.execute():
+        return True
+    if TestLimit.select().where(TestLimit.user_ip == user_ip).exists():
+        return False
+    # 首次调用时还没有记录，插入后重试一次（并发插入由唯一索引去重）
+    TestLimit.insert(user_ip=user_ip, user_count=0, limit=default_limit).on_conflict_ignore().execute()
+    return query.execute() > 0
+
+
 def get_notification_list(status: str = None, limit: int = None, offset: int = None):
     query = Notification.select().order_by(Notification.priority.desc(), Notification.publish_time.desc())
     if status is not None:
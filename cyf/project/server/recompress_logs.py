@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志与对话数据重新压缩脚本
+按 [log] compress_codec 重新写入 log.request_text、dialog.context、dialogmessage.content、dialogmessage.parts，
+输出各字段压缩前后的字节数；可选按 usage 模式精简历史日志，并在结束后 VACUUM 释放文件空间。
+用法：python recompress_logs.py [--trim-request-text] [--vacuum] [--batch-size 500]
+"""
+
+import argparse
+import os
+import sys
+import logging
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlitelog import Dialog, DialogMessage, Log, db, init_db
+from model.fields import encode_compressed_text, get_compress_codec
+from model.repositories.log_repository import trim_request_text
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# (模型, 字段)
+TARGET_COLUMNS = [
+    (Log, Log.request_text),
+    (Dialog, Dialog.context),
+    (DialogMessage, DialogMessage.content),
+    (DialogMessage, DialogMessage.parts),
+]
+
+
+def get_column_bytes(model, field):
+    """字段实际占用的字节数（BLOB 按字节、TEXT 按 UTF-8 编码计算）"""
+    table_name = model._meta.table_name
+    cursor = db.execute_sql(f'SELECT COALESCE(SUM(LENGTH(CAST("{field.column_name}" AS BLOB))), 0) FROM "{table_name}"')
+    return cursor.fetchone()[0]
+
+
+def recompress_column(model, field, batch_size, trim=False):
+    """按 id 游标分批读取（读取时自动解压），再经字段编码重新写入，返回处理行数"""
+    processed = 0
+    last_id = 0
+    while True:
+        rows = list(
+            model.select(model.id, field)
+            .where(model.id > last_id)
+            .order_by(model.id)
+            .limit(batch_size)
+            .tuples()
+        )
+        if not rows:
+            break
+        with db.atomic():
+            for row_id, value in rows:
+                if value is None:
+                    continue
+                if trim:
+                    value = trim_request_text(value)
+                # 直接写入编码后的值，避免 update 时再次经过字段转换
+                db.execute_sql(
+                    f'UPDATE "{model._meta.table_name}" SET "{field.column_name}" = ? WHERE id = ?',
+                    (encode_compressed_text(value), row_id),
+                )
+                processed += 1
+        last_id = rows[-1][0]
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重新压缩日志与对话数据")
+    parser.add_argument("--trim-request-text", action="store_true", help="将历史 log.request_text 精简为用量元数据")
+    parser.add_argument("--vacuum", action="store_true", help="完成后执行 VACUUM 回收数据库文件空间")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    init_db()
+    db_path = db.database
+    file_size_before = os.path.getsize(db_path)
+    logger.info(f"开始重新压缩，压缩算法: {get_compress_codec()}，数据库: {db_path}")
+
+    for model, field in TARGET_COLUMNS:
+        before = get_column_bytes(model, field)
+        trim = args.trim_request_text and field is Log.request_text
+        processed = recompress_column(model, field, args.batch_size, trim=trim)
+        after = get_column_bytes(model, field)
+        ratio = f"{after / before:.1%}" if before else "-"
+        logger.info(f"{model._meta.table_name}.{field.column_name}: {processed} 行，{before} -> {after} 字节（{ratio}）")
+
+    if args.vacuum:
+        logger.info("执行 VACUUM...")
+        db.execute_sql("VACUUM")
+    file_size_after = os.path.getsize(db_path)
+    logger.info(f"数据库文件大小: {file_size_before} -> {file_size_after} 字节")
+
+
+if __name__ == "__main__":
+    main()
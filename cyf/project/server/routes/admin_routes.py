@@ -9,9 +9,13 @@ from conf.runtime import runtime_state
 from dto.common import build_page_result, error_response, get_request_data, parse_pagination_args, success_response, to_bool
 from model.db import db
 from model.entities import ModelMeta, Notification, SystemPrompt, TestLimit, User
-from model.repositories.user_repository import get_active_notifications
-from service.auth_service import require_admin_auth
+from model.repositories.user_repository import clear_user_token_fields, get_active_notifications
+from service.auth_service import invalidate_token_cache, require_admin_auth
+from service.host_service import evict_pooled_clients
 from service.model_service import get_runtime_state_snapshot, invalidate_model_cache
+from service.rate_limit_service import invalidate_test_limit_cache
+from service.system_prompt_service import invalidate_system_prompt_cache
+from service.user_context_service import invalidate_user_context
 
 
 admin_bp = Blueprint("admin_routes", __name__, url_prefix="/never_guess_my_usage")
@@ -115,6 +119,9 @@ def model_meta_create():
             recommend=to_bool(data.get("recommend", "false")),
             allow_net=to_bool(data.get("allow_net", "true")),
             status_valid=to_bool(data.get("status_valid", "true")),
+            image_max_edge=int(data.get("image_max_edge") or 0),
+            image_quality=int(data.get("image_quality") or 0),
+            context_window=int(data.get("context_window") or 0),
         )
         invalidate_model_cache("model_meta_create", logger=current_app.logger)
         return success_response(data=model.to_dict(), msg="模型创建成功")
@@ -147,6 +154,12 @@ def model_meta_update():
             model.allow_net = to_bool(data["allow_net"])
         if "status_valid" in data:
             model.status_valid = to_bool(data["status_valid"])
+        if "image_max_edge" in data:
+            model.image_max_edge = int(data["image_max_edge"] or 0)
+        if "image_quality" in data:
+            model.image_quality = int(data["image_quality"] or 0)
+        if "context_window" in data:
+            model.context_window = int(data["context_window"] or 0)
         model.save()
         invalidate_model_cache("model_meta_update", logger=current_app.logger)
         return success_response(data=model.to_dict(), msg="模型更新成功")
@@ -271,6 +284,7 @@ def system_prompt_create():
             role_content=data.get("role_content", ""),
             status_valid=to_bool(data.get("status_valid", "true")),
         )
+        invalidate_system_prompt_cache()
         return success_response(data=prompt.to_dict(), msg="系统提示词创建成功")
     except IntegrityError:
         return error_response("该角色名称和分组组合已存在")
@@ -298,6 +312,7 @@ def system_prompt_update():
         if "status_valid" in data:
             prompt.status_valid = to_bool(data["status_valid"])
         prompt.save()
+        invalidate_system_prompt_cache()
         return success_response(data=prompt.to_dict(), msg="系统提示词更新成功")
     except DoesNotExist:
         return error_response("系统提示词不存在")
@@ -317,6 +332,7 @@ def system_prompt_delete():
             return error_response("系统提示词ID不能为空")
         prompt = SystemPrompt.get_by_id(int(prompt_id))
         prompt.delete_instance()
+        invalidate_system_prompt_cache()
         return success_response(msg="系统提示词删除成功")
     except DoesNotExist:
         return error_response("系统提示词不存在")
@@ -361,6 +377,7 @@ def test_limit_create():
         if not user_ip:
             return error_response("用户IP不能为空")
         test_limit = TestLimit.create(user_ip=user_ip, user_count=int(data.get("user_count", 0)), limit=int(data.get("limit", 20)))
+        invalidate_test_limit_cache(user_ip)
         return success_response(data=test_limit_to_dict(test_limit), msg="测试限制创建成功")
     except IntegrityError:
         return error_response("该IP已存在限制记录")
@@ -377,6 +394,7 @@ def test_limit_update():
         if not limit_id:
             return error_response("限制ID不能为空")
         test_limit = TestLimit.get_by_id(int(limit_id))
+        invalidate_test_limit_cache(test_limit.user_ip)
         if "user_ip" in data:
             test_limit.user_ip = data["user_ip"].strip()
         if "user_count" in data:
@@ -384,6 +402,7 @@ def test_limit_update():
         if "limit" in data:
             test_limit.limit = int(data["limit"])
         test_limit.save()
+        invalidate_test_limit_cache(test_limit.user_ip)
         return success_response(data=test_limit_to_dict(test_limit), msg="测试限制更新成功")
     except DoesNotExist:
         return error_response("测试限制不存在")
@@ -403,6 +422,7 @@ def test_limit_delete():
             return error_response("限制ID不能为空")
         test_limit = TestLimit.get_by_id(int(limit_id))
         test_limit.delete_instance()
+        invalidate_test_limit_cache(test_limit.user_ip)
         return success_response(msg="测试限制删除成功")
     except DoesNotExist:
         return error_response("测试限制不存在")
@@ -420,14 +440,17 @@ def test_limit_reset():
         reset_all = to_bool(data.get("reset_all", "false"))
         if reset_all:
             updated_count = TestLimit.update(user_count=0).execute()
+            invalidate_test_limit_cache()
             return success_response(msg=f"成功重置 {updated_count} 条测试限制记录")
         if limit_id:
             test_limit = TestLimit.get_by_id(int(limit_id))
             test_limit.user_count = 0
             test_limit.save()
+            invalidate_test_limit_cache(test_limit.user_ip)
             return success_response(data=test_limit_to_dict(test_limit), msg="测试限制重置成功")
         if user_ip:
             updated_count = TestLimit.update(user_count=0).where(TestLimit.user_ip == user_ip).execute()
+            invalidate_test_limit_cache(user_ip)
             if updated_count > 0:
                 return success_response(msg=f"成功重置IP {user_ip} 的测试限制")
             return error_response("未找到该IP的测试限制记录")
@@ -502,6 +525,8 @@ def user_update():
         if not user_id:
             return error_response("用户ID不能为空")
         user = User.get_by_id(int(user_id))
+        original_username = user.username
+        original_api_key = user.api_key
         if "username" in data:
             new_username = data["username"].strip()
             if new_username != user.username:
@@ -518,6 +543,10 @@ def user_update():
             user.password_hash, user.salt = User.hash_password(data["new_password"].strip())
         user.updated_at = datetime.now()
         user.save()
+        invalidate_token_cache(original_username)
+        invalidate_user_context(original_username)
+        if original_api_key != user.api_key or not user.is_active:
+            evict_pooled_clients(original_api_key)
         return success_response(data=user_to_dict(user), msg="用户信息更新成功")
     except DoesNotExist:
         return error_response("用户不存在")
@@ -536,14 +565,18 @@ def user_delete():
         hard_delete_value = data.get("hard_delete", "false")
         hard_delete = hard_delete_value if isinstance(hard_delete_value, bool) else str(hard_delete_value).lower() in ("true", "1", "yes")
         user = User.get_by_id(int(user_id))
+        evict_pooled_clients(user.api_key)
         if hard_delete:
-            user.token = None
             user.delete_instance()
+            invalidate_token_cache(user.username)
+            invalidate_user_context(user.username)
             return success_response(msg="用户永久删除成功")
         user.is_active = False
-        user.token = None
+        clear_user_token_fields(user)
         user.updated_at = datetime.now()
         user.save()
+        invalidate_token_cache(user.username)
+        invalidate_user_context(user.username)
         return success_response(msg="用户已标记为未激活")
     except DoesNotExist:
         return error_response("用户不存在")
@@ -1,28 +1,30 @@
 import json
-import os
-import time
 from datetime import datetime
 
 import requests
 from flask import Blueprint, Response, current_app, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
 
 import sqlitelog
 from conf.runtime import runtime_state
 from dto.auth_dto import LoginRequest, RefreshTokenRequest, RegisterRequest, ResetPasswordRequest
 from dto.chat_dto import ChatRequest, ImageChatRequest, StreamCancelRequest, StreamChatRequest
-from dto.common import get_request_data
-from dto.dialog_dto import DialogContentRequest, DialogDeleteRequest, DialogTitleUpdateRequest
+from dto.common import get_client_ip, get_request_data
+from dto.dialog_dto import DialogContentRequest, DialogDeleteRequest, DialogHistoryRequest, DialogTitleUpdateRequest
 from model.repositories.user_repository import create_user, get_user_browser_conf, get_user_by_username, set_user_browser_conf
 from service.auth_service import issue_auth_tokens, refresh_access_token, require_auth, revoke_user_tokens, verify_credentials
 from service.chat_service import run_chat_completion
 from service.common_service import generate_sse_error
 from service.dialog_service import delete_user_dialogs, get_dialog_content, get_recent_dialogs, rename_dialog
+from service.host_service import evict_pooled_clients
 from service.image_service import generate_or_edit_image
 from service.model_service import get_cached_models, get_grouped_models
 from service.notification_service import fetch_notification_count, fetch_notifications
 from service.stream_service import cancel_stream_request, stream_chat
 from service.system_prompt_service import fetch_system_prompts_grouped
+from service.upload_service import build_upload_url, is_upload_request_too_large, save_upload_file
 from service.usage_service import get_usage_summary
+from service.user_context_service import invalidate_user_context
 
 
 public_bp = Blueprint("public_routes", __name__, url_prefix="/never_guess_my_usage")
@@ -114,19 +116,24 @@ def allowed_file(filename):
 
 @public_bp.route("/download", methods=["POST"])
 def upload():
-    if "file" not in request.files:
+    too_large_msg = f"more than {runtime_state.settings.upload_max_bytes // (1024 * 1024)}M"
+    # 在解析 multipart 之前按请求头拒绝明显超限的请求；没有 Content-Length 的分块上传由 request_class 在解析时限制
+    if is_upload_request_too_large(request.content_length):
+        return {"msg": too_large_msg}, 200
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        return {"msg": too_large_msg}, 200
+    if "file" not in files:
         return {"msg": "no file"}, 200
-    file = request.files["file"]
+    file = files["file"]
     if file.filename == "":
         return {"msg": "no filename"}, 200
-    if file.content_length > 20 * 1024 * 1024:
-        return {"msg": "more than 20M"}, 200
     if file and allowed_file(file.filename):
-        filename = str(time.time()) + "-" + file.filename
-        file_fullname = os.path.join(runtime_state.settings.upload_dir, filename)
-        file.save(file_fullname)
-        os.chmod(file_fullname, 0o755)
-        return {"content": f":4567/download/{filename}"}, 200
+        saved, error_msg, filename = save_upload_file(file, current_app.logger)
+        if not saved:
+            return {"msg": error_msg}, 200
+        return {"content": build_upload_url(filename)}, 200
     return {"msg": "文件格式不支持，只支持pdf、通用图片等"}, 200
 
 
@@ -134,7 +141,7 @@ def upload():
 @require_auth
 def dialog(user, password):
     payload = ChatRequest.from_data(get_request_data(as_text=True))
-    return run_chat_completion(user, payload, current_app.logger)
+    return run_chat_completion(user, payload, current_app.logger, client_ip=get_client_ip())
 
 
 @public_bp.route("/split_stream", methods=["POST", "GET"])
@@ -142,7 +149,7 @@ def dialog(user, password):
 def dialog_stream(user, password):
     payload = StreamChatRequest.from_data(get_request_data(as_text=True))
     try:
-        return stream_chat(user, payload, current_app.logger)
+        return stream_chat(user, payload, current_app.logger, client_ip=get_client_ip())
     except Exception as exc:
         current_app.logger.error(f"流式对话异常: {exc}")
         return Response(
@@ -173,7 +180,15 @@ def dialog_pic(user, password):
 @require_auth
 def dialog_his(user, password):
     current_app.logger.info(user)
-    return {"content": get_recent_dialogs(user)}, 200
+    try:
+        req = DialogHistoryRequest.from_data(get_request_data(as_text=True))
+        dialogs, next_cursor = get_recent_dialogs(user, cursor=req.cursor, limit=req.limit)
+    except ValueError:
+        # cursor / limit 格式错误（如旧版客户端的游标）
+        return {"msg": "invalid cursor or limit"}, 200
+    if req.limit is None:
+        return {"content": dialogs}, 200
+    return {"content": dialogs, "next_cursor": next_cursor}, 200
 
 
 @public_bp.route("/split_his_content", methods=["POST"])
@@ -248,7 +263,12 @@ def system_prompt():
 @public_bp.route("/system_prompts_by_group", methods=["GET"])
 def get_system_prompts_by_group():
     try:
-        return {"success": True, "groups": fetch_system_prompts_grouped()}, 200
+        groups, version = fetch_system_prompts_grouped()
+        # 以缓存版本作为 ETag，浏览器携带 If-None-Match 重新验证，内容未变时返回 304
+        response = jsonify({"success": True, "groups": groups})
+        response.set_etag(version)
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
     except Exception as exc:
         current_app.logger.error(f"获取按组分类的系统提示词失败: {exc}")
         return {"success": False, "msg": f"获取系统提示词失败: {exc}"}, 200
@@ -302,9 +322,11 @@ def user_reset_password(user, password):
         if req.new_api_key:
             user_obj = get_user_by_username(user)
             if user_obj:
+                evict_pooled_clients(user_obj.api_key)
                 user_obj.api_key = req.new_api_key
                 user_obj.updated_at = datetime.now()
                 user_obj.save()
+                invalidate_user_context(user)
         revoke_user_tokens(user)
         return jsonify({"success": True, "msg": "密码更新成功，请重新登录"})
     except Exception as exc:
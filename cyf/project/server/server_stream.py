@@ -0,0 +1,203 @@
+# 异步流式网关：以 ASGI 方式单独提供 /split_stream 与 /split_stream_cancel，
+# 长时间的 SSE 流不再占用 uwsgi 的 worker 线程。
+# 启动：uvicorn server_stream:app --host 127.0.0.1 --port 39996
+import asyncio
+import json
+import uuid
+from urllib.parse import parse_qsl
+
+from conf.app_factory import create_app
+from conf.logging_config import configure_logging
+from conf.runtime import runtime_state
+from dto.chat_dto import StreamCancelRequest, StreamChatRequest
+from service.async_stream_service import cancel_async_stream_request, stream_chat_events
+from service.auth_service import get_token_payload, verify_credentials
+from service.bootstrap_service import bootstrap_runtime
+from service.common_service import generate_sse_error
+from service.log_writer_service import stop_log_writer
+
+
+ROUTE_PREFIX = "/never_guess_my_usage"
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type,Authorization,X-Requested-With,User-Agent,Cache-Control"),
+    (b"access-control-allow-methods", b"GET,PUT,POST,DELETE,OPTIONS"),
+    (b"access-control-allow-credentials", b"true"),
+]
+SSE_HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+]
+
+# 复用 Flask 应用的日志配置，网关本身不经过 Flask 路由
+flask_app = create_app()
+logger = configure_logging(flask_app)
+# 模型元数据的启动刷新和定时任务由 server.py 负责，网关不重复执行
+bootstrap_runtime(logger, run_scheduler=False)
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def parse_request_data(scope, body: bytes) -> dict:
+    """与 dto.common.get_request_data(as_text=True) 保持一致：JSON 对象或表单 + 查询参数。"""
+    headers = dict(scope.get("headers") or [])
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    data = dict(parse_qsl(scope.get("query_string", b"").decode("utf-8"), keep_blank_values=True))
+    if "application/json" in content_type:
+        try:
+            json_data = json.loads(body or b"{}")
+        except ValueError:
+            json_data = None
+        if isinstance(json_data, dict) and json_data:
+            return {
+                key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+                for key, value in json_data.items()
+            }
+    elif "application/x-www-form-urlencoded" in content_type:
+        data.update(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+    return data
+
+
+def get_client_ip(scope) -> str:
+    """与 dto.common.get_client_ip 一致：优先取反向代理传入的 X-Forwarded-For / X-Real-IP。"""
+    headers = dict(scope.get("headers") or [])
+    forwarded_for = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+    if forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    client = scope.get("client") or ("", 0)
+    return headers.get(b"x-real-ip", b"").decode("latin-1") or client[0] or ""
+
+
+async def authenticate(scope, data: dict) -> tuple[str, str]:
+    """返回 (用户名, 错误信息)，与 require_auth 一致：优先 Bearer 令牌，其次 user/password。"""
+    headers = dict(scope.get("headers") or [])
+    auth_header = headers.get(b"authorization", b"").decode("latin-1")
+    token_msg = ""
+    if auth_header.lower().startswith("bearer "):
+        token_ok, token_msg, token_payload = await asyncio.to_thread(get_token_payload, auth_header[7:].strip(), "access")
+        if token_ok:
+            return token_payload.get("username", ""), ""
+    user = str(data.get("user", "")).strip()
+    password = str(data.get("password", "")).strip()
+    is_valid, error_msg, _ = await asyncio.to_thread(verify_credentials, user, password)
+    if not is_valid:
+        return "", error_msg or token_msg or "认证失败"
+    return user, ""
+
+
+async def send_json(send, payload: dict, status: int = 200):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")] + CORS_HEADERS,
+        }
+    )
+    await send({"type": "http.response.body", "body": json.dumps(payload, ensure_ascii=False).encode("utf-8")})
+
+
+async def send_sse(send, receive, events, request_id: str = ""):
+    await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS + CORS_HEADERS})
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        # 客户端断开后立即停止上游生成，避免继续消耗 token
+        if request_id:
+            await cancel_async_stream_request(request_id)
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        try:
+            async for event in events:
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+        except OSError:
+            logger.info(f"流式客户端已断开: {request_id}")
+            return
+        except Exception as exc:
+            logger.error(f"流式对话异常: {exc}")
+            for event in generate_sse_error(f"流式对话异常: {str(exc)}", "GENERAL_ERROR"):
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        watcher.cancel()
+        await events.aclose()
+
+
+async def handle_split_stream(scope, receive, send, data: dict, user: str):
+    payload = StreamChatRequest.from_data(data)
+    # 断连时按 request_id 取消上游，客户端未传时由网关生成
+    payload.request_id = payload.request_id or uuid.uuid4().hex
+    await send_sse(send, receive, stream_chat_events(user, payload, logger, get_client_ip(scope)), payload.request_id)
+
+
+async def handle_split_stream_cancel(scope, receive, send, data: dict, user: str):
+    payload = StreamCancelRequest.from_data(data)
+    if not payload.request_id:
+        await send_json(send, {"success": False, "msg": "missing request_id"})
+        return
+    cancelled = await cancel_async_stream_request(payload.request_id)
+    await send_json(send, {"success": cancelled, "msg": "cancelled" if cancelled else "not_found"})
+
+
+ROUTES = {
+    f"{ROUTE_PREFIX}/split_stream": (("GET", "POST"), handle_split_stream),
+    f"{ROUTE_PREFIX}/split_stream_cancel": (("POST",), handle_split_stream_cancel),
+}
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if runtime_state.async_http_client is not None:
+                await runtime_state.async_http_client.aclose()
+            # 退出前写完队列中剩余的调用日志
+            await asyncio.to_thread(stop_log_writer, logger)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    method = scope["method"]
+    route = ROUTES.get(scope["path"].rstrip("/"))
+    if method == "OPTIONS":
+        await send_json(send, {"status": "OK"})
+        return
+    if route is None:
+        await send_json(send, {"success": False, "msg": "not found"}, status=404)
+        return
+    methods, handler = route
+    if method not in methods:
+        await send_json(send, {"success": False, "msg": "method not allowed"}, status=405)
+        return
+    data = parse_request_data(scope, await read_body(receive))
+    user, auth_error = await authenticate(scope, data)
+    if auth_error:
+        await send_json(send, {"success": False, "msg": auth_error}, status=401)
+        return
+    await handler(scope, receive, send, data, user)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("server_stream:app", host="0.0.0.0", port=39996)
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import time
+import uuid
+from contextlib import aclosing
+
+from conf.runtime import runtime_state
+from service.common_service import generate_sse_error, handle_api_exception
+from service.host_service import (
+    begin_host_request,
+    end_host_request,
+    get_async_client_for_url_index,
+    get_user_api_key,
+    is_host_failure,
+    is_shared_api_key,
+    select_host_index,
+)
+from service.quota_service import acquire_quota_async, release_quota
+from service.stream_pipeline import DeltaCoalescer, iter_chunks_with_flush_deadline
+from service.stream_service import (
+    build_stream_api_params,
+    cancel_stream_request,
+    cleanup_stream_request,
+    finish_stream_chat,
+    is_stream_cancelled,
+    prepare_stream_chat,
+    register_stream_request,
+)
+
+
+def _set_async_stream(request_id: str, stream_obj):
+    with runtime_state.stream_cancel_lock:
+        entry = runtime_state.stream_cancel_registry.get(request_id)
+        if entry is not None:
+            entry["async_stream"] = stream_obj
+
+
+async def cancel_async_stream_request(request_id: str) -> bool:
+    with runtime_state.stream_cancel_lock:
+        entry = runtime_state.stream_cancel_registry.get(request_id)
+        stream_obj = entry.get("async_stream") if entry else None
+    cancelled = await asyncio.to_thread(cancel_stream_request, request_id)
+    if stream_obj is not None:
+        try:
+            await stream_obj.close()
+        except Exception:
+            pass
+    return cancelled
+
+
+async def open_async_chat_stream_with_failover(user: str, api_params: dict, request_id: str, logger) -> tuple:
+    """异步版本的首 token 前换 host 重试，返回 (首批分片, 流, url_index, host_started_at)。"""
+    settings = runtime_state.settings
+    deadline = time.time() + settings.request_deadline_seconds
+    api_key = await asyncio.to_thread(get_user_api_key, user)
+    shared_key = is_shared_api_key(api_key)
+    tried_indices = []
+    last_exc = None
+    for attempt in range(max(1, settings.failover_max_attempts)):
+        if time.time() >= deadline:
+            break
+        url_index = select_host_index(tried_indices)
+        tried_indices.append(url_index)
+        client = get_async_client_for_url_index(url_index, api_key)
+        host_started_at = begin_host_request(url_index)
+        stream = None
+        try:
+            stream = await client.with_options(max_retries=0).chat.completions.create(**api_params)
+            _set_async_stream(request_id, stream)
+            prefetched = []
+            async for chunk in stream:
+                prefetched.append(chunk)
+                if chunk.choices and (chunk.choices[0].delta.content or chunk.choices[0].finish_reason):
+                    break
+            return prefetched, stream, url_index, host_started_at
+        except Exception as exc:
+            end_host_request(url_index, host_started_at, exc=exc, logger=logger, shared_key=shared_key)
+            if stream is not None:
+                try:
+                    await stream.close()
+                except Exception:
+                    pass
+            if not is_host_failure(exc) or is_stream_cancelled(request_id):
+                raise
+            last_exc = exc
+            logger.warning(f"上游流式请求失败（第 {attempt + 1} 次，host={settings.api_hosts[url_index]}），准备换 host 重试: {exc}")
+    raise last_exc or TimeoutError(f"上游流式请求超过 {settings.request_deadline_seconds} 秒仍未开始")
+
+
+async def _iter_stream_chunks(prefetched: list, stream):
+    for chunk in prefetched:
+        yield chunk
+    async for chunk in stream:
+        yield chunk
+
+
+async def stream_chat_events(user: str, payload, logger, client_ip: str = ""):
+    """异步流式对话，产出与 stream_service.stream_chat 相同格式的 SSE 事件。
+
+    数据库读写、附件转换等阻塞操作放到线程池执行，事件循环只负责上游流的转发。
+    """
+    request_id = payload.request_id or uuid.uuid4().hex
+    error_events, dialogvo, title = await asyncio.to_thread(prepare_stream_chat, user, payload, logger, client_ip)
+    if error_events is not None:
+        for event in error_events:
+            yield event
+        return
+    cancel_flag = await asyncio.to_thread(register_stream_request, request_id, logger)
+    coalescer = DeltaCoalescer(runtime_state.settings.stream_flush_bytes, runtime_state.settings.stream_flush_interval_ms)
+    was_cancelled = False
+    url_index = None
+    host_started_at = None
+    first_token_ms = None
+    stream = None
+    quota_acquired = False
+    shared_key = True
+    try:
+        if cancel_flag.is_set():
+            return
+        # 排队等待配额时在事件循环中等待，不占用线程池
+        quota_error = await acquire_quota_async(user, payload.model, logger)
+        if not quota_error["success"]:
+            for event in generate_sse_error(quota_error["msg"], quota_error["error_type"]):
+                yield event
+            return
+        quota_acquired = True
+        shared_key = is_shared_api_key(await asyncio.to_thread(get_user_api_key, user))
+        api_params = await asyncio.to_thread(build_stream_api_params, user, payload.model, dialogvo, title, payload, logger)
+        prefetched, stream, url_index, host_started_at = await open_async_chat_stream_with_failover(
+            user, api_params, request_id, logger
+        )
+        finish_reason = None
+        usage = None
+        async with aclosing(iter_chunks_with_flush_deadline(_iter_stream_chunks(prefetched, stream), coalescer)) as chunks:
+            async for chunk in chunks:
+                if cancel_flag.is_set():
+                    was_cancelled = True
+                    break
+                if chunk is None:
+                    yield coalescer.flush()
+                    continue
+                if chunk.choices:
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        if first_token_ms is None:
+                            first_token_ms = (time.time() - host_started_at) * 1000
+                        frame = coalescer.feed(delta.content)
+                        if frame:
+                            yield frame
+                    if chunk.choices[0].finish_reason:
+                        finish_reason = chunk.choices[0].finish_reason
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+        end_host_request(
+            url_index, host_started_at, latency_ms=first_token_ms, logger=logger, record_latency=first_token_ms is not None
+        )
+        host_started_at = None
+        if was_cancelled:
+            return
+        frame = coalescer.flush()
+        if frame:
+            yield frame
+        yield await asyncio.to_thread(
+            finish_stream_chat, user, payload, dialogvo, title, coalescer.content, finish_reason, api_params, usage
+        )
+    except Exception as api_exc:
+        if cancel_flag.is_set():
+            # 取消时主动关闭上游连接引发的异常，不计入 host 失败
+            return
+        if host_started_at is not None:
+            end_host_request(url_index, host_started_at, exc=api_exc, logger=logger, shared_key=shared_key)
+            host_started_at = None
+        error_response = await asyncio.to_thread(
+            handle_api_exception, api_exc, logger, user=user, model=payload.model, dialog_content=payload.dialog, url_index=url_index
+        )
+        yield f"data: {json.dumps({'content': error_response.get('msg', 'API请求失败'), 'done': True, 'error': error_response})}\n\n"
+    finally:
+        if host_started_at is not None:
+            end_host_request(
+                url_index, host_started_at, latency_ms=first_token_ms, logger=logger, record_latency=first_token_ms is not None
+            )
+        if stream is not None:
+            try:
+                await stream.close()
+            except Exception:
+                pass
+        if quota_acquired:
+            release_quota(user, payload.model)
+        await asyncio.to_thread(cleanup_stream_request, request_id)
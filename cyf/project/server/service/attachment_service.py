@@ -0,0 +1,147 @@
+import time
+
+import requests
+
+from conf.runtime import runtime_state
+from service.message_normalizer import build_file_result
+from service.upload_service import (
+    get_upload_file_validator,
+    guess_upload_content_type,
+    read_upload_file,
+    resolve_local_upload_path,
+)
+
+
+def _get_cache_entry(url: str):
+    with runtime_state.attachment_cache_lock:
+        entry = runtime_state.attachment_cache.get(url)
+        if entry is not None:
+            runtime_state.attachment_cache.move_to_end(url)
+        return entry
+
+
+def _put_cache_entry(url: str, result, etag: str, size: int):
+    settings = runtime_state.settings
+    entry_bytes = len(result.data) if result is not None else 0
+    if entry_bytes > settings.attachment_cache_max_entry_bytes:
+        return
+    entry = {
+        "result": result,
+        "etag": etag,
+        "size": size,
+        "bytes": entry_bytes,
+        "cached_until": time.time() + settings.attachment_cache_ttl_seconds,
+    }
+    with runtime_state.attachment_cache_lock:
+        cache = runtime_state.attachment_cache
+        previous = cache.pop(url, None)
+        if previous is not None:
+            runtime_state.attachment_cache_stats["bytes"] -= previous["bytes"]
+        cache[url] = entry
+        runtime_state.attachment_cache_stats["bytes"] += entry_bytes
+        while cache and runtime_state.attachment_cache_stats["bytes"] > settings.attachment_cache_max_bytes:
+            _, evicted = cache.popitem(last=False)
+            runtime_state.attachment_cache_stats["bytes"] -= evicted["bytes"]
+            runtime_state.attachment_cache_stats["evictions"] += 1
+
+
+def _record_stat(name: str):
+    with runtime_state.attachment_cache_lock:
+        runtime_state.attachment_cache_stats[name] += 1
+
+
+def _refresh_entry(entry: dict):
+    with runtime_state.attachment_cache_lock:
+        entry["cached_until"] = time.time() + runtime_state.settings.attachment_cache_ttl_seconds
+
+
+def _is_unchanged(url: str, entry: dict, timeout: int) -> bool:
+    """缓存过期后向源站确认内容是否变化：有 ETag 用 If-None-Match，否则比较 Content-Length。"""
+    if entry["etag"]:
+        response = requests.head(url, timeout=timeout, headers={"If-None-Match": entry["etag"]}, allow_redirects=True)
+        return response.status_code == 304 or (response.status_code == 200 and response.headers.get("ETag") == entry["etag"])
+    response = requests.head(url, timeout=timeout, allow_redirects=True)
+    content_length = response.headers.get("Content-Length")
+    return response.status_code == 200 and content_length is not None and int(content_length) == entry["size"]
+
+
+def _fetch_local_attachment(url: str, local_path: str, logger=None):
+    validator = get_upload_file_validator(local_path)
+    entry = _get_cache_entry(url)
+    if entry is not None and entry["etag"] == validator:
+        _record_stat("hits")
+        return entry["result"]
+    _record_stat("misses")
+    file_data = read_upload_file(local_path)
+    if len(file_data) == 0:
+        return None
+    result = build_file_result(url, guess_upload_content_type(local_path), file_data, logger)
+    _put_cache_entry(url, result, validator, len(file_data))
+    return result
+
+
+def fetch_attachment(url: str, logger=None, timeout: int = 30):
+    """获取单个附件的多模态处理结果，按 URL + ETag/大小 缓存；本服务的上传文件直接读本地。"""
+    local_path = resolve_local_upload_path(url)
+    if local_path is not None:
+        try:
+            return _fetch_local_attachment(url, local_path, logger)
+        except OSError as exc:
+            if logger:
+                logger.warning(f"读取本地上传文件失败，改为 HTTP 下载: {local_path}, err={exc}")
+    entry = _get_cache_entry(url)
+    if entry is not None:
+        if entry["cached_until"] > time.time():
+            _record_stat("hits")
+            return entry["result"]
+        try:
+            if _is_unchanged(url, entry, timeout):
+                _refresh_entry(entry)
+                _record_stat("revalidated")
+                return entry["result"]
+        except Exception as exc:
+            if logger:
+                logger.warning(f"附件缓存校验失败，重新下载: {url}, err={exc}")
+    _record_stat("misses")
+    try:
+        response = requests.get(url, timeout=timeout)
+        if response.status_code != 200:
+            if logger:
+                logger.error(f"下载文件失败: {url}, status={response.status_code}")
+            return None
+        file_data = response.content
+        if len(file_data) == 0:
+            return None
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        result = build_file_result(url, content_type, file_data, logger)
+    except Exception as exc:
+        if logger:
+            logger.error(f"下载文件异常: {url}, err={exc}")
+        return None
+    # 不支持的格式同样缓存，避免每轮对话重复下载
+    _put_cache_entry(url, result, response.headers.get("ETag", ""), len(file_data))
+    return result
+
+
+def fetch_attachments(urls: list, logger=None, timeout: int = 30) -> dict:
+    """去重后并发获取多个附件，返回 {url: 处理结果}；并发度由进程级共享线程池限制。"""
+    unique_urls = list(dict.fromkeys(urls))
+    if len(unique_urls) <= 1:
+        return {url: fetch_attachment(url, logger=logger, timeout=timeout) for url in unique_urls}
+    executor = runtime_state.build_attachment_executor()
+    results = executor.map(lambda url: fetch_attachment(url, logger=logger, timeout=timeout), unique_urls)
+    return dict(zip(unique_urls, results))
+
+
+def get_attachment_cache_snapshot() -> dict:
+    settings = runtime_state.settings
+    with runtime_state.attachment_cache_lock:
+        stats = dict(runtime_state.attachment_cache_stats)
+        entry_count = len(runtime_state.attachment_cache)
+    lookups = stats["hits"] + stats["revalidated"] + stats["misses"]
+    return {
+        "entries": entry_count,
+        "capacity_bytes": settings.attachment_cache_max_bytes,
+        "hit_rate": round((stats["hits"] + stats["revalidated"]) / lookups, 4) if lookups else 0,
+        **stats,
+    }
@@ -1,6 +1,7 @@
 import secrets
 import time
 from functools import wraps
+from typing import Optional
 
 from flask import request
 
@@ -11,9 +12,11 @@ from model.repositories.user_repository import (
     get_active_token_count,
     get_user_by_username,
     get_user_token_payload,
+    hash_token,
     set_user_token_payload,
     verify_user_password,
 )
+from service.user_context_service import remember_user_context
 
 
 def _now_ts() -> int:
@@ -30,6 +33,40 @@ def _extract_bearer_token() -> str:
     return ""
 
 
+def _get_cached_token(token_type: str, token_hash: str) -> Optional[dict]:
+    with runtime_state.token_cache_lock:
+        entry = runtime_state.token_cache.get((token_type, token_hash))
+        if not entry:
+            return None
+        if entry["cached_until"] <= time.time():
+            runtime_state.token_cache.pop((token_type, token_hash), None)
+            return None
+        return entry
+
+
+def _cache_token(token_type: str, token_hash: str, username: str, role: str, token_payload: dict):
+    ttl = runtime_state.settings.token_cache_ttl_seconds
+    if ttl <= 0:
+        return
+    with runtime_state.token_cache_lock:
+        runtime_state.token_cache[(token_type, token_hash)] = {
+            "username": username,
+            "role": role,
+            "payload": token_payload,
+            "cached_until": time.time() + ttl,
+        }
+
+
+def invalidate_token_cache(username: str = None):
+    with runtime_state.token_cache_lock:
+        if username is None:
+            runtime_state.token_cache.clear()
+            return
+        stale_keys = [key for key, entry in runtime_state.token_cache.items() if entry["username"] == username]
+        for key in stale_keys:
+            runtime_state.token_cache.pop(key, None)
+
+
 def issue_auth_tokens(username: str, role: str) -> dict:
     now_ts = _now_ts()
     token_bundle = {
@@ -41,6 +78,7 @@ def issue_auth_tokens(username: str, role: str) -> dict:
         "role": role,
     }
     set_user_token_payload(username, token_bundle)
+    invalidate_token_cache(username)
     return token_bundle
 
 
@@ -58,29 +96,40 @@ def issue_access_token(username: str, role: str, session_id: str) -> dict:
         }
     )
     set_user_token_payload(username, token_payload)
+    invalidate_token_cache(username)
     return {"access_token": access_token, "access_token_expires_at": access_expires_at}
 
 
 def get_token_payload(token: str, token_type: str) -> tuple[bool, str, dict]:
     if not token:
         return False, "缺少令牌", {}
-    found = find_user_by_token(token, token_type)
-    if not found:
-        return False, "令牌无效或已过期", {}
-    user_obj, token_payload = found
+    token_hash = hash_token(token)
+    cached = _get_cached_token(token_type, token_hash)
+    if cached:
+        username, user_role, token_payload = cached["username"], cached["role"], cached["payload"]
+    else:
+        found = find_user_by_token(token, token_type)
+        if not found:
+            return False, "令牌无效或已过期", {}
+        user_obj, token_payload = found
+        username, user_role = user_obj.username, user_obj.role
+        remember_user_context(user_obj)
+        _cache_token(token_type, token_hash, username, user_role, token_payload)
     expire_key = "access_token_expires_at" if token_type == "access" else "refresh_token_expires_at"
     if int(token_payload.get(expire_key, 0) or 0) <= _now_ts():
-        set_user_token_payload(user_obj.username, None)
+        set_user_token_payload(username, None)
+        invalidate_token_cache(username)
         return False, "令牌已过期", {}
     return True, "", {
-        "username": user_obj.username,
-        "role": token_payload.get("role", user_obj.role),
+        "username": username,
+        "role": token_payload.get("role", user_role),
         "session_id": token_payload.get("session_id", ""),
     }
 
 
 def revoke_user_tokens(username: str):
     set_user_token_payload(username, None)
+    invalidate_token_cache(username)
 
 
 def authenticate_request_token(required_role: str = None) -> tuple[bool, str, dict]:
@@ -3,15 +3,18 @@ import threading
 
 from conf.runtime import runtime_state
 from model.db import init_db
-from model.entities import ALL_MODELS, ModelMeta, User
+from model.entities import ALL_MODELS, Dialog, Log, ModelMeta, User
+from model.repositories.user_repository import backfill_user_token_hashes
 from quant.db import init_quant_db
 from quant.entities import QUANT_MODELS
-from service.host_service import start_blacklist_cleanup_thread
-from service.model_service import invalidate_model_cache, seconds_until_next
+from service.log_writer_service import start_log_writer
+from service.model_service import invalidate_model_cache, seconds_until_next, start_model_cache_refresher
+from service.stream_service import start_stream_cancel_poller
 
 
 def initialize_database():
-    init_db(ALL_MODELS, User, ModelMeta)
+    init_db(ALL_MODELS, User, ModelMeta, Log, Dialog)
+    backfill_user_token_hashes()
     init_quant_db(QUANT_MODELS)
 
 
@@ -56,9 +59,13 @@ def start_model_meta_scheduler(logger):
     schedule_next_model_meta_refresh(logger)
 
 
-def bootstrap_runtime(logger):
+def bootstrap_runtime(logger, run_scheduler: bool = True):
+    """初始化进程运行时；模型元数据定时任务只应在一个入口运行，其他入口传 run_scheduler=False。"""
     initialize_database()
     ensure_quant_runtime_dirs()
     runtime_state.build_clients()
-    start_blacklist_cleanup_thread()
-    start_model_meta_scheduler(logger)
+    if run_scheduler:
+        start_model_meta_scheduler(logger)
+    start_model_cache_refresher(logger)
+    start_stream_cancel_poller(logger)
+    start_log_writer(logger)
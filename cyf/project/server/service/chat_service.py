@@ -1,15 +1,23 @@
 import json
+import time
 import uuid
 
 from openai.types.chat import ChatCompletionUserMessageParam
 
 from conf.runtime import runtime_state
-from model.repositories.log_repository import set_dialog, set_log
-from model.repositories.model_meta_repository import get_system_prompt_by_id
-from model.repositories.user_repository import check_test_limit_exceeded, get_user_api_key, increment_test_limit
+from model.repositories.log_repository import set_dialog
 from service.common_service import handle_api_exception
+from service.context_budget_service import apply_context_budget
 from service.dialog_context_service import build_dialog_context_payload, current_time_str, stamp_latest_user_message
-from service.host_service import get_client_for_user
+from service.host_service import (
+    get_client_for_user,
+    get_current_url_index,
+    get_user_api_key,
+    is_host_failure,
+    is_shared_api_key,
+    track_host_request,
+)
+from service.log_writer_service import record_log
 from service.message_normalizer import (
     build_parts_from_message,
     convert_dialog_for_multimodal,
@@ -18,6 +26,11 @@ from service.message_normalizer import (
     strip_file_url_markers,
 )
 from service.model_service import is_valid_model
+from service.quota_service import acquire_quota, record_quota_tokens, release_quota
+from service.rate_limit_service import check_rate_limit
+from service.response_cache_service import build_response_cache_key, get_cached_response, store_cached_response
+from service.single_flight_service import build_completion_key, run_single_flight
+from service.system_prompt_service import fetch_system_prompt
 
 
 def is_gemini_model(model_name: str) -> bool:
@@ -52,7 +65,7 @@ def convert_dialog_for_model(dialogvo: list, model: str, logger=None) -> list:
     if is_gemini_model(model):
         return [convert_message_for_gemini(msg) for msg in dialogvo]
     if is_multimodal_model(model):
-        return convert_dialog_for_multimodal(dialogvo, logger=logger)
+        return convert_dialog_for_multimodal(dialogvo, logger=logger, model=model)
     return dialogvo
 
 
@@ -78,28 +91,12 @@ def parse_dialog_mode(dialogs, dialog_mode, dialog_title=None):
     return dialogvo, title
 
 
-def check_test_user_limit(user: str) -> dict:
-    default_test_api_key = runtime_state.settings.default_api_key
-    user_api_key = get_user_api_key(user)
-    is_test_key_user = (not user_api_key) or (user_api_key == default_test_api_key)
-    if not is_test_key_user:
-        return {"success": True}
-    if check_test_limit_exceeded(user, runtime_state.settings.test_ip_default_limit):
-        return {
-            "success": False,
-            "msg": runtime_state.settings.test_exceed_msg,
-            "error_type": "TEST_LIMIT_EXCEEDED",
-        }
-    increment_test_limit(user, runtime_state.settings.test_ip_default_limit)
-    return {"success": True}
-
-
 def prepare_dialog(dialogs: str, dialog_mode: str, dialog_title: str, system_prompt_id: str, logger):
     dialogvo, title = parse_dialog_mode(dialogs, dialog_mode, dialog_title)
     if dialogvo is None:
         return None, title
     if system_prompt_id:
-        system_prompt = get_system_prompt_by_id(int(system_prompt_id))
+        system_prompt = fetch_system_prompt(system_prompt_id)
         if system_prompt:
             dialogvo = [msg for msg in dialogvo if msg.get("role") != "system"]
             dialogvo.insert(0, {"role": "system", "content": system_prompt["role_content"]})
@@ -107,27 +104,102 @@ def prepare_dialog(dialogs: str, dialog_mode: str, dialog_title: str, system_pro
     return dialogvo, title
 
 
-def run_chat_completion(user: str, payload, logger):
+def create_chat_completion_with_failover(user: str, api_params: dict, logger):
+    """非流式请求在 host 失败时换 host 重试，受 request_deadline_seconds 总时长约束。"""
+    settings = runtime_state.settings
+    deadline = time.time() + settings.request_deadline_seconds
+    shared_key = is_shared_api_key(get_user_api_key(user))
+    tried_indices = []
+    last_exc = None
+    for attempt in range(max(1, settings.failover_max_attempts)):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        client, url_index = get_client_for_user(user, exclude_indices=tried_indices)
+        tried_indices.append(url_index)
+        try:
+            # 非流式耗时取决于回答长度，不计入 host 延迟 EWMA
+            with track_host_request(url_index, logger=logger, shared_key=shared_key, record_latency=False):
+                # 由本层负责换 host 重试，关闭 SDK 对同一 host 的内部重试
+                result = client.with_options(max_retries=0, timeout=remaining).chat.completions.create(**api_params)
+            return result, url_index
+        except Exception as exc:
+            if not is_host_failure(exc):
+                raise
+            last_exc = exc
+            logger.warning(f"上游请求失败（第 {attempt + 1} 次，host={settings.api_hosts[url_index]}），准备换 host 重试: {exc}")
+    raise last_exc or TimeoutError(f"上游请求超过 {settings.request_deadline_seconds} 秒仍未完成")
+
+
+def request_chat_completion(user: str, api_params: dict, logger, cache_key: str = None) -> tuple:
+    """请求上游并返回 (result, 是否复用)；同一用户并发的相同请求合并为一次上游调用，复用的结果不再记录日志和用量。
+
+    传入 cache_key 时先查询响应缓存，未命中时把新结果写入缓存。
+    """
+    if cache_key:
+        cached = get_cached_response(cache_key, logger)
+        if cached is not None:
+            return cached, True
+    if not runtime_state.settings.single_flight_enabled:
+        result, _ = create_chat_completion_with_failover(user, api_params, logger)
+        shared = False
+    else:
+        result, shared = run_single_flight(
+            build_completion_key(user, api_params),
+            lambda: create_chat_completion_with_failover(user, api_params, logger)[0],
+            cacheable=api_params.get("temperature") == 0,
+        )
+    if cache_key and not shared:
+        store_cached_response(cache_key, api_params["model"], result, logger)
+    return result, shared
+
+
+def run_chat_completion(user: str, payload, logger, client_ip: str = ""):
     model = payload.model
     if not is_valid_model(model):
         return {"msg": "not supported user or model"}, 200
-    limit_error = check_test_user_limit(user)
+    limit_error = check_rate_limit(user, model, client_ip)
     if not limit_error["success"]:
         return limit_error, 200
+    quota_error = acquire_quota(user, model, logger)
+    if not quota_error["success"]:
+        return quota_error, 200
+    try:
+        return complete_chat(user, payload, logger)
+    finally:
+        release_quota(user, model)
+
+
+def complete_chat(user: str, payload, logger):
+    """已通过校验并占用配额后，请求上游并保存日志与对话。"""
+    model = payload.model
     dialogs = payload.dialog
     dialogvo, title = prepare_dialog(dialogs, payload.dialog_mode, payload.dialog_title, payload.system_prompt_id, logger)
     if dialogvo is None:
         return {"msg": title}, 200
+    budget_messages, max_tokens = apply_context_budget(user, model, dialogvo, title, payload.max_response_tokens, logger)
     api_params = {
         "model": model,
-        "messages": convert_dialog_for_model(dialogvo, model, logger=logger),
-        "max_tokens": payload.max_response_tokens or 102400,
+        "messages": convert_dialog_for_model(budget_messages, model, logger=logger),
+        "max_tokens": max_tokens,
     }
+    if payload.temperature is not None:
+        api_params["temperature"] = payload.temperature
     try:
-        client, url_index = get_client_for_user(user)
-        result = client.chat.completions.create(**api_params)
-        tokens = result.usage.total_tokens
-        set_log(user, tokens, model, json.dumps(result.to_dict()))
+        cache_key = build_response_cache_key(user, payload, api_params)
+        result, shared = request_chat_completion(user, api_params, logger, cache_key=cache_key)
+        if not shared:
+            tokens = result.usage.total_tokens
+            record_log(
+                user,
+                tokens,
+                model,
+                json.dumps(result.to_dict()),
+                prompt_tokens=result.usage.prompt_tokens or 0,
+                completion_tokens=result.usage.completion_tokens or 0,
+                logger=logger,
+            )
+            record_quota_tokens(user, model, tokens)
         request_messages = stamp_latest_user_message(dialogvo)
         assistant_time = current_time_str()
         assistant_message = result.choices[0].message.to_dict()
@@ -139,7 +211,8 @@ def run_chat_completion(user: str, payload, logger):
             model,
             "chat",
             title,
-            build_dialog_context_payload(request_messages + [assistant_message], payload.role_setting),
+            build_dialog_context_payload([], payload.role_setting),
+            messages=request_messages + [assistant_message],
         )
         response_data = {
             "role": result.choices[0].message.role,
@@ -152,4 +225,4 @@ def run_chat_completion(user: str, payload, logger):
             response_data["dialog_id"] = dialog_id
         return response_data, 200
     except Exception as api_exc:
-        return handle_api_exception(api_exc, logger, user=user, model=model, dialog_content=dialogs, url_index=url_index), 200
+        return handle_api_exception(api_exc, logger, user=user, model=model, dialog_content=dialogs, url_index=get_current_url_index()), 200
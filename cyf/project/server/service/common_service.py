@@ -2,17 +2,17 @@ import json
 
 from openai import APIError, AuthenticationError, RateLimitError
 
-from model.repositories.log_repository import set_log
-from service.host_service import blacklist_host
+from conf.runtime import runtime_state
+from service.log_writer_service import record_log
 
 
 def handle_api_exception(exc, logger, user=None, model=None, dialog_content=None, url_index=None):
-    logger.error(f"API请求异常: {str(exc)}, 类型: {type(exc).__name__}")
+    # host 健康度由 host_service.track_host_request 记录，这里只负责日志和错误响应
+    host = runtime_state.settings.api_hosts[url_index] if url_index is not None else "-"
+    logger.error(f"API请求异常: {str(exc)}, 类型: {type(exc).__name__}, host: {host}")
     if user and model:
         error_msg = f"API Error: {str(exc)}"
-        set_log(user, 0, model, json.dumps({"error": error_msg, "content": dialog_content or ""}))
-    if url_index is not None:
-        blacklist_host(url_index, logger=logger)
+        record_log(user, 0, model, json.dumps({"error": error_msg, "content": dialog_content or ""}), logger=logger)
     if isinstance(exc, AuthenticationError):
         error_details = getattr(exc, "body", {}) or {}
         error_message = error_details.get("message", str(exc)) if isinstance(error_details, dict) else str(exc)
@@ -0,0 +1,162 @@
+import hashlib
+import json
+
+from conf.runtime import runtime_state
+from model.repositories.log_repository import get_dialog_summary, set_dialog_summary
+from service.log_writer_service import record_log
+from service.message_normalizer import strip_file_url_markers
+from service.token_counter import MESSAGE_OVERHEAD_TOKENS, count_message_tokens
+
+
+DEFAULT_MAX_RESPONSE_TOKENS = 102400
+# 生成新摘要时只保留预算该比例内的近期对话，留出余量让后续几轮无需再次摘要
+SUMMARY_TRIM_RATIO = 0.6
+SUMMARY_PROMPT = (
+    "你是对话摘要助手。请把下面的历史对话压缩成一段简洁的摘要，保留用户的目标、已确认的事实、"
+    "重要的约束与结论，以及尚未解决的问题。如果提供了之前的摘要，请将其与新内容合并。只输出摘要正文。"
+)
+
+
+def get_context_window(model: str) -> int:
+    from service.model_service import get_model_record
+
+    record = get_model_record(model)
+    if not record:
+        return 0
+    return int(record["model"].get("context_window", 0) or 0)
+
+
+def _split_system_messages(dialogvo: list) -> tuple:
+    index = 0
+    while index < len(dialogvo) and dialogvo[index].get("role") == "system":
+        index += 1
+    return dialogvo[:index], dialogvo[index:]
+
+
+def _select_recent_start(messages: list, budget: int, model: str) -> int:
+    """从末尾向前累加 token，返回预算内保留部分的起始下标；最后一条消息总是保留。"""
+    used = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        cost = count_message_tokens([messages[index]], model)
+        if used + cost > budget and start < len(messages):
+            break
+        used += cost
+        start = index
+    # 保留部分以 user 消息开头，避免上游拒绝以 assistant 开头的对话
+    while start < len(messages) - 1 and messages[start].get("role") != "user":
+        start += 1
+    return start
+
+
+def _digest_messages(messages: list) -> str:
+    payload = json.dumps([[msg.get("role"), msg.get("content")] for msg in messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        content = "\n".join(part.get("text", "") for part in content if isinstance(part, dict) and part.get("type") == "text")
+    return strip_file_url_markers(content or "")
+
+
+def _load_summary(user: str, title: str, messages: list):
+    """读取对话记录上的滚动摘要，覆盖范围内的消息被修改过时视为失效。"""
+    raw_summary = get_dialog_summary(user, "chat", title)
+    if not raw_summary:
+        return None
+    try:
+        summary = json.loads(raw_summary)
+    except ValueError:
+        return None
+    covered = int(summary.get("covered", 0))
+    if covered <= 0 or covered >= len(messages) or summary.get("digest") != _digest_messages(messages[:covered]):
+        return None
+    return summary
+
+
+def _summarize_messages(user: str, previous_text: str, messages: list, logger) -> str:
+    from service.chat_service import create_chat_completion_with_failover
+
+    settings = runtime_state.settings
+    transcript = "\n\n".join(f"{msg.get('role')}: {_message_text(msg)}" for msg in messages)
+    if previous_text:
+        transcript = f"之前的摘要：\n{previous_text}\n\n新增的历史对话：\n{transcript}"
+    api_params = {
+        "model": settings.dialog_summary_model,
+        "messages": [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+        "max_tokens": settings.dialog_summary_max_tokens,
+    }
+    result, _ = create_chat_completion_with_failover(user, api_params, logger)
+    if result.usage:
+        record_log(
+            user,
+            result.usage.total_tokens,
+            settings.dialog_summary_model,
+            json.dumps({"content": result.choices[0].message.content, "purpose": "dialog_summary"}),
+            prompt_tokens=result.usage.prompt_tokens or 0,
+            completion_tokens=result.usage.completion_tokens or 0,
+            logger=logger,
+        )
+    return (result.choices[0].message.content or "").strip()
+
+
+def _build_summary_message(text: str) -> dict:
+    return {"role": "system", "content": f"以下是本次对话早期内容的摘要，供参考：\n{text}"}
+
+
+def _apply_rolling_summary(user: str, model: str, title: str, system_messages: list, messages: list, budget: int, logger):
+    """用滚动摘要替换早期对话，返回新的消息列表；摘要生成失败时返回 None，由调用方退回直接裁剪。"""
+    settings = runtime_state.settings
+    recent_budget = budget - settings.dialog_summary_max_tokens - MESSAGE_OVERHEAD_TOKENS
+    if recent_budget <= 0:
+        return None
+    summary = _load_summary(user, title, messages)
+    if summary is not None and count_message_tokens(messages[summary["covered"]:], model) <= recent_budget:
+        return system_messages + [_build_summary_message(summary["text"])] + messages[summary["covered"]:]
+
+    start = _select_recent_start(messages, int(recent_budget * SUMMARY_TRIM_RATIO), model)
+    previous_text = summary["text"] if summary else ""
+    summarize_from = summary["covered"] if summary else 0
+    try:
+        text = _summarize_messages(user, previous_text, messages[summarize_from:start], logger)
+    except Exception as exc:
+        logger.warning(f"生成对话摘要失败，改为直接裁剪: {exc}")
+        return None
+    if not text:
+        return None
+    set_dialog_summary(
+        user, "chat", title, json.dumps({"covered": start, "digest": _digest_messages(messages[:start]), "text": text}, ensure_ascii=False)
+    )
+    logger.info(f"对话超出上下文预算，已将前 {start} 条消息合并为摘要: {title}")
+    return system_messages + [_build_summary_message(text)] + messages[start:]
+
+
+def apply_context_budget(user: str, model: str, dialogvo: list, title: str, max_response_tokens, logger) -> tuple:
+    """按模型上下文窗口裁剪发往上游的对话，返回 (messages, max_tokens)。
+
+    系统提示词始终保留，其余消息从最近一条向前保留到预算用尽；配置了摘要模型时，被裁掉的部分以滚动摘要代替。
+    模型未配置上下文窗口时原样返回。
+    """
+    max_tokens = max_response_tokens or DEFAULT_MAX_RESPONSE_TOKENS
+    context_window = get_context_window(model)
+    if context_window <= 0:
+        return dialogvo, max_tokens
+    # 为回答预留至多 1/4 的窗口，其余作为输入预算
+    budget = context_window - min(max_tokens, context_window // 4)
+    system_messages, messages = _split_system_messages(dialogvo)
+    prompt_tokens = count_message_tokens(dialogvo, model)
+    if prompt_tokens <= budget or len(messages) <= 1:
+        return dialogvo, max(1, min(max_tokens, context_window - prompt_tokens))
+
+    history_budget = budget - count_message_tokens(system_messages, model)
+    trimmed = None
+    if runtime_state.settings.dialog_summary_model and title:
+        trimmed = _apply_rolling_summary(user, model, title, system_messages, messages, history_budget, logger)
+    if trimmed is None:
+        start = _select_recent_start(messages, history_budget, model)
+        trimmed = system_messages + messages[start:]
+        logger.info(f"对话超出上下文预算（{prompt_tokens}/{budget} tokens），裁剪早期消息 {start} 条")
+    prompt_tokens = count_message_tokens(trimmed, model)
+    return trimmed, max(1, min(max_tokens, context_window - prompt_tokens))
@@ -64,13 +64,15 @@ def preserve_dialog_messages(messages: List[DialogMessage]) -> List[DialogMessag
 
 
 def stamp_latest_user_message(messages: List[DialogMessage], timestamp: Optional[str] = None) -> List[DialogMessage]:
-    next_messages = preserve_dialog_messages(messages)
+    # 只复制需要补时间戳的那条消息，其余消息按引用保留，长对话每轮不再整体深拷贝
+    next_messages = [message for message in messages if isinstance(message, dict)]
     if not next_messages:
         return next_messages
     stamped_at = timestamp or current_time_str()
-    for message in reversed(next_messages):
-        if message.get("role") == "user":
-            message.setdefault("time", stamped_at)
+    for index in range(len(next_messages) - 1, -1, -1):
+        if next_messages[index].get("role") == "user":
+            if "time" not in next_messages[index]:
+                next_messages[index] = {**next_messages[index], "time": stamped_at}
             break
     return next_messages
 
@@ -1,13 +1,42 @@
 from datetime import datetime, timedelta
 
-from model.repositories.log_repository import delete_dialogs, get_dialog_context, get_dialog_list, update_dialog_title
+from model.repositories.log_repository import (
+    delete_dialogs,
+    get_dialog_context,
+    get_dialog_list,
+    get_dialog_messages,
+    update_dialog_title,
+)
 from service.dialog_context_service import parse_dialog_context
 
 
-def get_recent_dialogs(user: str, days: int = 15):
+# 单页对话数上限
+MAX_DIALOG_PAGE_SIZE = 100
+
+
+def encode_dialog_cursor(item: dict) -> str:
+    return f"{item['start_date'].strftime('%Y-%m-%d')}_{item['id']}"
+
+
+def parse_dialog_cursor(cursor: str) -> tuple:
+    """游标格式为 <start_date>_<id>，自带排序键，对应的对话被删除后仍可继续翻页；格式错误时抛出 ValueError。"""
+    raw_date, _, raw_id = cursor.partition("_")
+    return datetime.strptime(raw_date, "%Y-%m-%d").date(), int(raw_id)
+
+
+def get_recent_dialogs(user: str, days: int = 15, cursor: str = None, limit: int = None):
+    """返回 (对话列表, 下一页游标)；不传 limit 时返回全部近期对话，游标为 None。"""
     min_time = (datetime.now() - timedelta(days=days)).date()
-    dialog_list = get_dialog_list(user, min_time)
-    return [{**item, "start_date": item["start_date"].strftime("%Y-%m-%d")} for item in dialog_list]
+    page_size = None if limit is None else max(1, min(limit, MAX_DIALOG_PAGE_SIZE))
+    # 多取一条判断是否还有下一页
+    dialog_list = get_dialog_list(
+        user, min_time, cursor=parse_dialog_cursor(cursor) if cursor else None, limit=page_size + 1 if page_size else None
+    )
+    next_cursor = None
+    if page_size and len(dialog_list) > page_size:
+        dialog_list = dialog_list[:page_size]
+        next_cursor = encode_dialog_cursor(dialog_list[-1])
+    return [{**item, "start_date": item["start_date"].strftime("%Y-%m-%d")} for item in dialog_list], next_cursor
 
 
 def get_dialog_content(user: str, dialog_id: int):
@@ -15,6 +44,10 @@ def get_dialog_content(user: str, dialog_id: int):
     if not result:
         return None
     context, role_setting = parse_dialog_context(result.context)
+    # 新记录的消息逐条存放在 DialogMessage；尚未迁移的旧记录没有消息行，沿用 context 中的完整对话
+    messages = get_dialog_messages(result.id)
+    if messages:
+        context = messages
     return {"chattype": result.chattype, "context": context, "role_setting": role_setting}
 
 
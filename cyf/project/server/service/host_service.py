@@ -1,51 +1,199 @@
 import random
-import threading
 import time
+from contextlib import contextmanager
 
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI, RateLimitError
 
-from conf.runtime import runtime_state
-from model.repositories.user_repository import get_user_api_key
+from conf.runtime import HostHealth, runtime_state
+from service.user_context_service import get_cached_user_api_key
+
+
+# 半开探测超过该时长未回报结果时视为丢失，允许重新探测
+HALF_OPEN_PROBE_TIMEOUT = 60
+# 错误率按时间半衰，避免偶发失败的 host 因不再被选中而长期被降权
+ERROR_RATE_HALF_LIFE = 60
+
+
+def _get_host_health(url_index: int) -> HostHealth:
+    """调用方需持有 host_health_lock。"""
+    health = runtime_state.host_health.get(url_index)
+    if health is None:
+        health = runtime_state.host_health[url_index] = HostHealth()
+    now = time.time()
+    if health.error_rate and health.error_rate_updated_at:
+        health.error_rate *= 0.5 ** ((now - health.error_rate_updated_at) / ERROR_RATE_HALF_LIFE)
+    health.error_rate_updated_at = now
+    if health.state == "open" and now >= health.open_until:
+        health.state = "half_open"
+        health.probe_started_at = 0.0
+    return health
+
+
+def _is_health_available(health: HostHealth, now: float) -> bool:
+    if health.state == "closed":
+        return True
+    if health.state == "half_open":
+        return not health.probe_started_at or now - health.probe_started_at > HALF_OPEN_PROBE_TIMEOUT
+    return False
+
+
+def _trip_breaker(health: HostHealth, now: float):
+    settings = runtime_state.settings
+    health.open_count += 1
+    open_seconds = min(settings.host_breaker_open_seconds * 2 ** (health.open_count - 1), settings.host_breaker_max_open_seconds)
+    health.state = "open"
+    health.open_until = now + open_seconds
+    health.probe_started_at = 0.0
+
+
+def host_score(health: HostHealth) -> float:
+    # 分数越低越优先：延迟 × 在途请求数，错误率作为惩罚系数
+    return (health.ewma_latency_ms + 1.0) * (health.in_flight + 1) * (1.0 + 4.0 * health.error_rate)
+
+
+def is_host_failure(exc) -> bool:
+    if isinstance(exc, (APIConnectionError, RateLimitError)):
+        return True
+    return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+
+def is_shared_api_key(api_key: str) -> bool:
+    return not api_key or api_key == runtime_state.settings.default_api_key
 
 
 def is_host_blacklisted(url_index: int) -> bool:
-    with runtime_state.blacklist_lock:
-        if url_index in runtime_state.api_host_blacklist:
-            if time.time() < runtime_state.api_host_blacklist[url_index]:
-                return True
-            del runtime_state.api_host_blacklist[url_index]
-        return False
+    with runtime_state.host_health_lock:
+        return _get_host_health(url_index).state == "open"
 
 
 def blacklist_host(url_index: int, logger=None):
-    with runtime_state.blacklist_lock:
-        runtime_state.api_host_blacklist[url_index] = time.time() + runtime_state.blacklist_duration
-        if logger:
-            logger.warning(f"API Host {runtime_state.settings.api_hosts[url_index]} 被拉黑 5 分钟")
+    with runtime_state.host_health_lock:
+        health = _get_host_health(url_index)
+        _trip_breaker(health, time.time())
+        open_seconds = int(health.open_until - time.time())
+    if logger:
+        logger.warning(f"API Host {runtime_state.settings.api_hosts[url_index]} 熔断 {open_seconds} 秒")
 
 
 def get_available_host_indices() -> list:
-    return [i for i in range(len(runtime_state.settings.api_hosts)) if not is_host_blacklisted(i)]
+    now = time.time()
+    with runtime_state.host_health_lock:
+        return [
+            idx
+            for idx in range(len(runtime_state.settings.api_hosts))
+            if _is_health_available(_get_host_health(idx), now)
+        ]
+
 
+def select_host_index(exclude_indices=None) -> int:
+    exclude_indices = set(exclude_indices or ())
+    host_count = len(runtime_state.settings.api_hosts)
+    now = time.time()
+    with runtime_state.host_health_lock:
+        candidates = []
+        for idx in range(host_count):
+            if idx in exclude_indices:
+                continue
+            health = _get_host_health(idx)
+            if _is_health_available(health, now):
+                candidates.append((host_score(health), random.random(), idx))
+        if not candidates:
+            fallback = [idx for idx in range(host_count) if idx not in exclude_indices] or list(range(host_count))
+            return random.choice(fallback)
+        _, _, url_index = min(candidates)
+        health = runtime_state.host_health[url_index]
+        if health.state == "half_open":
+            health.probe_started_at = now
+        return url_index
 
-def cleanup_expired_blacklist():
-    with runtime_state.blacklist_lock:
-        current_time = time.time()
-        expired = [idx for idx, end_time in runtime_state.api_host_blacklist.items() if current_time >= end_time]
-        for idx in expired:
-            del runtime_state.api_host_blacklist[idx]
 
+def begin_host_request(url_index: int) -> float:
+    with runtime_state.host_health_lock:
+        health = _get_host_health(url_index)
+        health.in_flight += 1
+        health.total_requests += 1
+    return time.time()
 
-def blacklist_cleanup_worker():
-    while True:
-        time.sleep(60)
-        cleanup_expired_blacklist()
 
+def end_host_request(
+    url_index: int,
+    started_at: float,
+    exc=None,
+    latency_ms: float = None,
+    logger=None,
+    shared_key: bool = True,
+    record_latency: bool = True,
+):
+    """结束一次 host 请求并更新健康度。
 
-def start_blacklist_cleanup_thread():
-    thread = threading.Thread(target=blacklist_cleanup_worker, daemon=True)
-    thread.start()
-    return thread
+    用户自有 key 的 429 只说明该 key 超限，不计入 host 失败；record_latency 为 False 时（非流式、图片等整段耗时）
+    不更新延迟 EWMA，EWMA 只反映首 token / 建连延迟。
+    """
+    settings = runtime_state.settings
+    alpha = settings.host_ewma_alpha
+    now = time.time()
+    latency_ms = (now - started_at) * 1000 if latency_ms is None else latency_ms
+    failed = exc is not None and is_host_failure(exc) and (shared_key or not isinstance(exc, RateLimitError))
+    open_until = 0.0
+    with runtime_state.host_health_lock:
+        health = _get_host_health(url_index)
+        health.in_flight = max(0, health.in_flight - 1)
+        health.error_rate = health.error_rate * (1 - alpha) + (alpha if failed else 0.0)
+        if failed:
+            health.total_failures += 1
+            health.consecutive_failures += 1
+            health.last_error = f"{type(exc).__name__}: {exc}"[:200]
+            if health.state == "half_open" or health.consecutive_failures >= settings.host_breaker_failure_threshold:
+                _trip_breaker(health, now)
+                open_until = health.open_until
+        else:
+            if record_latency:
+                health.ewma_latency_ms = latency_ms if not health.ewma_latency_ms else health.ewma_latency_ms * (1 - alpha) + latency_ms * alpha
+            health.consecutive_failures = 0
+            if health.state == "half_open":
+                health.state = "closed"
+                health.open_count = 0
+                health.probe_started_at = 0.0
+    if open_until and logger:
+        logger.warning(f"API Host {settings.api_hosts[url_index]} 熔断至 {time.strftime('%H:%M:%S', time.localtime(open_until))}")
+
+
+@contextmanager
+def track_host_request(url_index: int, logger=None, shared_key: bool = True, record_latency: bool = True):
+    started_at = begin_host_request(url_index)
+    try:
+        yield
+    except Exception as exc:
+        end_host_request(url_index, started_at, exc=exc, logger=logger, shared_key=shared_key, record_latency=record_latency)
+        raise
+    end_host_request(url_index, started_at, logger=logger, shared_key=shared_key, record_latency=record_latency)
+
+
+def get_host_health_snapshot() -> list:
+    now = time.time()
+    hosts = []
+    with runtime_state.host_health_lock:
+        for idx, host in enumerate(runtime_state.settings.api_hosts):
+            health = _get_host_health(idx)
+            remaining = max(0, int(health.open_until - now)) if health.state == "open" else 0
+            hosts.append(
+                {
+                    "index": idx,
+                    "host": host,
+                    "state": health.state,
+                    "blacklisted": health.state == "open",
+                    "blacklist_remaining_seconds": remaining,
+                    "ewma_latency_ms": round(health.ewma_latency_ms, 1),
+                    "error_rate": round(health.error_rate, 3),
+                    "in_flight": health.in_flight,
+                    "total_requests": health.total_requests,
+                    "total_failures": health.total_failures,
+                    "consecutive_failures": health.consecutive_failures,
+                    "score": round(host_score(health), 1),
+                    "last_error": health.last_error,
+                }
+            )
+    return hosts
 
 
 def get_current_url_index():
@@ -62,31 +210,89 @@ def ensure_clients():
     return runtime_state.clients
 
 
-def random_client() -> tuple:
+def select_client(exclude_indices=None) -> tuple:
     clients = ensure_clients()
-    available_indices = get_available_host_indices()
-    if not available_indices:
-        url_index = random.randint(0, len(clients) - 1)
-        return clients[url_index], url_index
-    selected_index = random.choice(available_indices)
+    selected_index = select_host_index(exclude_indices)
     set_current_url_index(selected_index)
     return clients[selected_index], selected_index
 
 
+def get_pooled_client(api_key: str, url_index: int) -> OpenAI:
+    pool_key = (api_key, url_index)
+    with runtime_state.client_pool_lock:
+        client = runtime_state.client_pool.get(pool_key)
+        if client is not None:
+            runtime_state.client_pool.move_to_end(pool_key)
+            runtime_state.client_pool_stats["hits"] += 1
+            return client
+        runtime_state.client_pool_stats["misses"] += 1
+        # 共享 http_client，淘汰时只丢弃引用，不能 close
+        client = OpenAI(
+            api_key=api_key,
+            base_url=runtime_state.settings.api_hosts[url_index],
+            http_client=runtime_state.build_http_client(),
+        )
+        runtime_state.client_pool[pool_key] = client
+        while len(runtime_state.client_pool) > max(1, runtime_state.settings.client_pool_size):
+            runtime_state.client_pool.popitem(last=False)
+            runtime_state.client_pool_stats["evictions"] += 1
+        return client
+
+
+def evict_pooled_clients(api_key: str) -> int:
+    if not api_key:
+        return 0
+    with runtime_state.client_pool_lock:
+        stale_keys = [key for key in runtime_state.client_pool if key[0] == api_key]
+        for key in stale_keys:
+            del runtime_state.client_pool[key]
+        runtime_state.client_pool_stats["evictions"] += len(stale_keys)
+        for key in [key for key in runtime_state.async_client_pool if key[0] == api_key]:
+            del runtime_state.async_client_pool[key]
+    return len(stale_keys)
+
+
+def get_client_pool_snapshot() -> dict:
+    settings = runtime_state.settings
+    with runtime_state.client_pool_lock:
+        return {
+            "size": len(runtime_state.client_pool),
+            "capacity": settings.client_pool_size,
+            **runtime_state.client_pool_stats,
+            "http_limits": {
+                "max_connections": settings.http_max_connections,
+                "max_keepalive_connections": settings.http_max_keepalive_connections,
+                "keepalive_expiry": settings.http_keepalive_expiry,
+            },
+        }
+
+
 def get_client_for_url_index(url_index: int, api_key: str = None) -> OpenAI:
-    if api_key:
-        return OpenAI(api_key=api_key, base_url=runtime_state.settings.api_hosts[url_index])
+    if api_key and api_key != runtime_state.settings.default_api_key:
+        return get_pooled_client(api_key, url_index)
     return ensure_clients()[url_index]
 
 
-def get_client_for_user(username: str) -> tuple:
-    api_key = get_user_api_key(username) if runtime_state.use_db_auth else runtime_state.user_api_keys.get(username)
-    available_indices = get_available_host_indices()
-    if not available_indices:
-        url_index = random.randint(0, len(runtime_state.settings.api_hosts) - 1)
-    else:
-        url_index = random.choice(available_indices)
+def get_async_client_for_url_index(url_index: int, api_key: str = None) -> AsyncOpenAI:
+    api_key = api_key or runtime_state.settings.default_api_key
+    pool_key = (api_key, url_index)
+    with runtime_state.client_pool_lock:
+        client = runtime_state.async_client_pool.get(pool_key)
+        if client is not None:
+            runtime_state.async_client_pool.move_to_end(pool_key)
+            return client
+        client = runtime_state.async_client_pool[pool_key] = runtime_state.build_async_client(api_key, url_index)
+        while len(runtime_state.async_client_pool) > max(1, runtime_state.settings.client_pool_size):
+            runtime_state.async_client_pool.popitem(last=False)
+        return client
+
+
+def get_user_api_key(username: str):
+    return get_cached_user_api_key(username) if runtime_state.use_db_auth else runtime_state.user_api_keys.get(username)
+
+
+def get_client_for_user(username: str, exclude_indices=None) -> tuple:
+    api_key = get_user_api_key(username)
+    url_index = select_host_index(exclude_indices)
     set_current_url_index(url_index)
-    if api_key:
-        return OpenAI(api_key=api_key, base_url=runtime_state.settings.api_hosts[url_index]), url_index
-    return ensure_clients()[url_index], url_index
+    return get_client_for_url_index(url_index, api_key), url_index
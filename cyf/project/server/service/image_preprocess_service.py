@@ -0,0 +1,136 @@
+import base64
+import io
+
+from conf.runtime import runtime_state
+from service.message_normalizer import _FileResult
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+
+# 模型未配置压缩质量时使用的 JPEG 质量
+DEFAULT_IMAGE_QUALITY = 85
+
+
+def get_image_preprocess_options(model: str) -> tuple:
+    """返回模型配置的 (长边上限, 压缩质量)，长边上限为 0 表示不做预处理。"""
+    from service.model_service import get_model_record
+
+    record = get_model_record(model)
+    if not record:
+        return 0, 0
+    model_info = record["model"]
+    max_edge = int(model_info.get("image_max_edge", 0) or 0)
+    quality = int(model_info.get("image_quality", 0) or 0) or DEFAULT_IMAGE_QUALITY
+    return max_edge, min(max(quality, 1), 95)
+
+
+def _downscale_image(file_data: bytes, max_edge: int, quality: int):
+    """缩放并重新编码图片，返回 (新数据, MIME 类型)；动图或压缩后不更小时返回 None。"""
+    with Image.open(io.BytesIO(file_data)) as image:
+        if getattr(image, "n_frames", 1) > 1:
+            return None
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        output = io.BytesIO()
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if has_alpha:
+            image.save(output, format="PNG", optimize=True)
+            content_type = "image/png"
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+            content_type = "image/jpeg"
+    processed = output.getvalue()
+    if len(processed) >= len(file_data):
+        return None
+    return processed, content_type
+
+
+def _get_cached_image(cache_key: tuple):
+    with runtime_state.image_preprocess_lock:
+        cache = runtime_state.image_preprocess_cache
+        if cache_key not in cache:
+            return False, None
+        cache.move_to_end(cache_key)
+        return True, cache[cache_key]
+
+
+def _put_cached_image(cache_key: tuple, data_url):
+    entry_bytes = len(data_url) if data_url else 0
+    with runtime_state.image_preprocess_lock:
+        cache = runtime_state.image_preprocess_cache
+        stats = runtime_state.image_preprocess_stats
+        previous = cache.pop(cache_key, None)
+        if previous:
+            stats["bytes"] -= len(previous)
+        cache[cache_key] = data_url
+        stats["bytes"] += entry_bytes
+        while cache and stats["bytes"] > runtime_state.settings.image_preprocess_cache_max_bytes:
+            _, evicted = cache.popitem(last=False)
+            stats["bytes"] -= len(evicted) if evicted else 0
+
+
+def _record_stats(name: str, bytes_saved: int = 0):
+    with runtime_state.image_preprocess_lock:
+        runtime_state.image_preprocess_stats[name] += 1
+        runtime_state.image_preprocess_stats["bytes_saved"] += bytes_saved
+
+
+def preprocess_image_result(result, max_edge: int, quality: int, logger=None):
+    """按长边上限与质量压缩图片类处理结果，结果按原图 SHA-256 + 参数缓存；失败或无收益时返回原结果。"""
+    if result is None or result.kind != "image" or not result.digest or max_edge <= 0 or Image is None:
+        return result
+    cache_key = (result.digest, max_edge, quality)
+    found, data_url = _get_cached_image(cache_key)
+    if found:
+        _record_stats("hits", len(result.data) - len(data_url) if data_url else 0)
+        return _FileResult("image", data_url, result.digest) if data_url else result
+    try:
+        b64_data = result.data.split(",", 1)[1]
+        processed = _downscale_image(base64.b64decode(b64_data), max_edge, quality)
+    except Exception as exc:
+        if logger:
+            logger.warning(f"图片预处理失败，使用原图: sha256={result.digest}, err={exc}")
+        processed = None
+    if processed is None:
+        # 无收益同样缓存，避免每轮对话重复解码
+        _put_cached_image(cache_key, None)
+        _record_stats("skipped")
+        return result
+    file_data, content_type = processed
+    data_url = f"data:{content_type};base64,{base64.b64encode(file_data).decode('utf-8')}"
+    _put_cached_image(cache_key, data_url)
+    bytes_saved = len(result.data) - len(data_url)
+    _record_stats("processed", bytes_saved)
+    if logger:
+        logger.info(f"图片已压缩: {len(result.data)} -> {len(data_url)} 字节（长边上限 {max_edge}, 质量 {quality}）")
+    return _FileResult("image", data_url, result.digest)
+
+
+def preprocess_file_results(file_results: dict, model: str, logger=None) -> dict:
+    """对预取的附件结果按模型配置做图片预处理；多张图片时在附件线程池中并行处理。"""
+    max_edge, quality = get_image_preprocess_options(model)
+    if max_edge <= 0 or Image is None:
+        return file_results
+    image_urls = [url for url, result in file_results.items() if result is not None and result.kind == "image"]
+    if not image_urls:
+        return file_results
+    processed = dict(file_results)
+    if len(image_urls) == 1:
+        processed[image_urls[0]] = preprocess_image_result(file_results[image_urls[0]], max_edge, quality, logger)
+        return processed
+    executor = runtime_state.build_attachment_executor()
+    results = executor.map(lambda url: preprocess_image_result(file_results[url], max_edge, quality, logger), image_urls)
+    processed.update(zip(image_urls, results))
+    return processed
+
+
+def get_image_preprocess_snapshot() -> dict:
+    with runtime_state.image_preprocess_lock:
+        stats = dict(runtime_state.image_preprocess_stats)
+        entry_count = len(runtime_state.image_preprocess_cache)
+    return {"enabled": Image is not None, "entries": entry_count, **stats}
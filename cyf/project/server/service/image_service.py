@@ -6,13 +6,16 @@ from urllib.parse import urlparse
 import requests
 
 from conf.runtime import runtime_state
-from model.repositories.log_repository import set_dialog, set_log
+from model.repositories.log_repository import set_dialog
 from service.common_service import handle_api_exception
 from service.dialog_context_service import build_dialog_context_payload, current_time_str, stamp_latest_user_message
-from service.host_service import get_client_for_user
+from service.host_service import get_client_for_user, get_user_api_key, is_shared_api_key, track_host_request
+from service.log_writer_service import record_log
 from service.message_normalizer import build_parts_from_message, ensure_message_parts, strip_file_url_markers
 from service.model_service import is_valid_model
+from service.quota_service import acquire_quota, release_quota
 from service.system_prompt_service import fetch_system_prompt
+from service.upload_service import read_upload_file, resolve_local_upload_path
 
 
 FILE_URL_PATTERN = re.compile(r"\[FILE_URL:(https?://[^\]]+)\]")
@@ -29,6 +32,9 @@ def extract_title_from_dialog(dialogvo: list, max_length: int = 50) -> str:
 
 
 def url_to_file(url: str, logger) -> bytes:
+    local_path = resolve_local_upload_path(url)
+    if local_path is not None:
+        return read_upload_file(local_path)
     response = requests.get(url, timeout=30)
     if response.status_code == 200:
         return response.content
@@ -82,7 +88,18 @@ def generate_or_edit_image(user: str, payload, logger):
     model = payload.model
     if not is_valid_model(model):
         return {"msg": "not supported user or model"}, 200
+    quota_error = acquire_quota(user, model, logger)
+    if not quota_error["success"]:
+        return quota_error, 200
+    try:
+        return request_image(user, payload, logger)
+    finally:
+        release_quota(user, model)
+
 
+def request_image(user: str, payload, logger):
+    """已占用配额后生成或编辑图片，并保存日志与对话。"""
+    model = payload.model
     dialogs = payload.dialog
     dialog_mode = payload.dialog_mode
     dialog_id = payload.dialog_id or None
@@ -105,27 +122,32 @@ def generate_or_edit_image(user: str, payload, logger):
         full_content = f"{sys_content}\n{dialogvo[-1]['content']}" if sys_content else dialogvo[-1]["content"]
         processed_data = process_pic_dialog_with_urls(full_content, logger)
 
+    url_index = None
     try:
         client, url_index = get_client_for_user(user)
-        if processed_data["files"]:
-            result = client.images.edit(
-                model=model,
-                image=processed_data["files"][0]["data"],
-                prompt=processed_data["text_content"],
-                n=1,
-                response_format="url",
-                size=size,
-                timeout=300,
-            )
-        else:
-            result = client.images.generate(
-                model=model,
-                prompt=processed_data["text_content"],
-                n=1,
-                response_format="url",
-                size=size,
-                timeout=300,
-            )
+        # 图片生成耗时不代表 host 延迟，不计入 EWMA
+        with track_host_request(
+            url_index, logger=logger, shared_key=is_shared_api_key(get_user_api_key(user)), record_latency=False
+        ):
+            if processed_data["files"]:
+                result = client.images.edit(
+                    model=model,
+                    image=processed_data["files"][0]["data"],
+                    prompt=processed_data["text_content"],
+                    n=1,
+                    response_format="url",
+                    size=size,
+                    timeout=300,
+                )
+            else:
+                result = client.images.generate(
+                    model=model,
+                    prompt=processed_data["text_content"],
+                    n=1,
+                    response_format="url",
+                    size=size,
+                    timeout=300,
+                )
     except Exception as api_exc:
         return handle_api_exception(api_exc, logger, user=user, model=model, dialog_content=dialogs, url_index=url_index), 200
 
@@ -133,7 +155,7 @@ def generate_or_edit_image(user: str, payload, logger):
     result_save = {"role": "assistant", "desc": desc, "url": f"{result.data[0].url}", "time": current_time_str()}
     # 归一化为统一 MessagePart 协议
     result_save = ensure_message_parts(result_save)
-    set_log(user, 1, model, json.dumps(result.to_dict()))
+    record_log(user, 1, model, json.dumps(result.to_dict()), logger=logger)
     try:
         if dialog_mode == "single":
             dialogvo.append({"role": "user", "desc": processed_data["original_content"], "time": current_time_str()})
@@ -143,7 +165,9 @@ def generate_or_edit_image(user: str, payload, logger):
                 dialogvo = [dialogvo]
             dialogvo = stamp_latest_user_message(dialogvo)
             dialogvo.append(result_save)
-        saved_dialog_id = set_dialog(user, model, "pic", title, build_dialog_context_payload(dialogvo, payload.role_setting), dialog_id)
+        saved_dialog_id = set_dialog(
+            user, model, "pic", title, build_dialog_context_payload([], payload.role_setting), dialog_id, messages=dialogvo
+        )
     except Exception as exc:
         logger.error(f"获取对话历史失败: {exc}")
         if not isinstance(dialogvo, list):
@@ -151,7 +175,7 @@ def generate_or_edit_image(user: str, payload, logger):
         dialogvo = stamp_latest_user_message(dialogvo)
         if result_save not in dialogvo:
             dialogvo.append(result_save)
-        saved_dialog_id = set_dialog(user, model, "pic", title, build_dialog_context_payload(dialogvo, payload.role_setting))
+        saved_dialog_id = set_dialog(user, model, "pic", title, build_dialog_context_payload([], payload.role_setting), messages=dialogvo)
     if saved_dialog_id:
         result_save["dialog_id"] = saved_dialog_id
     return result_save, 200
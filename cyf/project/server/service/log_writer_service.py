@@ -0,0 +1,228 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from conf.runtime import runtime_state
+from model.repositories.log_repository import build_log_row, insert_logs
+
+
+# 写线程退出标记
+_STOP = object()
+# 补写中的 spool 文件超过该时长（秒）未完成时视为遗留，其他进程可以接管
+LOG_REPLAY_CLAIM_TIMEOUT = 300
+
+
+def _record_stat(name: str, count: int = 1):
+    with runtime_state.log_writer_lock:
+        runtime_state.log_writer_stats[name] += count
+
+
+def _spool_rows(rows: list):
+    """写库失败或队列已满时追加到 spool 文件并 fsync，保证日志不丢。"""
+    spool_file = runtime_state.settings.log_spool_file
+    lines = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    with runtime_state.log_writer_lock:
+        with open(spool_file, "a", encoding="utf-8") as spool:
+            spool.write(lines)
+            spool.flush()
+            os.fsync(spool.fileno())
+        runtime_state.log_writer_stats["spooled"] += len(rows)
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _claim_replay_file(path: str):
+    """原子改名为本进程独占的文件名并刷新修改时间作为认领时间；已被其他进程认领时返回 None。"""
+    claimed = f"{runtime_state.settings.log_spool_file}.{os.getpid()}.{uuid.uuid4().hex}.replay"
+    try:
+        os.rename(path, claimed)
+        os.utime(claimed)
+    except FileNotFoundError:
+        return None
+    return claimed
+
+
+def _is_replay_file_claimable(path: str, now: float) -> bool:
+    """本进程的残留文件（持有 log_replay_lock 时）、所属进程已退出或认领已超时的文件才可接管。"""
+    try:
+        pid = int(os.path.basename(path).rsplit(".", 3)[-3])
+        claimed_at = os.path.getmtime(path)
+    except (ValueError, IndexError, OSError):
+        return False
+    if pid == os.getpid() or not _is_process_alive(pid):
+        return True
+    return now - claimed_at > LOG_REPLAY_CLAIM_TIMEOUT
+
+
+def replay_log_spool(logger=None) -> int:
+    """把 spool 文件中的日志补写入库；只处理本次改名认领到的文件，多进程同时补写时不会重复。"""
+    spool_file = runtime_state.settings.log_spool_file
+    replayed = 0
+    with runtime_state.log_replay_lock:
+        claimed_files = []
+        if os.path.exists(spool_file):
+            claimed = _claim_replay_file(spool_file)
+            if claimed:
+                claimed_files.append(claimed)
+        # 其他进程补写中的文件不动，只接管补写失败或进程退出后遗留的文件
+        now = time.time()
+        for replay_file in glob.glob(f"{glob.escape(spool_file)}.*.replay"):
+            if replay_file in claimed_files or not _is_replay_file_claimable(replay_file, now):
+                continue
+            claimed = _claim_replay_file(replay_file)
+            if claimed:
+                claimed_files.append(claimed)
+        for replay_file in claimed_files:
+            try:
+                with open(replay_file, encoding="utf-8") as spool:
+                    rows = [json.loads(line) for line in spool if line.strip()]
+                if rows:
+                    insert_logs(rows)
+                os.remove(replay_file)
+                replayed += len(rows)
+            except Exception as exc:
+                # 文件保留为本进程认领，下次补写时重试
+                if logger:
+                    logger.error(f"补写 spool 日志失败，稍后重试: {replay_file}, err={exc}")
+                break
+    if replayed:
+        _record_stat("replayed", replayed)
+        if logger:
+            logger.info(f"已补写 spool 日志 {replayed} 条")
+    return replayed
+
+
+def _write_batch(rows: list, logger=None):
+    try:
+        insert_logs(rows)
+    except Exception as exc:
+        _record_stat("failures")
+        if logger:
+            logger.error(f"批量写入日志失败，已转存 spool 文件: {len(rows)} 条, err={exc}")
+        _spool_rows(rows)
+        return
+    with runtime_state.log_writer_lock:
+        runtime_state.log_writer_stats["written"] += len(rows)
+        runtime_state.log_writer_stats["batches"] += 1
+    if os.path.exists(runtime_state.settings.log_spool_file):
+        replay_log_spool(logger)
+
+
+def log_writer_worker(log_queue: queue.Queue, logger=None):
+    settings = runtime_state.settings
+    flush_interval = max(1, settings.log_flush_interval_ms) / 1000
+    stopping = False
+    while not stopping:
+        item = log_queue.get()
+        if item is _STOP:
+            break
+        batch = [item]
+        deadline = time.monotonic() + flush_interval
+        while len(batch) < settings.log_flush_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = log_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        _write_batch(batch, logger)
+
+
+def start_log_writer(logger=None):
+    """为当前进程启动日志写线程；uwsgi fork 出的 worker 在首次记录日志时重新创建。"""
+    settings = runtime_state.settings
+    if not settings.log_write_behind:
+        return None
+    with runtime_state.log_writer_lock:
+        if runtime_state.log_writer_pid == os.getpid() and runtime_state.log_writer_thread is not None:
+            return runtime_state.log_writer_thread
+        log_queue = queue.Queue(maxsize=max(1, settings.log_queue_max_size))
+        thread = threading.Thread(target=log_writer_worker, args=(log_queue, logger), daemon=True)
+        thread.name = "log-writer"
+        runtime_state.log_queue = log_queue
+        runtime_state.log_writer_thread = thread
+        runtime_state.log_writer_pid = os.getpid()
+    thread.start()
+    atexit.register(stop_log_writer, logger)
+    replay_log_spool(logger)
+    return thread
+
+
+def stop_log_writer(logger=None, timeout: float = 10):
+    """停止写线程并写完队列中剩余的日志，进程退出前调用。"""
+    with runtime_state.log_writer_lock:
+        if runtime_state.log_writer_pid != os.getpid():
+            return
+        log_queue = runtime_state.log_queue
+        thread = runtime_state.log_writer_thread
+        runtime_state.log_queue = None
+        runtime_state.log_writer_thread = None
+    if log_queue is None:
+        return
+    try:
+        log_queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        pass
+    if thread is not None:
+        thread.join(timeout)
+    # 写线程未及处理（或停止标记之后入队）的日志在当前线程同步写入
+    remaining = []
+    while True:
+        try:
+            item = log_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _STOP:
+            remaining.append(item)
+    if remaining:
+        _write_batch(remaining, logger)
+    if logger:
+        logger.info(f"日志写线程已停止，退出前写入 {len(remaining)} 条")
+
+
+def record_log(user: str, usage: int, model: str, text: str, prompt_tokens: int = 0, completion_tokens: int = 0, logger=None):
+    """记录调用日志：放入后台队列由写线程批量提交，请求线程不等待 SQLite 写锁；未启用时同步写入。"""
+    row = build_log_row(user, usage, model, text, prompt_tokens, completion_tokens)
+    if not runtime_state.settings.log_write_behind:
+        insert_logs([row])
+        return
+    if runtime_state.log_writer_pid != os.getpid():
+        start_log_writer(logger)
+    log_queue = runtime_state.log_queue
+    if log_queue is None:
+        insert_logs([row])
+        return
+    try:
+        log_queue.put_nowait(row)
+        _record_stat("queued")
+    except queue.Full:
+        _spool_rows([row])
+
+
+def get_log_writer_snapshot() -> dict:
+    log_queue = runtime_state.log_queue
+    with runtime_state.log_writer_lock:
+        stats = dict(runtime_state.log_writer_stats)
+    return {
+        "enabled": runtime_state.settings.log_write_behind,
+        "pending": log_queue.qsize() if log_queue is not None else 0,
+        **stats,
+    }
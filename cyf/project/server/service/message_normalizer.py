@@ -5,6 +5,7 @@
 """
 
 import base64
+import hashlib
 import logging
 import re
 import time
@@ -13,6 +14,8 @@ from urllib.parse import urlparse
 
 import requests
 
+from service.upload_service import guess_upload_content_type, read_upload_file, resolve_local_upload_path
+
 # MessagePart 类型常量
 PART_TEXT = "text"
 PART_IMAGE = "image"
@@ -132,10 +135,11 @@ TEXT_FILE_EXTENSIONS = {
 # 文件处理结果类型
 class _FileResult:
     """多模态文件处理结果。"""
-    __slots__ = ("kind", "data")
-    def __init__(self, kind: str, data: str):
+    __slots__ = ("kind", "data", "digest")
+    def __init__(self, kind: str, data: str, digest: str = ""):
         self.kind = kind  # "image" | "text" | "unsupported"
         self.data = data  # data URL or text content
+        self.digest = digest  # 图片原始内容的 SHA-256，用作压缩结果的缓存键
 
 
 def _classify_file(url: str, content_type: str) -> str:
@@ -159,6 +163,46 @@ def _classify_file(url: str, content_type: str) -> str:
     return "unsupported"
 
 
+def build_file_result(
+    url: str, content_type: str, file_data: bytes, logger: Optional[logging.Logger] = None
+) -> Optional[_FileResult]:
+    """按文件类型把下载内容转换为处理结果，不支持的格式返回 None。"""
+    file_kind = _classify_file(url, content_type)
+
+    if file_kind == "image":
+        # 确定准确的 MIME 类型
+        if not content_type or content_type == "application/octet-stream":
+            path = urlparse(url).path.lower()
+            for ext, mime in [
+                (".png", "image/png"), (".jpg", "image/jpeg"), (".jpeg", "image/jpeg"),
+                (".gif", "image/gif"), (".webp", "image/webp"),
+                (".bmp", "image/bmp"), (".tiff", "image/tiff"),
+            ]:
+                if path.endswith(ext):
+                    content_type = mime
+                    break
+            else:
+                content_type = "image/png"
+        b64_data = base64.b64encode(file_data).decode("utf-8")
+        return _FileResult("image", f"data:{content_type};base64,{b64_data}", hashlib.sha256(file_data).hexdigest())
+
+    elif file_kind == "text":
+        # 尝试 UTF-8 解码，失败则用 Latin-1 兜底
+        try:
+            text = file_data.decode("utf-8")
+        except UnicodeDecodeError:
+            text = file_data.decode("latin-1")
+        filename = urlparse(url).path.rsplit("/", 1)[-1] or "file"
+        if logger:
+            logger.info(f"文本文件已读取: {filename}, {len(text)} 字符")
+        return _FileResult("text", text)
+
+    else:
+        if logger:
+            logger.warning(f"不支持的文件类型（{content_type}），保留原始标记: {url}")
+        return None
+
+
 def process_file_for_multimodal(
     url: str, logger: Optional[logging.Logger] = None, timeout: int = 30
 ) -> Optional[_FileResult]:
@@ -169,6 +213,11 @@ def process_file_for_multimodal(
     - 不支持的格式：返回 None，保留原始 [FILE_URL:...] 标记在文本中
     """
     try:
+        local_path = resolve_local_upload_path(url)
+        if local_path is not None:
+            file_data = read_upload_file(local_path)
+            return build_file_result(url, guess_upload_content_type(local_path), file_data, logger) if file_data else None
+
         response = requests.get(url, timeout=timeout)
         if response.status_code != 200:
             if logger:
@@ -179,40 +228,7 @@ def process_file_for_multimodal(
             return None
 
         content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
-        file_kind = _classify_file(url, content_type)
-
-        if file_kind == "image":
-            # 确定准确的 MIME 类型
-            if not content_type or content_type == "application/octet-stream":
-                path = urlparse(url).path.lower()
-                for ext, mime in [
-                    (".png", "image/png"), (".jpg", "image/jpeg"), (".jpeg", "image/jpeg"),
-                    (".gif", "image/gif"), (".webp", "image/webp"),
-                    (".bmp", "image/bmp"), (".tiff", "image/tiff"),
-                ]:
-                    if path.endswith(ext):
-                        content_type = mime
-                        break
-                else:
-                    content_type = "image/png"
-            b64_data = base64.b64encode(file_data).decode("utf-8")
-            return _FileResult("image", f"data:{content_type};base64,{b64_data}")
-
-        elif file_kind == "text":
-            # 尝试 UTF-8 解码，失败则用 Latin-1 兜底
-            try:
-                text = file_data.decode("utf-8")
-            except UnicodeDecodeError:
-                text = file_data.decode("latin-1")
-            filename = urlparse(url).path.rsplit("/", 1)[-1] or "file"
-            if logger:
-                logger.info(f"文本文件已读取: {filename}, {len(text)} 字符")
-            return _FileResult("text", text)
-
-        else:
-            if logger:
-                logger.warning(f"不支持的文件类型（{content_type}），保留原始标记: {url}")
-            return None
+        return build_file_result(url, content_type, file_data, logger)
 
     except Exception as exc:
         if logger:
@@ -238,6 +254,7 @@ def convert_user_message_for_multimodal(
     message: Dict[str, Any],
     logger: Optional[logging.Logger] = None,
     timeout: int = 30,
+    file_results: Optional[Dict[str, Optional[_FileResult]]] = None,
 ) -> Dict[str, Any]:
     """将包含 [FILE_URL:...] 的用户消息转换为多模态 content 数组格式。
 
@@ -246,6 +263,8 @@ def convert_user_message_for_multimodal(
     - 文本文件（txt/md/json/py 等）→ text 块（读取文件内容）
     - 不支持的格式 → 保留原始 [FILE_URL:...] 标记在文本中
 
+    file_results 为预先并发获取的 {url: 处理结果}，缺失的 URL 才在此处单独下载。
+
     输入示例: {"role": "user", "content": "描述这张图\\n[FILE_URL:http://x/a.png]"}
     输出示例: {"role": "user", "content": [{"type": "text", "text": "描述这张图"},
                                             {"type": "image_url", "image_url": {"url": "data:..."}}]}
@@ -269,7 +288,10 @@ def convert_user_message_for_multimodal(
         content_array.append({"type": "text", "text": clean_text})
 
     for url in file_urls:
-        result = process_file_for_multimodal(url, logger=logger, timeout=timeout)
+        if file_results is not None and url in file_results:
+            result = file_results[url]
+        else:
+            result = process_file_for_multimodal(url, logger=logger, timeout=timeout)
         if result is None:
             # 下载失败或不支持的格式：保留原始标记在文本中
             filename = urlparse(url).path.rsplit("/", 1)[-1] or "file"
@@ -301,34 +323,42 @@ def convert_user_message_for_multimodal(
 def convert_dialog_for_multimodal(
     dialogvo: List[Dict[str, Any]],
     logger: Optional[logging.Logger] = None,
+    model: str = "",
 ) -> List[Dict[str, Any]]:
     """为多模态模型转换整个对话数组中的用户消息。
 
     仅转换 role=user 的消息；assistant/system 消息保持不变。
+    整个对话的附件先去重并发获取（带缓存），多轮对话重复发送的历史附件不再重复下载。
+    模型配置了图片长边上限时，图片按该模型的参数缩放压缩后再 base64 嵌入。
     """
+    from service.attachment_service import fetch_attachments
+    from service.image_preprocess_service import preprocess_file_results
+
+    file_urls = []
+    for msg in dialogvo:
+        if msg.get("role", "") == "user" and isinstance(msg.get("content"), str):
+            file_urls.extend(extract_file_urls_from_content(msg["content"]))
+    file_results = fetch_attachments(file_urls, logger=logger) if file_urls else {}
+    if file_results and model:
+        file_results = preprocess_file_results(file_results, model, logger=logger)
+
     converted = []
     for msg in dialogvo:
         role = msg.get("role", "")
         if role == "user":
-            converted.append(convert_user_message_for_multimodal(msg, logger=logger))
+            converted.append(convert_user_message_for_multimodal(msg, logger=logger, file_results=file_results))
         else:
             converted.append(msg)
     return converted
 
 
 def get_model_type_from_cache(model_name: str) -> int:
-    """从运行时缓存获取模型的 model_type。默认返回 1（文本类）。"""
+    """从运行时模型索引获取模型的 model_type。默认返回 1（文本类）。"""
     try:
-        from conf.runtime import runtime_state
-
-        models = runtime_state.model_cache.get("models")
-        if not models:
-            return 1
-        model_name_lower = model_name.lower()
-        for m in models:
-            if str(m.get("id", "")).lower() == model_name_lower:
-                return int(m.get("model_type", 1))
-        return 1
+        from service.model_service import get_model_record
+
+        record = get_model_record(model_name)
+        return record["model_type"] if record else 1
     except Exception:
         return 1
 
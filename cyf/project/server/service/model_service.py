@@ -1,17 +1,27 @@
+import os
+import threading
 import time
 from datetime import datetime, timedelta
 
 from conf.runtime import runtime_state
 from model.repositories.model_meta_repository import get_model_meta_list
 from model.repositories.user_repository import get_active_token_count
-from service.host_service import random_client
+from service.attachment_service import get_attachment_cache_snapshot
+from service.host_service import get_client_pool_snapshot, get_host_health_snapshot, select_client, track_host_request
+from service.image_preprocess_service import get_image_preprocess_snapshot
+from service.log_writer_service import get_log_writer_snapshot
+from service.quota_service import get_quota_snapshot
+from service.rate_limit_service import get_rate_limit_snapshot
+from service.response_cache_service import get_response_cache_snapshot
+from service.single_flight_service import get_single_flight_snapshot
 
 
 def invalidate_model_cache(reason: str = "manual", logger=None):
-    runtime_state.model_cache.pop("models", None)
+    # 保留上一次成功的列表，标记过期后立即后台刷新
     runtime_state.cache_expiry_time.pop("models", None)
     if logger:
         logger.info(f"模型缓存已失效，reason={reason}")
+    trigger_model_cache_refresh(logger=logger, reason=reason)
 
 
 def filter_models(models_data, exclude_keywords=None):
@@ -29,48 +39,176 @@ def filter_models(models_data, exclude_keywords=None):
     return filtered_models
 
 
-def get_cached_models(logger=None):
+def build_model_index(models: list) -> dict:
+    return {
+        str(model.get("id", "")).lower(): {
+            "model": model,
+            "model_type": int(model.get("model_type", 1) or 1),
+            "model_grp": str(model.get("model_grp", "") or "").strip(),
+        }
+        for model in models
+    }
+
+
+def is_model_cache_fresh(current_time: float = None) -> bool:
+    current_time = time.time() if current_time is None else current_time
+    return "models" in runtime_state.cache_expiry_time and current_time < runtime_state.cache_expiry_time["models"]
+
+
+def refresh_model_cache(logger=None):
     current_time = time.time()
-    if "models" in runtime_state.cache_expiry_time and current_time < runtime_state.cache_expiry_time["models"]:
-        return runtime_state.model_cache.get("models", [])
-    try:
-        client, _ = random_client()
+    client, url_index = select_client()
+    with track_host_request(url_index, logger=logger):
         models_response = client.models.list()
-        filtered_models = filter_models(
-            [model.model_dump() for model in models_response.data],
-            runtime_state.settings.model_exclude_keywords,
-        )
-        model_ids = [m["id"] for m in filtered_models]
-        model_meta_list = get_model_meta_list(model_names=model_ids)
-        meta_map = {meta["model_name"].lower(): meta for meta in model_meta_list}
-        meta_order_map = {meta["model_name"].lower(): int(meta.get("id") or 0) for meta in model_meta_list}
-        enhanced_models = []
-        for model in filtered_models:
-            model_id = model["id"].lower()
-            meta = meta_map.get(model_id)
-            if meta and not meta.get("status_valid", True):
-                continue
-            model["recommend"] = meta.get("recommend", False) if meta else False
-            model["allow_net"] = meta.get("allow_net", True) if meta else True
-            model["model_desc"] = meta.get("model_desc", "") if meta else ""
-            model["model_type"] = meta.get("model_type", 1) if meta else 1
-            model["model_grp"] = meta.get("model_grp", "") if meta else ""
-            enhanced_models.append(model)
-        enhanced_models.sort(
-            key=lambda m: (1 if m.get("recommend", False) else 0, meta_order_map.get(str(m.get("id", "")).lower(), 0)),
-            reverse=True,
-        )
-        runtime_state.model_cache["models"] = enhanced_models
-        runtime_state.cache_expiry_time["models"] = current_time + runtime_state.settings.model_cache_ttl
-        return enhanced_models
+    filtered_models = filter_models(
+        [model.model_dump() for model in models_response.data],
+        runtime_state.settings.model_exclude_keywords,
+    )
+    model_ids = [m["id"] for m in filtered_models]
+    model_meta_list = get_model_meta_list(model_names=model_ids)
+    meta_map = {meta["model_name"].lower(): meta for meta in model_meta_list}
+    meta_order_map = {meta["model_name"].lower(): int(meta.get("id") or 0) for meta in model_meta_list}
+    enhanced_models = []
+    for model in filtered_models:
+        model_id = model["id"].lower()
+        meta = meta_map.get(model_id)
+        if meta and not meta.get("status_valid", True):
+            continue
+        model["recommend"] = meta.get("recommend", False) if meta else False
+        model["allow_net"] = meta.get("allow_net", True) if meta else True
+        model["model_desc"] = meta.get("model_desc", "") if meta else ""
+        model["model_type"] = meta.get("model_type", 1) if meta else 1
+        model["model_grp"] = meta.get("model_grp", "") if meta else ""
+        model["image_max_edge"] = meta.get("image_max_edge", 0) if meta else 0
+        model["image_quality"] = meta.get("image_quality", 0) if meta else 0
+        model["context_window"] = meta.get("context_window", 0) if meta else 0
+        enhanced_models.append(model)
+    enhanced_models.sort(
+        key=lambda m: (1 if m.get("recommend", False) else 0, meta_order_map.get(str(m.get("id", "")).lower(), 0)),
+        reverse=True,
+    )
+    runtime_state.model_cache["index"] = build_model_index(enhanced_models)
+    runtime_state.model_cache["models"] = enhanced_models
+    runtime_state.cache_expiry_time["models"] = current_time + runtime_state.settings.model_cache_ttl
+    return enhanced_models
+
+
+def run_model_cache_refresh(logger=None, reason: str = "expired"):
+    """调用方需持有 model_cache_refresh_lock。失败时保留旧列表并在重试间隔后再刷新。"""
+    stats = runtime_state.model_cache_stats
+    started_at = time.time()
+    stats["refreshing"] = True
+    stats["last_reason"] = reason
+    try:
+        models = refresh_model_cache(logger=logger)
+        stats["last_refresh_at"] = int(time.time())
+        stats["last_refresh_ms"] = int((time.time() - started_at) * 1000)
+        stats["success_count"] += 1
+        stats["consecutive_failures"] = 0
+        return models
     except Exception as exc:
+        stats["failure_count"] += 1
+        stats["consecutive_failures"] += 1
+        stats["last_error"] = str(exc)
+        stats["last_error_at"] = int(time.time())
+        if "models" in runtime_state.model_cache:
+            runtime_state.cache_expiry_time["models"] = time.time() + runtime_state.settings.model_cache_retry_interval
         if logger:
-            logger.error(f"获取模型列表失败: {exc}")
-        return []
+            logger.error(f"刷新模型列表失败，reason={reason}, err={exc}")
+        raise
+    finally:
+        stats["refreshing"] = False
+
+
+def _background_model_cache_refresh(logger, reason: str):
+    if not runtime_state.model_cache_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        run_model_cache_refresh(logger=logger, reason=reason)
+    except Exception:
+        pass
+    finally:
+        runtime_state.model_cache_refresh_lock.release()
+
+
+def trigger_model_cache_refresh(logger=None, reason: str = "stale") -> bool:
+    if runtime_state.model_cache_refresher_pid != os.getpid():
+        start_model_cache_refresher(logger)
+    if runtime_state.model_cache_refresh_lock.locked():
+        return False
+    thread = threading.Thread(target=_background_model_cache_refresh, args=(logger, reason), daemon=True)
+    thread.name = "model-cache-refresh"
+    thread.start()
+    return True
+
+
+def get_cached_models(logger=None):
+    if runtime_state.model_cache_refresher_pid != os.getpid():
+        start_model_cache_refresher(logger)
+    if is_model_cache_fresh():
+        return runtime_state.model_cache.get("models", [])
+    if "models" in runtime_state.model_cache:
+        # stale-while-revalidate：先返回上一次成功的列表，后台刷新
+        trigger_model_cache_refresh(logger=logger, reason="stale")
+        return runtime_state.model_cache["models"]
+    # 冷启动无可用列表时单飞同步刷新，其余请求等待其结果
+    with runtime_state.model_cache_refresh_lock:
+        if "models" in runtime_state.model_cache:
+            return runtime_state.model_cache["models"]
+        try:
+            return run_model_cache_refresh(logger=logger, reason="cold_start")
+        except Exception:
+            return []
+
+
+def model_cache_refresh_worker(logger):
+    settings = runtime_state.settings
+    refresh_ahead = min(settings.model_cache_refresh_ahead, settings.model_cache_ttl // 2)
+    while True:
+        expires_at = runtime_state.cache_expiry_time.get("models", 0)
+        wait_seconds = expires_at - refresh_ahead - time.time()
+        if wait_seconds > 0:
+            time.sleep(min(wait_seconds, 30))
+            continue
+        try:
+            with runtime_state.model_cache_refresh_lock:
+                run_model_cache_refresh(logger=logger, reason="background")
+        except Exception:
+            time.sleep(settings.model_cache_retry_interval)
+
+
+def start_model_cache_refresher(logger):
+    """为当前进程启动缓存刷新线程；uwsgi fork 出的 worker 在首次查询模型时重新创建。
+
+    fork 时刷新锁可能正被 master 的刷新线程持有，子进程中无人释放，因此一并替换为新锁。
+    """
+    with runtime_state.model_cache_refresher_lock:
+        if runtime_state.model_cache_refresher_pid == os.getpid() and runtime_state.model_cache_refresher is not None:
+            return runtime_state.model_cache_refresher
+        if runtime_state.model_cache_refresher_pid:
+            runtime_state.model_cache_refresh_lock = threading.Lock()
+            runtime_state.model_cache_stats["refreshing"] = False
+        thread = threading.Thread(target=model_cache_refresh_worker, args=(logger,), daemon=True)
+        thread.name = "model-cache-refresher"
+        runtime_state.model_cache_refresher = thread
+        runtime_state.model_cache_refresher_pid = os.getpid()
+    thread.start()
+    return thread
+
+
+def get_model_index(logger=None) -> dict:
+    get_cached_models(logger=logger)
+    return runtime_state.model_cache.get("index", {})
+
+
+def get_model_record(model_name: str, logger=None):
+    if not model_name:
+        return None
+    return get_model_index(logger=logger).get(model_name.lower())
 
 
 def is_valid_model(model_name):
-    return model_name in [model["id"] for model in get_cached_models()]
+    return bool(model_name) and model_name in get_model_index()
 
 
 def get_grouped_models(logger=None):
@@ -98,21 +236,8 @@ def seconds_until_next(hour: int, minute: int = 0) -> int:
 
 def get_runtime_state_snapshot() -> dict:
     now_ts = int(time.time())
-    with runtime_state.blacklist_lock:
-        blacklist_snapshot = dict(runtime_state.api_host_blacklist)
-    host_status = []
-    for idx, host in enumerate(runtime_state.settings.api_hosts):
-        blacklisted_until = blacklist_snapshot.get(idx, 0)
-        remaining = max(0, int(blacklisted_until - now_ts))
-        host_status.append(
-            {
-                "index": idx,
-                "host": host,
-                "blacklisted": remaining > 0,
-                "blacklist_remaining_seconds": remaining,
-            }
-        )
     model_cache_expire_ts = int(runtime_state.cache_expiry_time.get("models", 0) or 0)
+    refresh_stats = dict(runtime_state.model_cache_stats)
     return {
         "uptime_seconds": max(0, int(now_ts - runtime_state.server_start_time)),
         "model_cache": {
@@ -120,7 +245,17 @@ def get_runtime_state_snapshot() -> dict:
             "model_count": len(runtime_state.model_cache.get("models", [])) if isinstance(runtime_state.model_cache.get("models", []), list) else 0,
             "expires_at": model_cache_expire_ts,
             "expires_in_seconds": max(0, model_cache_expire_ts - now_ts) if model_cache_expire_ts else 0,
+            "stale": "models" in runtime_state.model_cache and model_cache_expire_ts <= now_ts,
+            "refresh": refresh_stats,
         },
-        "api_hosts": host_status,
+        "api_hosts": get_host_health_snapshot(),
+        "client_pool": get_client_pool_snapshot(),
+        "attachment_cache": get_attachment_cache_snapshot(),
+        "image_preprocess": get_image_preprocess_snapshot(),
+        "log_writer": get_log_writer_snapshot(),
+        "rate_limit": get_rate_limit_snapshot(),
+        "quota": get_quota_snapshot(),
+        "single_flight": get_single_flight_snapshot(),
+        "response_cache": get_response_cache_snapshot(),
         "token_stats": {"active_token_count": get_active_token_count()},
     }
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import deque
+
+from conf.runtime import runtime_state
+
+
+# token 用量统计窗口（秒）
+TPM_WINDOW_SECONDS = 60
+
+
+def _quota_keys(user: str, model: str) -> list:
+    """返回 [(key, 进行中上限, TPM 上限)]，上限为 0 表示不限制。"""
+    settings = runtime_state.settings
+    return [
+        (f"user:{user}", settings.quota_user_max_in_flight, settings.quota_user_tpm),
+        (f"model:{model}", settings.quota_model_max_in_flight, settings.quota_model_tpm),
+    ]
+
+
+def _window_tokens(key: str, now: float) -> int:
+    """清理过期记录并返回窗口内的 token 合计，调用方需持有 quota_condition。"""
+    window = runtime_state.quota_token_windows.get(key)
+    if window is None:
+        return 0
+    entries, total = window
+    while entries and entries[0][0] <= now - TPM_WINDOW_SECONDS:
+        total -= entries.popleft()[1]
+    if not entries:
+        runtime_state.quota_token_windows.pop(key, None)
+        return 0
+    runtime_state.quota_token_windows[key] = (entries, total)
+    return total
+
+
+def _find_exceeded(keys: list, now: float) -> tuple:
+    """返回 (超限类型, 建议等待秒数)，都有余量时超限类型为 None。"""
+    for key, max_in_flight, tpm in keys:
+        if max_in_flight > 0 and runtime_state.quota_in_flight.get(key, 0) >= max_in_flight:
+            # 进行中请求结束时会唤醒等待者，这里的等待时间只是兜底
+            return "in_flight", 1.0
+        if tpm > 0 and _window_tokens(key, now) >= tpm:
+            entries, _ = runtime_state.quota_token_windows[key]
+            return "tpm", max(0.01, entries[0][0] + TPM_WINDOW_SECONDS - now)
+    return None, 0
+
+
+def _try_acquire_quota(user: str, model: str, keys: list, deadline: float, queued: bool, logger=None) -> tuple:
+    """尝试占用配额，调用方需持有 quota_condition。
+
+    返回 (结果, 建议等待秒数)；仍需排队时结果为 None。
+    """
+    exceeded, wait_seconds = _find_exceeded(keys, time.time())
+    if exceeded is None:
+        for key, _, _ in keys:
+            runtime_state.quota_in_flight[key] = runtime_state.quota_in_flight.get(key, 0) + 1
+        runtime_state.quota_stats["admitted"] += 1
+        return {"success": True}, 0
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        runtime_state.quota_stats[f"rejected_{exceeded}"] += 1
+        if logger:
+            logger.warning(f"请求超出配额被拒绝: user={user}, model={model}, type={exceeded}")
+        return {"success": False, "msg": runtime_state.settings.quota_exceed_msg, "error_type": "QUOTA_EXCEEDED"}, 0
+    if not queued:
+        runtime_state.quota_stats["queued"] += 1
+    return None, min(remaining, wait_seconds)
+
+
+def acquire_quota(user: str, model: str, logger=None) -> dict:
+    """占用一个请求配额；超出时按 [quota] queue_timeout_ms 排队等待，超时仍无配额则拒绝。
+
+    返回成功时调用方必须在请求结束后调用 release_quota。
+    """
+    keys = _quota_keys(user, model)
+    deadline = time.monotonic() + max(0, runtime_state.settings.quota_queue_timeout_ms) / 1000
+    queued = False
+    with runtime_state.quota_condition:
+        while True:
+            result, wait_seconds = _try_acquire_quota(user, model, keys, deadline, queued, logger)
+            if result is not None:
+                return result
+            queued = True
+            runtime_state.quota_condition.wait(wait_seconds)
+
+
+async def acquire_quota_async(user: str, model: str, logger=None) -> dict:
+    """acquire_quota 的异步版本，供 ASGI 网关使用：排队时在事件循环中等待，不占用线程池线程。"""
+    loop = asyncio.get_running_loop()
+    keys = _quota_keys(user, model)
+    deadline = time.monotonic() + max(0, runtime_state.settings.quota_queue_timeout_ms) / 1000
+    queued = False
+    while True:
+        waiter = (loop, asyncio.Event())
+        with runtime_state.quota_condition:
+            result, wait_seconds = _try_acquire_quota(user, model, keys, deadline, queued, logger)
+            if result is not None:
+                return result
+            runtime_state.quota_async_waiters.add(waiter)
+        queued = True
+        try:
+            await asyncio.wait_for(waiter[1].wait(), wait_seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with runtime_state.quota_condition:
+                runtime_state.quota_async_waiters.discard(waiter)
+
+
+def release_quota(user: str, model: str):
+    with runtime_state.quota_condition:
+        for key, _, _ in _quota_keys(user, model):
+            count = runtime_state.quota_in_flight.get(key, 0) - 1
+            if count > 0:
+                runtime_state.quota_in_flight[key] = count
+            else:
+                runtime_state.quota_in_flight.pop(key, None)
+        runtime_state.quota_condition.notify_all()
+        async_waiters = list(runtime_state.quota_async_waiters)
+    for loop, event in async_waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+
+def record_quota_tokens(user: str, model: str, tokens: int):
+    """记录已完成请求消耗的 token，计入用户和模型的 TPM 窗口。"""
+    if not tokens:
+        return
+    now = time.time()
+    with runtime_state.quota_condition:
+        for key, _, _ in _quota_keys(user, model):
+            entries, total = runtime_state.quota_token_windows.get(key, (None, 0))
+            if entries is None:
+                entries = deque()
+            entries.append((now, tokens))
+            runtime_state.quota_token_windows[key] = (entries, total + tokens)
+
+
+def get_quota_snapshot() -> dict:
+    settings = runtime_state.settings
+    now = time.time()
+    with runtime_state.quota_condition:
+        tokens_per_minute = {key: _window_tokens(key, now) for key in list(runtime_state.quota_token_windows)}
+        return {
+            "limits": {
+                "user_max_in_flight": settings.quota_user_max_in_flight,
+                "model_max_in_flight": settings.quota_model_max_in_flight,
+                "user_tpm": settings.quota_user_tpm,
+                "model_tpm": settings.quota_model_tpm,
+                "queue_timeout_ms": settings.quota_queue_timeout_ms,
+            },
+            "in_flight": dict(runtime_state.quota_in_flight),
+            "tokens_per_minute": {key: value for key, value in tokens_per_minute.items() if value},
+            **runtime_state.quota_stats,
+        }
@@ -0,0 +1,129 @@
+import time
+from collections import deque
+
+from conf.runtime import runtime_state
+from model.repositories.user_repository import consume_test_limit
+from service.user_context_service import get_cached_user_api_key
+
+
+# 滑动窗口计数条目超过该数量时清理已过期的 key
+WINDOW_SWEEP_THRESHOLD = 4096
+
+
+def _record_stat(name: str):
+    with runtime_state.rate_limit_lock:
+        runtime_state.rate_limit_stats[name] += 1
+
+
+def is_test_key_user(user: str) -> bool:
+    user_api_key = get_cached_user_api_key(user)
+    return (not user_api_key) or (user_api_key == runtime_state.settings.default_api_key)
+
+
+def _take_bucket_token(key: str, now: float) -> bool:
+    """进程内令牌桶，调用方需持有 rate_limit_lock。"""
+    settings = runtime_state.settings
+    burst = settings.rate_limit_test_burst
+    if burst <= 0:
+        return True
+    tokens, updated_at = runtime_state.rate_limit_buckets.get(key, (float(burst), now))
+    tokens = min(float(burst), tokens + (now - updated_at) * settings.rate_limit_test_per_minute / 60)
+    if tokens < 1:
+        runtime_state.rate_limit_buckets[key] = (tokens, now)
+        return False
+    runtime_state.rate_limit_buckets[key] = (tokens - 1, now)
+    return True
+
+
+def _sweep_windows(now: float):
+    for key in [key for key, (hits, seconds) in runtime_state.rate_limit_windows.items() if not hits or hits[-1] <= now - seconds]:
+        runtime_state.rate_limit_windows.pop(key, None)
+
+
+def _check_windows(rules: list, now: float) -> bool:
+    """所有窗口都有余量时才一并计数，某一项超限时整体拒绝且不占用其他窗口的额度。"""
+    with runtime_state.rate_limit_lock:
+        if len(runtime_state.rate_limit_windows) > WINDOW_SWEEP_THRESHOLD:
+            _sweep_windows(now)
+        windows = []
+        for key, (count, seconds) in rules:
+            hits, _ = runtime_state.rate_limit_windows.get(key, (None, seconds))
+            if hits is None:
+                hits = deque()
+            while hits and hits[0] <= now - seconds:
+                hits.popleft()
+            if len(hits) >= count:
+                return False
+            windows.append((key, hits, seconds))
+        for key, hits, seconds in windows:
+            hits.append(now)
+            runtime_state.rate_limit_windows[key] = (hits, seconds)
+    return True
+
+
+def _build_window_rules(user: str, model: str, client_ip: str) -> list:
+    settings = runtime_state.settings
+    rules = []
+    if settings.rate_limit_user_window[0] > 0:
+        rules.append((f"user:{user}", settings.rate_limit_user_window))
+    if settings.rate_limit_ip_window[0] > 0 and client_ip:
+        rules.append((f"ip:{client_ip}", settings.rate_limit_ip_window))
+    if settings.rate_limit_model_window[0] > 0 and model:
+        rules.append((f"model:{model}", settings.rate_limit_model_window))
+    return rules
+
+
+def _consume_test_quota(user: str, now: float) -> dict:
+    settings = runtime_state.settings
+    exceed_error = {"success": False, "msg": settings.test_exceed_msg, "error_type": "TEST_LIMIT_EXCEEDED"}
+    with runtime_state.rate_limit_lock:
+        exhausted_until = runtime_state.test_limit_exhausted.get(user, 0)
+        if exhausted_until > now:
+            runtime_state.rate_limit_stats["cache_rejected"] += 1
+            return exceed_error
+        runtime_state.test_limit_exhausted.pop(user, None)
+        if not _take_bucket_token(user, now):
+            runtime_state.rate_limit_stats["bucket_rejected"] += 1
+            return {"success": False, "msg": settings.rate_limit_exceed_msg, "error_type": "RATE_LIMITED"}
+        runtime_state.rate_limit_stats["db_checks"] += 1
+    if consume_test_limit(user, settings.test_ip_default_limit):
+        return {"success": True}
+    with runtime_state.rate_limit_lock:
+        runtime_state.test_limit_exhausted[user] = now + settings.rate_limit_exhausted_ttl_seconds
+        runtime_state.rate_limit_stats["limit_rejected"] += 1
+    return exceed_error
+
+
+def check_rate_limit(user: str, model: str = "", client_ip: str = "") -> dict:
+    """对话请求限流：先检查可选的滑动窗口，测试用户再经令牌桶和额度缓存后原子占用数据库中的测试额度。"""
+    now = time.time()
+    rules = _build_window_rules(user, model, client_ip)
+    if rules and not _check_windows(rules, now):
+        _record_stat("window_rejected")
+        return {"success": False, "msg": runtime_state.settings.rate_limit_exceed_msg, "error_type": "RATE_LIMITED"}
+    if is_test_key_user(user):
+        result = _consume_test_quota(user, now)
+        if not result["success"]:
+            return result
+    _record_stat("allowed")
+    return {"success": True}
+
+
+def invalidate_test_limit_cache(user_ip: str = None):
+    """后台修改或重置测试限制后清除进程内缓存；不传 user_ip 时全部清除。"""
+    with runtime_state.rate_limit_lock:
+        if user_ip is None:
+            runtime_state.test_limit_exhausted.clear()
+            runtime_state.rate_limit_buckets.clear()
+        else:
+            runtime_state.test_limit_exhausted.pop(user_ip, None)
+            runtime_state.rate_limit_buckets.pop(user_ip, None)
+
+
+def get_rate_limit_snapshot() -> dict:
+    with runtime_state.rate_limit_lock:
+        return {
+            **runtime_state.rate_limit_stats,
+            "exhausted_cached": len(runtime_state.test_limit_exhausted),
+            "window_keys": len(runtime_state.rate_limit_windows),
+        }
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import time
+from typing import Optional
+
+from openai.types.chat import ChatCompletion
+
+from conf.runtime import runtime_state
+from model.repositories.response_cache_repository import get_response_cache, purge_response_cache, set_response_cache
+from service.rate_limit_service import is_test_key_user
+
+
+# 磁盘层每写入多少条清理一次过期与超量记录
+DISK_PURGE_INTERVAL = 100
+
+
+def build_response_cache_key(user: str, payload, api_params: dict) -> Optional[str]:
+    """请求符合缓存条件时返回缓存 key（与用户无关），否则返回 None。"""
+    settings = runtime_state.settings
+    if not settings.response_cache_enabled or payload.dialog_mode != "single" or not payload.system_prompt_id:
+        return None
+    if settings.response_cache_models and payload.model not in settings.response_cache_models:
+        return None
+    if settings.response_cache_prompt_ids and payload.system_prompt_id not in settings.response_cache_prompt_ids:
+        return None
+    if not settings.response_cache_personal_keys and not is_test_key_user(user):
+        with runtime_state.response_cache_lock:
+            runtime_state.response_cache_stats["bypassed"] += 1
+        return None
+    raw = json.dumps(api_params, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _put_memory_entry(cache_key: str, expires_at: int, payload: str):
+    """写入内存 LRU，调用方需持有 response_cache_lock。"""
+    settings = runtime_state.settings
+    stats = runtime_state.response_cache_stats
+    old_entry = runtime_state.response_cache.pop(cache_key, None)
+    if old_entry is not None:
+        stats["bytes"] -= len(old_entry[1])
+    runtime_state.response_cache[cache_key] = (expires_at, payload)
+    stats["bytes"] += len(payload)
+    while stats["bytes"] > settings.response_cache_max_bytes and runtime_state.response_cache:
+        _, (_, evicted) = runtime_state.response_cache.popitem(last=False)
+        stats["bytes"] -= len(evicted)
+        stats["evictions"] += 1
+
+
+def get_cached_response(cache_key: str, logger=None):
+    """依次查询内存与磁盘层，命中时返回 ChatCompletion。"""
+    now_ts = int(time.time())
+    payload = None
+    with runtime_state.response_cache_lock:
+        entry = runtime_state.response_cache.get(cache_key)
+        if entry is not None:
+            if entry[0] > now_ts:
+                runtime_state.response_cache.move_to_end(cache_key)
+                runtime_state.response_cache_stats["hits"] += 1
+                payload = entry[1]
+            else:
+                runtime_state.response_cache.pop(cache_key, None)
+                runtime_state.response_cache_stats["bytes"] -= len(entry[1])
+    if payload is None and runtime_state.settings.response_cache_disk:
+        try:
+            row = get_response_cache(cache_key, now_ts)
+        except Exception as exc:
+            row = None
+            if logger:
+                logger.warning(f"读取响应缓存失败: {exc}")
+        if row is not None:
+            payload, expires_at = row
+            with runtime_state.response_cache_lock:
+                _put_memory_entry(cache_key, expires_at, payload)
+                runtime_state.response_cache_stats["disk_hits"] += 1
+    if payload is None:
+        with runtime_state.response_cache_lock:
+            runtime_state.response_cache_stats["misses"] += 1
+        return None
+    return ChatCompletion.model_validate(json.loads(payload))
+
+
+def store_cached_response(cache_key: str, model: str, result, logger=None):
+    """缓存正常结束的响应；被截断或超过单条上限的响应不缓存。"""
+    settings = runtime_state.settings
+    if not result.choices or result.choices[0].finish_reason != "stop":
+        return
+    payload = json.dumps(result.to_dict())
+    if len(payload) > settings.response_cache_max_entry_bytes:
+        return
+    expires_at = int(time.time()) + settings.response_cache_ttl_seconds
+    with runtime_state.response_cache_lock:
+        _put_memory_entry(cache_key, expires_at, payload)
+        runtime_state.response_cache_stats["stores"] += 1
+        stores = runtime_state.response_cache_stats["stores"]
+    if not settings.response_cache_disk:
+        return
+    try:
+        set_response_cache(cache_key, model, payload, expires_at)
+        if stores % DISK_PURGE_INTERVAL == 0:
+            purge_response_cache(int(time.time()), settings.response_cache_disk_max_entries)
+    except Exception as exc:
+        if logger:
+            logger.warning(f"写入响应缓存失败: {exc}")
+
+
+def get_response_cache_snapshot() -> dict:
+    settings = runtime_state.settings
+    with runtime_state.response_cache_lock:
+        stats = dict(runtime_state.response_cache_stats)
+        entry_count = len(runtime_state.response_cache)
+    lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+    return {
+        "enabled": settings.response_cache_enabled,
+        "entries": entry_count,
+        "capacity_bytes": settings.response_cache_max_bytes,
+        "hit_rate": round((stats["hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0,
+        **stats,
+    }
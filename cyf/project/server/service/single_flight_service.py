@@ -0,0 +1,85 @@
+import hashlib
+import json
+import threading
+import time
+
+from conf.runtime import runtime_state
+
+
+def build_completion_key(user: str, api_params: dict) -> str:
+    """按用户与规范化后的请求参数生成合并 key，参数顺序不影响结果。"""
+    payload = json.dumps(api_params, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{user}\n{payload}".encode("utf-8")).hexdigest()
+
+
+def _get_cached_result(key: str, now: float):
+    entry = runtime_state.deterministic_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, result = entry
+    if expires_at <= now:
+        runtime_state.deterministic_cache.pop(key, None)
+        return None
+    runtime_state.deterministic_cache.move_to_end(key)
+    return result
+
+
+def _store_cached_result(key: str, result, ttl_seconds: int):
+    with runtime_state.single_flight_lock:
+        runtime_state.deterministic_cache[key] = (time.time() + ttl_seconds, result)
+        runtime_state.deterministic_cache.move_to_end(key)
+        while len(runtime_state.deterministic_cache) > max(1, runtime_state.settings.deterministic_cache_max_entries):
+            runtime_state.deterministic_cache.popitem(last=False)
+
+
+def run_single_flight(key: str, func, cacheable: bool = False) -> tuple:
+    """相同 key 的并发调用只执行一次 func，其余调用等待并共享结果或异常，返回 (结果, 是否共享)。
+
+    cacheable 为 True 且配置了 deterministic_cache_ttl_seconds 时，结果在有效期内直接复用。
+    """
+    settings = runtime_state.settings
+    cache_ttl = settings.deterministic_cache_ttl_seconds if cacheable else 0
+    with runtime_state.single_flight_lock:
+        if cache_ttl > 0:
+            result = _get_cached_result(key, time.time())
+            if result is not None:
+                runtime_state.single_flight_stats["cache_hits"] += 1
+                return result, True
+        call = runtime_state.single_flight_calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = {"event": threading.Event(), "result": None, "error": None}
+            runtime_state.single_flight_calls[key] = call
+            runtime_state.single_flight_stats["leaders"] += 1
+        else:
+            runtime_state.single_flight_stats["followers"] += 1
+
+    if not is_leader:
+        # 首个请求受 request_deadline_seconds 约束，等待超时说明其已异常卡住，改为自行请求
+        if call["event"].wait(settings.request_deadline_seconds):
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        return func(), False
+
+    try:
+        call["result"] = func()
+        if cache_ttl > 0:
+            _store_cached_result(key, call["result"], cache_ttl)
+        return call["result"], False
+    except Exception as exc:
+        call["error"] = exc
+        raise
+    finally:
+        with runtime_state.single_flight_lock:
+            runtime_state.single_flight_calls.pop(key, None)
+        call["event"].set()
+
+
+def get_single_flight_snapshot() -> dict:
+    with runtime_state.single_flight_lock:
+        return {
+            **runtime_state.single_flight_stats,
+            "in_flight": len(runtime_state.single_flight_calls),
+            "cache_entries": len(runtime_state.deterministic_cache),
+        }
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import time
+
+
+def build_text_delta_frame(content: str) -> str:
+    return f"data: {json.dumps({'type': 'text_delta', 'content': content, 'done': False})}\n\n"
+
+
+class DeltaCoalescer:
+    """把上游逐 token 的 delta 合并成 SSE 帧，并累积完整回答。
+
+    满足任一条件即输出一帧：待发送内容达到 flush_bytes（按字符数近似），或距上次输出超过 flush_interval_ms。
+    首个 delta 总是立即输出，保证首 token 延迟不受合并影响。
+    """
+
+    def __init__(self, flush_bytes: int, flush_interval_ms: int):
+        self.flush_bytes = max(0, flush_bytes)
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        self.parts = []
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush_at = 0.0
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def seconds_until_flush(self) -> float:
+        """待发送内容距离时间窗口到期的剩余秒数，没有待发送内容时返回 None。"""
+        if not self._pending:
+            return None
+        return max(0.0, self._last_flush_at + self.flush_interval - time.monotonic())
+
+    def feed(self, piece: str):
+        """追加一段 delta，需要输出时返回 SSE 帧，否则返回 None。"""
+        self.parts.append(piece)
+        self._pending.append(piece)
+        self._pending_bytes += len(piece)
+        if self._pending_bytes >= self.flush_bytes or time.monotonic() - self._last_flush_at >= self.flush_interval:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self._pending:
+            return None
+        frame = build_text_delta_frame("".join(self._pending))
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush_at = time.monotonic()
+        return frame
+
+
+async def iter_chunks_with_flush_deadline(chunks, coalescer: DeltaCoalescer):
+    """异步迭代上游分片；合并窗口到期而上游尚无新分片时产出 None，调用方据此 flush。
+
+    同步生成器只能在下一个分片到达时检查时间窗口，异步路径借助超时等待保证窗口内必然输出。
+    """
+    chunk_iter = chunks.__aiter__()
+    next_chunk = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(chunk_iter.__anext__())
+            done, _ = await asyncio.wait({next_chunk}, timeout=coalescer.seconds_until_flush())
+            if not done:
+                yield None
+                continue
+            task, next_chunk = next_chunk, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
@@ -1,20 +1,66 @@
+import itertools
 import json
+import os
+import threading
+import time
 import uuid
+from datetime import datetime, timedelta
 
 from flask import Response
 
 from conf.runtime import runtime_state
-from model.repositories.log_repository import set_dialog, set_log
-from service.chat_service import check_test_user_limit, convert_dialog_for_model, is_valid_model, prepare_dialog
+from model.repositories.log_repository import set_dialog
+from model.repositories.stream_cancel_repository import (
+    delete_stream_cancel,
+    get_cancelled_request_ids,
+    mark_stream_cancelled,
+    purge_stream_cancels,
+    register_stream_cancel,
+)
+from service.chat_service import convert_dialog_for_model, is_valid_model, prepare_dialog
 from service.common_service import generate_sse_error, handle_api_exception
+from service.context_budget_service import apply_context_budget
 from service.dialog_context_service import build_dialog_context_payload, current_time_str, stamp_latest_user_message
-from service.host_service import get_client_for_user
+from service.host_service import (
+    begin_host_request,
+    end_host_request,
+    get_client_for_user,
+    get_current_url_index,
+    get_user_api_key,
+    is_host_failure,
+    is_shared_api_key,
+)
+from service.log_writer_service import record_log
 from service.message_normalizer import build_parts_from_message, ensure_message_parts
+from service.quota_service import acquire_quota, record_quota_tokens, release_quota
+from service.rate_limit_service import check_rate_limit
+from service.stream_pipeline import DeltaCoalescer
+from service.token_counter import count_message_tokens, count_text_tokens
 
 
-def register_stream_request(request_id: str):
+# sqlite 取消登记超过该时长仍未清理（进程崩溃等）时视为残留
+STREAM_CANCEL_RETENTION = timedelta(hours=1)
+
+
+def is_shared_cancel_backend() -> bool:
+    return runtime_state.settings.stream_cancel_backend == "sqlite"
+
+
+def register_stream_request(request_id: str, logger=None) -> threading.Event:
+    """登记流式请求，返回取消标记；生成器逐块检查该标记，无需再获取全局锁。"""
+    cancel_flag = threading.Event()
     with runtime_state.stream_cancel_lock:
-        runtime_state.stream_cancel_registry[request_id] = {"cancelled": False, "stream": None}
+        runtime_state.stream_cancel_registry[request_id] = {"cancel_flag": cancel_flag, "stream": None}
+    if is_shared_cancel_backend():
+        if runtime_state.stream_cancel_poller_pid != os.getpid():
+            start_stream_cancel_poller(logger)
+        try:
+            register_stream_cancel(request_id)
+        except Exception as exc:
+            # 登记失败只影响跨进程取消，本进程内取消仍然有效
+            if logger:
+                logger.warning(f"流式取消登记写入失败，request_id={request_id}, err={exc}")
+    return cancel_flag
 
 
 def set_stream_object(request_id: str, stream_obj):
@@ -26,16 +72,16 @@ def set_stream_object(request_id: str, stream_obj):
 def is_stream_cancelled(request_id: str) -> bool:
     with runtime_state.stream_cancel_lock:
         entry = runtime_state.stream_cancel_registry.get(request_id)
-        return bool(entry and entry.get("cancelled"))
+        return bool(entry and entry["cancel_flag"].is_set())
 
 
-def cancel_stream_request(request_id: str) -> bool:
+def cancel_local_stream_request(request_id: str) -> bool:
     stream_obj = None
     with runtime_state.stream_cancel_lock:
         entry = runtime_state.stream_cancel_registry.get(request_id)
         if not entry:
             return False
-        entry["cancelled"] = True
+        entry["cancel_flag"].set()
         stream_obj = entry.get("stream")
     if stream_obj is not None:
         try:
@@ -45,9 +91,64 @@ def cancel_stream_request(request_id: str) -> bool:
     return True
 
 
+def cancel_stream_request(request_id: str) -> bool:
+    if cancel_local_stream_request(request_id):
+        return True
+    # 流不在本进程时写入共享登记，由所在进程的轮询线程取消
+    return is_shared_cancel_backend() and mark_stream_cancelled(request_id)
+
+
 def cleanup_stream_request(request_id: str):
     with runtime_state.stream_cancel_lock:
         runtime_state.stream_cancel_registry.pop(request_id, None)
+    if is_shared_cancel_backend():
+        try:
+            delete_stream_cancel(request_id)
+        except Exception:
+            pass
+
+
+def poll_shared_stream_cancels() -> int:
+    with runtime_state.stream_cancel_lock:
+        request_ids = [rid for rid, entry in runtime_state.stream_cancel_registry.items() if not entry["cancel_flag"].is_set()]
+    if not request_ids:
+        return 0
+    cancelled_ids = get_cancelled_request_ids(request_ids)
+    for request_id in cancelled_ids:
+        cancel_local_stream_request(request_id)
+    return len(cancelled_ids)
+
+
+def stream_cancel_poll_worker(logger):
+    interval = max(50, runtime_state.settings.stream_cancel_poll_interval_ms) / 1000
+    last_purge_at = 0.0
+    while True:
+        time.sleep(interval)
+        try:
+            cancelled_count = poll_shared_stream_cancels()
+            if cancelled_count and logger:
+                logger.info(f"跨进程取消流式请求 {cancelled_count} 个")
+            if time.time() - last_purge_at > STREAM_CANCEL_RETENTION.total_seconds():
+                last_purge_at = time.time()
+                purge_stream_cancels(datetime.now() - STREAM_CANCEL_RETENTION)
+        except Exception as exc:
+            if logger:
+                logger.error(f"流式取消轮询失败: {exc}")
+
+
+def start_stream_cancel_poller(logger):
+    """为当前进程启动取消轮询线程；uwsgi fork 出的 worker 在首次登记流式请求时重新创建。"""
+    if not is_shared_cancel_backend():
+        return None
+    with runtime_state.stream_cancel_lock:
+        if runtime_state.stream_cancel_poller_pid == os.getpid() and runtime_state.stream_cancel_poller is not None:
+            return runtime_state.stream_cancel_poller
+        thread = threading.Thread(target=stream_cancel_poll_worker, args=(logger,), daemon=True)
+        thread.name = "stream-cancel-poller"
+        runtime_state.stream_cancel_poller = thread
+        runtime_state.stream_cancel_poller_pid = os.getpid()
+    thread.start()
+    return thread
 
 
 def build_stream_response(generator):
@@ -58,74 +159,194 @@ def build_stream_response(generator):
     )
 
 
-def stream_chat(user: str, payload, logger):
+def open_chat_stream_with_failover(user: str, api_params: dict, request_id: str, logger) -> tuple:
+    """打开上游流并读到首个 token；首 token 之前的 host 失败会换 host 重试。
+
+    返回 (chunks, url_index, host_started_at)，chunks 已包含预读的分片。
+    """
+    settings = runtime_state.settings
+    deadline = time.time() + settings.request_deadline_seconds
+    shared_key = is_shared_api_key(get_user_api_key(user))
+    tried_indices = []
+    last_exc = None
+    for attempt in range(max(1, settings.failover_max_attempts)):
+        if time.time() >= deadline:
+            break
+        client, url_index = get_client_for_user(user, exclude_indices=tried_indices)
+        tried_indices.append(url_index)
+        host_started_at = begin_host_request(url_index)
+        stream = None
+        try:
+            stream = client.with_options(max_retries=0).chat.completions.create(**api_params)
+            set_stream_object(request_id, stream)
+            chunk_iter = iter(stream)
+            prefetched = []
+            for chunk in chunk_iter:
+                prefetched.append(chunk)
+                if chunk.choices and (chunk.choices[0].delta.content or chunk.choices[0].finish_reason):
+                    break
+            return itertools.chain(prefetched, chunk_iter), url_index, host_started_at
+        except Exception as exc:
+            end_host_request(url_index, host_started_at, exc=exc, logger=logger, shared_key=shared_key)
+            if stream is not None:
+                # 预读首个分片时失败的流要先关闭，避免连接泄漏到下一次重试
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            if not is_host_failure(exc) or is_stream_cancelled(request_id):
+                raise
+            last_exc = exc
+            logger.warning(f"上游流式请求失败（第 {attempt + 1} 次，host={settings.api_hosts[url_index]}），准备换 host 重试: {exc}")
+    raise last_exc or TimeoutError(f"上游流式请求超过 {settings.request_deadline_seconds} 秒仍未开始")
+
+
+def build_stream_api_params(user: str, model: str, dialogvo: list, title: str, payload, logger) -> dict:
+    budget_messages, max_tokens = apply_context_budget(user, model, dialogvo, title, payload.max_response_tokens, logger)
+    api_params = {
+        "model": model,
+        "messages": convert_dialog_for_model(budget_messages, model, logger=logger),
+        "max_tokens": max_tokens,
+        "stream": True,
+        "timeout": 300,
+    }
+    if payload.temperature is not None:
+        api_params["temperature"] = payload.temperature
+    if runtime_state.settings.stream_include_usage:
+        api_params["stream_options"] = {"include_usage": True}
+    return api_params
+
+
+def resolve_stream_usage(usage, messages: list, full_content: str, model: str) -> tuple:
+    """返回 (prompt_tokens, completion_tokens)；上游未返回 usage 时用本地 tokenizer 估算。"""
+    if usage is not None and usage.total_tokens:
+        return usage.prompt_tokens or 0, usage.completion_tokens or 0
+    return count_message_tokens(messages, model), count_text_tokens(full_content, model)
+
+
+def prepare_stream_chat(user: str, payload, logger, client_ip: str = "") -> tuple:
+    """流式对话前置校验，返回 (错误事件生成器, dialogvo, title)，校验通过时错误事件为 None。"""
+    limit_error = check_rate_limit(user, payload.model, client_ip)
+    if not limit_error["success"]:
+        error_type = "TEST_EXCEED" if limit_error["error_type"] == "TEST_LIMIT_EXCEEDED" else limit_error["error_type"]
+        return generate_sse_error(limit_error["msg"], error_type), None, None
+    if not is_valid_model(payload.model):
+        return generate_sse_error("not supported user or model", "MODEL_ERROR"), None, None
+    dialogvo, title = prepare_dialog(payload.dialog, payload.dialog_mode, payload.dialog_title, payload.system_prompt_id, logger)
+    if dialogvo is None:
+        return generate_sse_error(title, "DIALOG_MODE_ERROR"), None, None
+    return None, dialogvo, title
+
+
+def finish_stream_chat(
+    user: str, payload, dialogvo: list, title: str, full_content: str, finish_reason, api_params: dict, usage=None
+) -> str:
+    """记录日志与对话，返回 done 事件。"""
+    model = payload.model
+    prompt_tokens, completion_tokens = resolve_stream_usage(usage, api_params["messages"], full_content, model)
+    record_quota_tokens(user, model, prompt_tokens + completion_tokens)
+    record_log(
+        user,
+        prompt_tokens + completion_tokens,
+        model,
+        json.dumps({"content": full_content}),
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+    )
+    request_messages = stamp_latest_user_message(dialogvo)
+    assistant_time = current_time_str()
+    assistant_message = {"role": "assistant", "content": full_content, "time": assistant_time}
+    # 归一化为统一 MessagePart 协议
+    assistant_message = ensure_message_parts(assistant_message)
+    dialog_id = set_dialog(
+        user,
+        model,
+        "chat",
+        title,
+        build_dialog_context_payload([], payload.role_setting),
+        messages=request_messages + [assistant_message],
+    )
+    return f"data: {json.dumps({'type': 'done', 'content': '', 'done': True, 'finish_reason': finish_reason, 'dialog_id': dialog_id, 'time': assistant_time})}\n\n"
+
+
+def stream_chat(user: str, payload, logger, client_ip: str = ""):
     request_id = payload.request_id or uuid.uuid4().hex
     model = payload.model
-    limit_error = check_test_user_limit(user)
-    if not limit_error["success"]:
-        return build_stream_response(generate_sse_error(limit_error["msg"], "TEST_EXCEED"))
-    if not is_valid_model(model):
-        return build_stream_response(generate_sse_error("not supported user or model", "MODEL_ERROR"))
+    error_events, dialogvo, title = prepare_stream_chat(user, payload, logger, client_ip)
+    if error_events is not None:
+        return build_stream_response(error_events)
     dialogs = payload.dialog
-    dialogvo, title = prepare_dialog(dialogs, payload.dialog_mode, payload.dialog_title, payload.system_prompt_id, logger)
-    if dialogvo is None:
-        return build_stream_response(generate_sse_error(title, "DIALOG_MODE_ERROR"))
-    register_stream_request(request_id)
+    cancel_flag = register_stream_request(request_id, logger)
 
     def generate():
-        full_content = ""
+        coalescer = DeltaCoalescer(runtime_state.settings.stream_flush_bytes, runtime_state.settings.stream_flush_interval_ms)
         was_cancelled = False
+        url_index = None
+        host_started_at = None
+        first_token_ms = None
+        quota_acquired = False
+        shared_key = True
         try:
-            if is_stream_cancelled(request_id):
+            if cancel_flag.is_set():
                 return
-            api_params = {
-                "model": model,
-                "messages": convert_dialog_for_model(dialogvo, model, logger=logger),
-                "max_tokens": payload.max_response_tokens or 102400,
-                "stream": True,
-                "timeout": 300,
-            }
-            client, url_index = get_client_for_user(user)
-            stream = client.chat.completions.create(**api_params)
-            set_stream_object(request_id, stream)
+            shared_key = is_shared_api_key(get_user_api_key(user))
+            # 在生成器内占用配额，客户端未开始读取就断开时不会遗留计数
+            quota_error = acquire_quota(user, model, logger)
+            if not quota_error["success"]:
+                yield from generate_sse_error(quota_error["msg"], quota_error["error_type"])
+                return
+            quota_acquired = True
+            api_params = build_stream_api_params(user, model, dialogvo, title, payload, logger)
+            chunks, url_index, host_started_at = open_chat_stream_with_failover(user, api_params, request_id, logger)
             finish_reason = None
-            for chunk in stream:
-                if is_stream_cancelled(request_id):
+            usage = None
+            for chunk in chunks:
+                if cancel_flag.is_set():
                     was_cancelled = True
-                    try:
-                        stream.close()
-                    except Exception:
-                        pass
+                    cancel_local_stream_request(request_id)
                     break
                 if chunk.choices:
                     delta = chunk.choices[0].delta
                     if delta.content:
-                        content_piece = delta.content
-                        full_content += content_piece
-                        yield f"data: {json.dumps({'type': 'text_delta', 'content': content_piece, 'done': False})}\n\n"
+                        if first_token_ms is None:
+                            first_token_ms = (time.time() - host_started_at) * 1000
+                        # 同步生成器只能在下一个分片到达时输出，合并窗口内的尾部内容会等到下一分片或结束
+                        frame = coalescer.feed(delta.content)
+                        if frame:
+                            yield frame
                     if chunk.choices[0].finish_reason:
                         finish_reason = chunk.choices[0].finish_reason
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+            # 流式请求以首 token 延迟计入 host 延迟，避免长回答拉高 EWMA；没有输出内容时不计入
+            end_host_request(
+                url_index, host_started_at, latency_ms=first_token_ms, logger=logger, record_latency=first_token_ms is not None
+            )
+            host_started_at = None
             if was_cancelled:
                 return
-            tokens_used = len(full_content.encode("utf-8")) // 4
-            set_log(user, tokens_used, model, json.dumps({"content": full_content}))
-            request_messages = stamp_latest_user_message(dialogvo)
-            assistant_time = current_time_str()
-            assistant_message = {"role": "assistant", "content": full_content, "time": assistant_time}
-            # 归一化为统一 MessagePart 协议
-            assistant_message = ensure_message_parts(assistant_message)
-            dialog_id = set_dialog(
-                user,
-                model,
-                "chat",
-                title,
-                build_dialog_context_payload(request_messages + [assistant_message], payload.role_setting),
-            )
-            yield f"data: {json.dumps({'type': 'done', 'content': '', 'done': True, 'finish_reason': finish_reason, 'dialog_id': dialog_id, 'time': assistant_time})}\n\n"
+            frame = coalescer.flush()
+            if frame:
+                yield frame
+            yield finish_stream_chat(user, payload, dialogvo, title, coalescer.content, finish_reason, api_params, usage)
         except Exception as api_exc:
-            error_response = handle_api_exception(api_exc, logger, user=user, model=model, dialog_content=dialogs, url_index=url_index)
+            if cancel_flag.is_set():
+                # 取消时关闭上游连接引发的异常属于正常结束，不计入 host 失败也不返回错误
+                return
+            if host_started_at is not None:
+                end_host_request(url_index, host_started_at, exc=api_exc, logger=logger, shared_key=shared_key)
+                host_started_at = None
+            error_response = handle_api_exception(
+                api_exc, logger, user=user, model=model, dialog_content=dialogs, url_index=get_current_url_index()
+            )
             yield f"data: {json.dumps({'content': error_response.get('msg', 'API请求失败'), 'done': True, 'error': error_response})}\n\n"
         finally:
+            if host_started_at is not None:
+                end_host_request(
+                    url_index, host_started_at, latency_ms=first_token_ms, logger=logger, record_latency=first_token_ms is not None
+                )
+            if quota_acquired:
+                release_quota(user, model)
             cleanup_stream_request(request_id)
 
     return build_stream_response(generate())
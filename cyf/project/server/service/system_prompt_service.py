@@ -1,9 +1,54 @@
-from model.repositories.model_meta_repository import get_system_prompt_by_id, get_system_prompts_by_group
+import hashlib
+import json
+import time
+
+from conf.runtime import runtime_state
+from model.repositories.model_meta_repository import get_system_prompt_list
+
+
+def _load_system_prompt_cache() -> dict:
+    by_id = {}
+    groups = {}
+    for prompt in sorted(get_system_prompt_list(status_valid=True), key=lambda item: item["id"]):
+        by_id[prompt["id"]] = {
+            "id": prompt["id"],
+            "role_name": prompt["role_name"],
+            "role_desc": prompt["role_desc"],
+            "role_content": prompt["role_content"],
+        }
+        groups.setdefault(prompt["role_group"], []).append(
+            {"id": prompt["id"], "role_name": prompt["role_name"], "role_desc": prompt["role_desc"]}
+        )
+    # 版本号取内容摘要，各进程数据相同时 ETag 一致
+    raw = json.dumps([list(by_id.values()), groups], ensure_ascii=False, sort_keys=True)
+    return {
+        "by_id": by_id,
+        "groups": groups,
+        "version": hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32],
+        "expires_at": time.time() + runtime_state.settings.system_prompt_cache_ttl_seconds,
+    }
+
+
+def get_system_prompt_cache() -> dict:
+    """返回有效系统提示词缓存，过期或失效后重新加载。"""
+    with runtime_state.system_prompt_lock:
+        cache = runtime_state.system_prompt_cache
+        if not cache or cache["expires_at"] <= time.time():
+            cache = _load_system_prompt_cache()
+            runtime_state.system_prompt_cache = cache
+        return cache
+
+
+def invalidate_system_prompt_cache():
+    with runtime_state.system_prompt_lock:
+        runtime_state.system_prompt_cache = {}
 
 
 def fetch_system_prompt(prompt_id: int):
-    return get_system_prompt_by_id(prompt_id)
+    return get_system_prompt_cache()["by_id"].get(int(prompt_id))
 
 
-def fetch_system_prompts_grouped():
-    return get_system_prompts_by_group()
+def fetch_system_prompts_grouped() -> tuple:
+    """返回 (按组分类的系统提示词, 版本号)。"""
+    cache = get_system_prompt_cache()
+    return cache["groups"], cache["version"]
@@ -0,0 +1,75 @@
+import math
+import re
+
+from conf.runtime import runtime_state
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# 上游未返回 usage 时的本地估算：优先 tiktoken，按模型族缓存编码器；未安装或加载失败时按字符启发式估算
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+# 每条消息的格式开销与单张图片的估算值（低清晰度图片的固定计费）
+MESSAGE_OVERHEAD_TOKENS = 3
+IMAGE_PART_TOKENS = 85
+
+
+def get_encoding_name(model: str) -> str:
+    name = (model or "").lower()
+    if name.startswith(("gpt-4", "gpt-3.5")) and not name.startswith(("gpt-4o", "gpt-4.1")):
+        return "cl100k_base"
+    # 新一代 OpenAI 模型使用 o200k_base；其他厂商模型没有公开编码，同样以 o200k_base 近似
+    return "o200k_base"
+
+
+def get_encoder(model: str):
+    if tiktoken is None:
+        return None
+    encoding_name = get_encoding_name(model)
+    with runtime_state.token_encoder_lock:
+        if encoding_name in runtime_state.token_encoders:
+            return runtime_state.token_encoders[encoding_name]
+    try:
+        encoder = tiktoken.get_encoding(encoding_name)
+    except Exception:
+        # 编码文件需要联网下载，失败后本进程内不再重试，改用启发式估算
+        encoder = None
+    with runtime_state.token_encoder_lock:
+        runtime_state.token_encoders[encoding_name] = encoder
+    return encoder
+
+
+def estimate_text_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+
+def count_text_tokens(text: str, model: str = "") -> int:
+    if not text:
+        return 0
+    encoder = get_encoder(model)
+    if encoder is None:
+        return estimate_text_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list, model: str = "") -> int:
+    total = 0
+    for message in messages or []:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            total += count_text_tokens(content, model)
+        elif isinstance(content, list):
+            for part in content:
+                if not isinstance(part, dict):
+                    continue
+                if part.get("type") == "text":
+                    total += count_text_tokens(part.get("text", ""), model)
+                elif part.get("type") == "image_url":
+                    total += IMAGE_PART_TOKENS
+    return total
@@ -0,0 +1,132 @@
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+from conf.runtime import runtime_state
+
+
+UPLOAD_URL_PREFIX = "/download/"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# multipart 边界与表单头的余量，请求体超过 上限 + 余量 时不再解析
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
+# 对外文件名中保留的内容哈希长度与原始文件名最大长度
+UPLOAD_HASH_PREFIX_LENGTH = 16
+UPLOAD_NAME_MAX_LENGTH = 100
+
+
+def resolve_local_upload_path(url: str) -> Optional[str]:
+    """识别本服务上传接口返回的 :<port>/download/<文件名> 链接，返回 upload_dir 中对应的本地路径。
+
+    只接受不含目录成分的文件名，文件不存在时返回 None，由调用方回退到 HTTP 下载。
+    """
+    settings = runtime_state.settings
+    if not url or not settings.upload_dir:
+        return None
+    try:
+        parsed = urlparse(url)
+        port = parsed.port
+    except ValueError:
+        return None
+    if port != settings.upload_url_port or not parsed.path.startswith(UPLOAD_URL_PREFIX):
+        return None
+    if settings.upload_url_hosts and (parsed.hostname or "").lower() not in settings.upload_url_hosts:
+        return None
+    filename = unquote(parsed.path[len(UPLOAD_URL_PREFIX):])
+    if not filename or filename != os.path.basename(filename) or filename in (".", ".."):
+        return None
+    local_path = os.path.join(settings.upload_dir, filename)
+    return local_path if os.path.isfile(local_path) else None
+
+
+def read_upload_file(local_path: str) -> bytes:
+    with open(local_path, "rb") as file_obj:
+        return file_obj.read()
+
+
+def guess_upload_content_type(local_path: str) -> str:
+    return mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+
+
+def get_upload_file_validator(local_path: str) -> str:
+    # 本地文件以 大小 + 修改时间 作为缓存校验值，相当于 HTTP 的 ETag
+    stat_result = os.stat(local_path)
+    return f"local:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+
+
+def get_upload_extension(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,10}", ext) else ""
+
+
+def is_upload_request_too_large(content_length: Optional[int]) -> bool:
+    return bool(content_length) and content_length > runtime_state.settings.upload_max_bytes + UPLOAD_MULTIPART_OVERHEAD
+
+
+def get_upload_display_name(filename: str) -> str:
+    """保留原始文件名供前端展示，去掉目录成分和会破坏链接的字符。"""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    name = re.sub(r"[\s/?#%&]+", "_", name)
+    if len(name) > UPLOAD_NAME_MAX_LENGTH:
+        ext = get_upload_extension(name)
+        name = name[: UPLOAD_NAME_MAX_LENGTH - len(ext)] + ext
+    return name if name not in ("", ".", "..") else "file"
+
+
+def build_upload_url(filename: str) -> str:
+    return f":{runtime_state.settings.upload_url_port}{UPLOAD_URL_PREFIX}{filename}"
+
+
+def save_upload_file(file_storage, logger=None) -> tuple[bool, str, str]:
+    """逐块复制到临时文件并计算 SHA-256，超过大小上限即中止。
+
+    内容按 <sha256><扩展名> 保存一份，对外文件名为 <哈希前缀>-<原始文件名>，以硬链接指向同一内容，
+    重复上传不再占用额外空间。返回 (是否成功, 错误信息, 文件名)。
+    """
+    settings = runtime_state.settings
+    ext = get_upload_extension(file_storage.filename)
+    hasher = hashlib.sha256()
+    total_bytes = 0
+    fd, temp_path = tempfile.mkstemp(prefix=".upload-", dir=settings.upload_dir)
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total_bytes += len(chunk)
+                if total_bytes > settings.upload_max_bytes:
+                    return False, f"more than {settings.upload_max_bytes // (1024 * 1024)}M", ""
+                hasher.update(chunk)
+                temp_file.write(chunk)
+        if total_bytes == 0:
+            return False, "empty file", ""
+        digest = hasher.hexdigest()
+        blob_path = os.path.join(settings.upload_dir, digest + ext)
+        if os.path.exists(blob_path):
+            if logger:
+                logger.info(f"上传文件内容重复，复用已有文件: {digest + ext}")
+        else:
+            os.chmod(temp_path, 0o755)
+            # 同内容并发上传时 replace 为原子操作，最终只保留一份
+            os.replace(temp_path, blob_path)
+            temp_path = None
+        filename = f"{digest[:UPLOAD_HASH_PREFIX_LENGTH]}-{get_upload_display_name(file_storage.filename)}"
+        link_path = os.path.join(settings.upload_dir, filename)
+        if not os.path.exists(link_path):
+            try:
+                os.link(blob_path, link_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # 文件系统不支持硬链接时退回复制
+                shutil.copyfile(blob_path, link_path)
+                os.chmod(link_path, 0o755)
+        return True, "", filename
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
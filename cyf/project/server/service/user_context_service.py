@@ -0,0 +1,68 @@
+import time
+from typing import Optional
+
+from flask import g, has_app_context
+
+from conf.runtime import runtime_state
+from model.repositories.user_repository import get_user_by_username
+
+
+def _request_contexts() -> Optional[dict]:
+    # 流式响应的生成器在请求上下文结束后执行，此时只走进程缓存
+    if not has_app_context():
+        return None
+    if "user_contexts" not in g:
+        g.user_contexts = {}
+    return g.user_contexts
+
+
+def remember_user_context(user) -> dict:
+    context = {"username": user.username, "api_key": user.api_key, "role": user.role, "is_active": user.is_active}
+    ttl = runtime_state.settings.user_context_ttl_seconds
+    if ttl > 0:
+        with runtime_state.user_context_lock:
+            runtime_state.user_context_cache[user.username] = {"context": context, "cached_until": time.time() + ttl}
+    request_contexts = _request_contexts()
+    if request_contexts is not None:
+        request_contexts[user.username] = context
+    return context
+
+
+def get_user_context(username: str) -> Optional[dict]:
+    if not username:
+        return None
+    request_contexts = _request_contexts()
+    if request_contexts is not None and username in request_contexts:
+        return request_contexts[username]
+    with runtime_state.user_context_lock:
+        entry = runtime_state.user_context_cache.get(username)
+        if entry and entry["cached_until"] <= time.time():
+            runtime_state.user_context_cache.pop(username, None)
+            entry = None
+    if entry:
+        if request_contexts is not None:
+            request_contexts[username] = entry["context"]
+        return entry["context"]
+    user = get_user_by_username(username)
+    if not user:
+        return None
+    return remember_user_context(user)
+
+
+def get_cached_user_api_key(username: str) -> Optional[str]:
+    context = get_user_context(username)
+    return context["api_key"] if context else None
+
+
+def invalidate_user_context(username: str = None):
+    with runtime_state.user_context_lock:
+        if username is None:
+            runtime_state.user_context_cache.clear()
+        else:
+            runtime_state.user_context_cache.pop(username, None)
+    request_contexts = _request_contexts()
+    if request_contexts is not None:
+        if username is None:
+            request_contexts.clear()
+        else:
+            request_contexts.pop(username, None)
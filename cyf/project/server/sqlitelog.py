@@ -1,10 +1,14 @@
 from model.db import db, init_db as _init_db
-from model.entities import ALL_MODELS, Dialog, Log, ModelMeta, Notification, SystemPrompt, TestLimit, User
+from model.entities import ALL_MODELS, Dialog, DialogMessage, Log, ModelMeta, Notification, StreamCancel, SystemPrompt, TestLimit, User
 from model.repositories.log_repository import (
+    append_dialog_messages,
     delete_dialogs,
     get_dialog_context,
     get_dialog_list,
+    get_dialog_messages,
+    get_dialog_summary,
     set_dialog,
+    set_dialog_summary,
     set_log,
     update_dialog_title,
 )
@@ -15,7 +19,10 @@ from model.repositories.model_meta_repository import (
     get_system_prompts_by_group,
 )
 from model.repositories.user_repository import (
+    backfill_user_token_hashes,
     check_test_limit_exceeded,
+    clear_user_token_fields,
+    consume_test_limit,
     create_notification,
     create_user,
     delete_notification,
@@ -30,6 +37,7 @@ from model.repositories.user_repository import (
     get_user_browser_conf,
     get_user_by_username,
     get_user_token_payload,
+    hash_token,
     increment_test_limit,
     message_query,
     reset_user_password,
@@ -42,4 +50,4 @@ from model.repositories.user_repository import (
 
 
 def init_db():
-    _init_db(ALL_MODELS, User, ModelMeta)
+    _init_db(ALL_MODELS, User, ModelMeta, Log, Dialog)